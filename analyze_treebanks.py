@@ -7,6 +7,7 @@ from src.file_processor import FileProcessor
 from src.sentence_cleaner import SentenceCleaner
 from src.load_treebank import TreebankLoader
 from src.file_dumper import FileDumper
+from src.utils.decorators import set_copy_free
 from src.utils.fileutils import load_ndjson
 from src.utils.processor_factories import treebank_analyzer_factory
 
@@ -89,6 +90,26 @@ def parse_args():
         help="Mask all words in the treebank. Token forms and lemma will be represented only by original token index.",
     )
 
+    optional.add_argument(
+        "--cache_dir",
+        type=Path,
+        default=None,
+        help="Directory in which to cache loaded treebanks for faster reloading",
+    )
+
+    optional.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes with which to load treebanks when globbing a directory",
+    )
+
+    optional.add_argument(
+        "--copy_free",
+        action="store_true",
+        help="Copy each sentence once when it is loaded and process it in place afterwards",
+    )
+
     optional.add_argument(
         "--min_len",
         type=int,
@@ -150,6 +171,9 @@ def main():
     # Set random seed
     random.seed(args.random_seed)
 
+    # Sentences are processed in place by each stage rather than copied
+    set_copy_free(args.copy_free)
+
     # Loads the remove config (for removing tokens of given type) or ignores
     if args.remove_config:
         remove_config = load_ndjson(args.remove_config)
@@ -164,6 +188,8 @@ def main():
         cleaner=cleaner,
         min_len=args.min_len,
         max_len=args.max_len,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
     )
 
     # Make treebank analyzer
@@ -0,0 +1,70 @@
+import argparse
+import sys
+from pathlib import Path
+import logging
+
+from src.columnar_corpus import ColumnarCorpusWriter
+from src.load_treebank import TreebankLoader
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    required = parser.add_argument_group("required arguments")
+    optional = parser.add_argument_group("optional arguments")
+
+    required.add_argument(
+        "--directory",
+        type=Path,
+        required=True,
+        help="Directory from which to find treebanks by globbing",
+    )
+
+    required.add_argument(
+        "--outdir",
+        type=Path,
+        required=True,
+        help="The directory to write the columnar corpus to",
+    )
+
+    optional.add_argument(
+        "--glob_pattern",
+        type=str,
+        default="*",
+        help="glob pattern for recursively finding files that match the pattern",
+    )
+
+    optional.add_argument(
+        "--verbosity",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="WARNING",
+        help="Set the logging verbosity level (default: INFO)",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # Set logging level according to verbosity
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(message)s", level=args.verbosity
+    )
+
+    # Make loader. Sentences are stored uncleaned; cleaning is done when the corpus is read
+    loader = TreebankLoader(min_len=1, max_len=sys.maxsize, compact=True)
+
+    writer = ColumnarCorpusWriter(args.outdir)
+
+    for infile in sorted(loader.glob_treebanks(args.directory, args.glob_pattern)):
+        logging.info(f"Processing file: {infile}")
+        writer.add_file(infile, loader.iter_load_treebank(infile))
+
+    writer.write()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+from pathlib import Path
+import logging
+
+from src.load_treebank import TreebankLoader
+from src.inverted_index import InvertedIndex
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    required = parser.add_argument_group("required arguments")
+    optional = parser.add_argument_group("optional arguments")
+
+    treebank_source = required.add_mutually_exclusive_group()
+
+    treebank_source.add_argument(
+        "--treebank", type=Path, help="Treebank to index"
+    )
+
+    treebank_source.add_argument(
+        "--directory",
+        type=Path,
+        help="Directory from which to find treebanks by globbing",
+    )
+
+    optional.add_argument(
+        "--glob_pattern",
+        type=str,
+        default="*",
+        help="glob pattern for recursively finding files that match the pattern",
+    )
+
+    optional.add_argument(
+        "--verbosity",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+        default="WARNING",
+        help="Set the logging verbosity level (default: INFO)",
+    )
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # Set logging level according to verbosity
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(message)s", level=args.verbosity
+    )
+
+    if args.treebank:
+        infiles = [args.treebank]
+    elif args.directory:
+        infiles = TreebankLoader.glob_treebanks(args.directory, args.glob_pattern)
+    else:
+        raise ValueError("Either --treebank or --directory must be given.")
+
+    # Indices are written next to each treebank as <treebank>.postings
+    for infile in infiles:
+        index = InvertedIndex.build(infile)
+        index.save(InvertedIndex.index_path(infile))
+        logging.info(f"Indexed {len(index.keys)} field values in {len(index)} sentences of {infile}")
+
+
+if __name__ == "__main__":
+    main()
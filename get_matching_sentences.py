@@ -4,11 +4,15 @@ import random
 from pathlib import Path
 import logging
 
-from src.file_processor import FileProcessor
+from src.file_processor import (
+    FileProcessor,
+    QueryBatchFileProcessor,
+    ByteRangeFileProcessor,
+)
 from src.sentence_cleaner import SentenceCleaner
 from src.file_dumper import FileDumper
 from src.load_treebank import TreebankLoader
-from src.sentence_selector import SentenceSelector
+from src.sentence_selector import SentenceSelector, MultiQuerySelector
 from src.sentence_permuter import (
     RandomProjectivePermuter,
     RandomSameValencyPermuter,
@@ -18,6 +22,7 @@ from src.sentence_permuter import (
     SentencePermuter,
 )
 from src.treebank_processor import TreebankPermuter
+from src.utils.decorators import set_copy_free
 from src.utils.fileutils import load_ndjson
 from src.utils.processor_factories import (
     sentence_permuter_factory,
@@ -74,10 +79,20 @@ def parse_args():
         help="ndjson format list of token properties to exclude",
     )
 
-    optional.add_argument(
+    query_source = optional.add_mutually_exclusive_group()
+
+    query_source.add_argument(
         "--query", type=Path, default=None, help="json format token query"
     )
 
+    query_source.add_argument(
+        "--queries",
+        type=Path,
+        default=None,
+        help="ndjson format list of token queries, all matched in one pass. The matches of each query "
+        "are written under a directory named by the query's optional \"name\" key, or query_<n>",
+    )
+
     optional.add_argument(
         "--fields_to_remove",
         type=str,
@@ -86,6 +101,42 @@ def parse_args():
         help="Masks any fields in a conllu that are not necessary; can save some space",
     )
 
+    optional.add_argument(
+        "--cache_dir",
+        type=Path,
+        default=None,
+        help="Directory in which to cache loaded treebanks for faster reloading",
+    )
+
+    optional.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes with which to load treebanks when globbing a directory",
+    )
+
+    optional.add_argument(
+        "--chunk_size",
+        type=int,
+        default=None,
+        help="With several workers, number of sentences of an uncompressed treebank to match per task. "
+        "This builds a sentence index next to each treebank (<treebank>.idx) if it has none. "
+        "By default, each treebank is matched in a single task",
+    )
+
+    optional.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Stop once this many matching sentences have been found, across all treebanks",
+    )
+
+    optional.add_argument(
+        "--copy_free",
+        action="store_true",
+        help="Copy each sentence once when it is loaded and process it in place afterwards",
+    )
+
     optional.add_argument(
         "--min_len",
         type=int,
@@ -106,6 +157,18 @@ def parse_args():
         help="Mask all words in the treebank. Token forms and lemma will be represented only by original token index.",
     )
 
+    optional.add_argument(
+        "--use_index",
+        action="store_true",
+        help="Only parse the sentences that the inverted index of each treebank shows can match the query. "
+        "Indices are built where missing (see build_inverted_index.py)",
+    )
+    optional.add_argument(
+        "--extract_raw",
+        action="store_true",
+        help="Copy matching sentences byte for byte from the input instead of re-serializing them. "
+        "Requires uncompressed input and cannot be combined with cleaning options or --queries",
+    )
     optional.add_argument("--verbose", action="store_true", help="Verbosity")
 
     args = parser.parse_args()
@@ -119,6 +182,9 @@ def main():
     # Set random seed
     random.seed(args.random_seed)
 
+    # Sentences are processed in place by each stage rather than copied
+    set_copy_free(args.copy_free)
+
     # Set logging level to info if verbose
     if args.verbose:
         level = logging.INFO
@@ -149,13 +215,32 @@ def main():
         selector=selector,
         min_len=args.min_len,
         max_len=args.max_len,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
+        inverted_index=args.use_index,
+        chunk_size=args.chunk_size,
     )
 
     # Make file dumper
     file_dumper = FileDumper(extension=".conllu")
 
-    # Make file processor
-    file_processor = FileProcessor(loader, NullProcessor(), file_dumper)
+    # Make file processor. With a batch of queries, sentences are selected after loading
+    if args.limit is not None and (args.queries or args.extract_raw):
+        raise ValueError("--limit cannot be used with --queries or --extract_raw")
+
+    if args.extract_raw:
+        if args.queries or args.remove_config or args.fields_to_remove or args.mask_words:
+            raise ValueError(
+                "--extract_raw copies sentences unchanged, so it cannot be used with cleaning options or --queries"
+            )
+        file_processor = ByteRangeFileProcessor(loader, file_dumper)
+    elif args.queries:
+        batch_selector = MultiQuerySelector(list(load_ndjson(args.queries)))
+        file_processor = QueryBatchFileProcessor(loader, batch_selector, file_dumper)
+    else:
+        file_processor = FileProcessor(
+            loader, NullProcessor(), file_dumper, limit=args.limit
+        )
 
     # Handle input and output
     if args.treebank and args.outfile:
@@ -168,6 +253,13 @@ def main():
         # Get glob list of files and process them
         file_processor.process_glob(args.directory, args.glob_pattern, args.outdir)
 
+    elif args.directory and args.outfile and not (args.queries or args.extract_raw):
+
+        # Get glob list of files and merge their matches into one file, in order
+        file_processor.process_glob_to_file(
+            args.directory, args.glob_pattern, args.outfile
+        )
+
     else:
         raise ValueError("Incorrect or incompatible use of input and output options.")
 
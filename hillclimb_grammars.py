@@ -84,11 +84,28 @@ gen_hparams.add_argument(
     default=0,
     help="Number of epochs to burn-in (i.e. train without output)",
 )
+io_args.add_argument(
+    "--cache_dir",
+    type=Path,
+    default=None,
+    help="Directory in which to cache loaded treebanks for faster reloading",
+)
+io_args.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes with which to load treebanks",
+)
 io_args.add_argument(
     "--callable_loading",
     action="store_true",
     help="Load the treebanks afresh on each epoch as a callable function. Recommended only for reading very large data",
 )
+io_args.add_argument(
+    "--compact_sentences",
+    action="store_true",
+    help="Parse only the columns needed and hold sentences as compact arrays rather than full conllu tokens. Reduces memory use and loading time",
+)
 gen_hparams.add_argument(
     "--log_level",
     choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
@@ -138,7 +155,14 @@ cleaner = SentenceCleaner(remove_config=[{"deprel": "punct"}])
 
 # Make loader
 logging.info("Making sentence loader")
-loader = TreebankLoader(cleaner=cleaner)
+if args.compact_sentences:
+    # Forms are kept for the bigram mutual information objective
+    fields = ("id", "form", "head", "deprel")
+else:
+    fields = None
+loader = TreebankLoader(
+    cleaner=cleaner, fields=fields, cache_dir=args.cache_dir, workers=args.workers
+)
 
 logging.info("Loading sentences")
 if args.callable_loading:
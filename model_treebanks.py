@@ -45,6 +45,18 @@ parser.add_argument(
     type=str,
     help="ndjson file to output the training outputs to",
 )
+parser.add_argument(
+    "--cache_dir",
+    type=Path,
+    default=None,
+    help="Directory in which to cache loaded treebanks for faster reloading",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of processes with which to load treebanks",
+)
 parser.add_argument(
     "--callable_loading",
     action="store_true",
@@ -84,7 +96,9 @@ cleaner = SentenceCleaner(remove_config=[{"deprel": "punct"}])
 
 # Make loader
 logging.info("Making sentence loader")
-loader = TreebankLoader(cleaner=cleaner)
+loader = TreebankLoader(
+    cleaner=cleaner, cache_dir=args.cache_dir, workers=args.workers
+)
 
 logging.info("Loading sentences")
 if args.callable_loading:
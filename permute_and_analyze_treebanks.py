@@ -7,11 +7,14 @@ from src.file_processor import FileProcessor
 from src.load_treebank import TreebankLoader
 from src.sentence_cleaner import SentenceCleaner
 from src.file_dumper import FileDumper
+from src.utils.decorators import set_copy_free
 from src.utils.fileutils import load_ndjson
 from src.utils.processor_factories import (
     treebank_permuter_factory,
     sentence_analyzer_factory,
     treebank_permuter_analyzer_factory,
+    treebank_optimal_dependency_length_factory,
+    treebank_expected_dependency_length_factory,
 )
 
 
@@ -119,6 +122,33 @@ def parse_args():
         help="Number of times to perform the permutation action on each treebank",
     )
 
+    optional.add_argument(
+        "--cache_dir",
+        type=Path,
+        default=None,
+        help="Directory in which to cache loaded treebanks for faster reloading",
+    )
+
+    optional.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes with which to load treebanks when globbing a directory",
+    )
+
+    optional.add_argument(
+        "--copy_free",
+        action="store_true",
+        help="Copy each sentence once when it is loaded and process it in place afterwards",
+    )
+
+    optional.add_argument(
+        "--sentence_major",
+        action="store_true",
+        help="Apply all permutations to each sentence before the next, instead of copying the treebank "
+        "for each permutation. Output order is unchanged, but random permutations differ for a given seed",
+    )
+
     optional.add_argument(
         "--min_len",
         type=int,
@@ -151,6 +181,17 @@ def parse_args():
         help="If true, token scores will be aggregated and the results for each sentence will be output in an ndjson",
     )
 
+    optional.add_argument(
+        "--expected",
+        action="store_true",
+        help="Output the exact expected total dependency length (the sum of absolute lengths) of each "
+        "sentence and its variance over RandomProjective permutations, as ExpectedTotalDL and "
+        "VarianceTotalDL. With --n_times, these are added to the output of each sampled permutation, "
+        "with its own total as TotalDL (unlike DL, which is the absolute value of the sum of signed "
+        "lengths). Without --n_times, no permutations are sampled. "
+        "Requires RandomProjective permutation, --aggregate and the DependencyLength analysis mode",
+    )
+
     optional.add_argument(
         "--standardize_deprels",
         action="store_true",
@@ -180,6 +221,9 @@ def main():
     # Set random seed
     random.seed(args.random_seed)
 
+    # Sentences are processed in place by each stage rather than copied
+    set_copy_free(args.copy_free)
+
     # Loads the remove config (for removing tokens of given type) or ignores
     if args.remove_config:
         print(f"using remove config from {args.remove_config}")
@@ -195,9 +239,37 @@ def main():
         cleaner=cleaner,
         min_len=args.min_len,
         max_len=args.max_len,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
     )
 
-    if args.n_times:
+    only_aggregate_dl = args.aggregate and set(args.analysis_modes or []) == {"DependencyLength"}
+
+    if args.expected and (
+        args.permutation_mode != "RandomProjective"
+        or not args.aggregate
+        or "DependencyLength" not in (args.analysis_modes or [])
+    ):
+        raise ValueError(
+            "--expected requires RandomProjective permutation, --aggregate and DependencyLength analysis"
+        )
+
+    if args.expected and not args.n_times:
+        logging.info(
+            "Computing expected dependency lengths under RandomProjective permutation, without sampling"
+        )
+        treebank_processor = treebank_expected_dependency_length_factory(
+            count_root=args.count_root
+        )
+
+    elif args.permutation_mode == "OptimalOrder" and only_aggregate_dl:
+        # Optimal dependency lengths follow from the head arrays, so sentences need not be permuted
+        logging.info("Computing optimal dependency lengths without permuting")
+        treebank_processor = treebank_optimal_dependency_length_factory(
+            count_root=args.count_root
+        )
+
+    elif args.n_times:
         logging.info(
             f"Instantiating {args.n_times} processors of permuter type {args.permutation_mode}"
         )
@@ -207,6 +279,8 @@ def main():
             n_times=args.n_times,
             count_root=args.count_root,
             aggregate=args.aggregate,
+            sentence_major=args.sentence_major,
+            expected_dl=args.expected,
         )
 
     elif args.grammars:
@@ -225,6 +299,7 @@ def main():
             grammars=grammars,
             count_root=args.count_root,
             aggregate=args.aggregate,
+            sentence_major=args.sentence_major,
         )
 
     else:
@@ -16,6 +16,7 @@ from src.sentence_permuter import (
     SentencePermuter,
 )
 from src.treebank_processor import TreebankPermuter
+from src.utils.decorators import set_copy_free
 from src.utils.fileutils import load_ndjson
 from src.utils.processor_factories import (
     sentence_permuter_factory,
@@ -106,6 +107,33 @@ def parse_args():
         help="Number of times to perform the permutation action on each treebank",
     )
 
+    optional.add_argument(
+        "--cache_dir",
+        type=Path,
+        default=None,
+        help="Directory in which to cache loaded treebanks for faster reloading",
+    )
+
+    optional.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes with which to load treebanks when globbing a directory",
+    )
+
+    optional.add_argument(
+        "--copy_free",
+        action="store_true",
+        help="Copy each sentence once when it is loaded and process it in place afterwards",
+    )
+
+    optional.add_argument(
+        "--sentence_major",
+        action="store_true",
+        help="Apply all permutations to each sentence before the next, instead of copying the treebank "
+        "for each permutation. Output order is unchanged, but random permutations differ for a given seed",
+    )
+
     optional.add_argument(
         "--min_len",
         type=int,
@@ -150,6 +178,9 @@ def main():
     # Set random seed
     random.seed(args.random_seed)
 
+    # Sentences are processed in place by each stage rather than copied
+    set_copy_free(args.copy_free)
+
     # Set logging level according to verbosity
     logging.basicConfig(
         format="%(asctime)s %(levelname)s %(message)s", level=args.verbosity
@@ -169,6 +200,8 @@ def main():
         cleaner=cleaner,
         min_len=args.min_len,
         max_len=args.max_len,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
     )
 
     if args.n_times:
@@ -177,7 +210,9 @@ def main():
             f"Instantiating {args.n_times} processors of permuter type {args.permutation_mode}"
         )
         treebank_processor = treebank_permuter_factory(
-            args.permutation_mode, n_times=args.n_times
+            args.permutation_mode,
+            n_times=args.n_times,
+            sentence_major=args.sentence_major,
         )
 
     elif args.grammars:
@@ -190,7 +225,9 @@ def main():
             """
         )
         treebank_processor = treebank_permuter_factory(
-            args.permutation_mode, grammars=grammars
+            args.permutation_mode,
+            grammars=grammars,
+            sentence_major=args.sentence_major,
         )
 
     else:
@@ -0,0 +1,144 @@
+import json
+import logging
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+import numpy as np
+from conllu.models import Metadata
+
+from src.compact_sentence import (
+    CompactSentence,
+    DEPREL_VOCAB,
+    UPOS_VOCAB,
+    FORM_VOCAB,
+)
+
+CORPUS_VERSION = 1
+CORPUS_COLUMNS = ("heads", "deprels", "upos", "forms")
+CORPUS_VOCABS = {"deprels": DEPREL_VOCAB, "upos": UPOS_VOCAB, "forms": FORM_VOCAB}
+
+MANIFEST_FILE = "manifest.json"
+VOCAB_FILE = "vocab.json"
+SENT_IDS_FILE = "sent_ids.json"
+OFFSETS_FILE = "offsets.npy"
+
+EMPTY_FIELD = "_"
+
+
+class ColumnarCorpusWriter:
+    """
+    Writes compact sentences to a columnar corpus directory.
+
+    The corpus holds one .npy array per column with the tokens of all sentences concatenated,
+    and an offsets array where sentence i spans offsets[i]:offsets[i+1].
+    Code columns are stored with the codes of the writing process and a vocab.json to decode them.
+    """
+
+    def __init__(self, outdir: Path):
+        self.outdir = Path(outdir)
+        self.columns = {column: array("i") for column in CORPUS_COLUMNS}
+        self.offsets = array("q", [0])
+        self.sent_ids: List[str] = []
+        self.files: List[dict] = []
+
+    def add_sentence(self, sentence: CompactSentence):
+        n_tokens = len(sentence)
+        for column in CORPUS_COLUMNS:
+            values = getattr(sentence, column)
+            if values is None:
+                # Emptied fields are stored as the empty field symbol
+                values = np.full(n_tokens, CORPUS_VOCABS[column].encode(EMPTY_FIELD))
+            self.columns[column].frombytes(np.asarray(values, dtype=np.int32).tobytes())
+        self.offsets.append(self.offsets[-1] + n_tokens)
+        self.sent_ids.append(sentence.metadata.get("sent_id"))
+
+    def add_file(self, source: Path, sentences: Iterable[CompactSentence]):
+        start = len(self.sent_ids)
+        for sentence in sentences:
+            self.add_sentence(sentence)
+        self.files.append({"file": str(source), "start": start, "stop": len(self.sent_ids)})
+
+    def write(self):
+        self.outdir.mkdir(parents=True, exist_ok=True)
+
+        for column, values in self.columns.items():
+            np.save(Path(self.outdir, f"{column}.npy"), np.frombuffer(values, dtype=np.int32))
+        np.save(Path(self.outdir, OFFSETS_FILE), np.frombuffer(self.offsets, dtype=np.int64))
+
+        vocab = {column: vocab.strings() for column, vocab in CORPUS_VOCABS.items()}
+        _dump_json(vocab, Path(self.outdir, VOCAB_FILE))
+        _dump_json(self.sent_ids, Path(self.outdir, SENT_IDS_FILE))
+
+        manifest = {
+            "version": CORPUS_VERSION,
+            "n_sentences": len(self.sent_ids),
+            "n_tokens": self.offsets[-1],
+            "files": self.files,
+        }
+        _dump_json(manifest, Path(self.outdir, MANIFEST_FILE))
+
+        logging.info(
+            f"Wrote {manifest['n_sentences']} sentences ({manifest['n_tokens']} tokens) to {self.outdir}"
+        )
+
+
+class ColumnarCorpus:
+    """
+    Reads a columnar corpus with the columns memory-mapped, so that several processes
+    reading the same corpus share it through the page cache.
+    """
+
+    def __init__(self, corpus_dir: Path):
+        self.corpus_dir = Path(corpus_dir)
+
+        with open(Path(self.corpus_dir, MANIFEST_FILE), encoding="utf-8") as fin:
+            self.manifest = json.load(fin)
+        if self.manifest["version"] != CORPUS_VERSION:
+            raise ValueError(
+                f"Corpus version {self.manifest['version']} is not supported (expected {CORPUS_VERSION})"
+            )
+
+        self.offsets = np.load(Path(self.corpus_dir, OFFSETS_FILE), mmap_mode="r")
+        self.columns = {
+            column: np.load(Path(self.corpus_dir, f"{column}.npy"), mmap_mode="r")
+            for column in CORPUS_COLUMNS
+        }
+
+        with open(Path(self.corpus_dir, SENT_IDS_FILE), encoding="utf-8") as fin:
+            self.sent_ids = json.load(fin)
+
+        # Map the corpus codes onto the codes of this process' vocabularies
+        with open(Path(self.corpus_dir, VOCAB_FILE), encoding="utf-8") as fin:
+            vocab = json.load(fin)
+        self._code_maps = {
+            column: CORPUS_VOCABS[column].encode_many(vocab[column])
+            for column in CORPUS_VOCABS
+        }
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> CompactSentence:
+        start, stop = int(self.offsets[i]), int(self.offsets[i + 1])
+        metadata = Metadata(sent_id=self.sent_ids[i])
+        return CompactSentence(
+            np.array(self.columns["heads"][start:stop]),
+            self._code_maps["deprels"][self.columns["deprels"][start:stop]],
+            self._code_maps["upos"][self.columns["upos"][start:stop]],
+            self._code_maps["forms"][self.columns["forms"][start:stop]],
+            metadata,
+        )
+
+    def file_ranges(self) -> List[Tuple[str, int, int]]:
+        return [(item["file"], item["start"], item["stop"]) for item in self.manifest["files"]]
+
+    def iter_sentences(self, start: int = 0, stop: int = None) -> Iterator[CompactSentence]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield self[i]
+
+
+def _dump_json(obj, outfile: Path):
+    with open(outfile, "w", encoding="utf-8") as fout:
+        json.dump(obj, fout, ensure_ascii=False)
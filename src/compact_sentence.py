@@ -0,0 +1,227 @@
+from typing import List, Dict, Iterable, Sequence, Union
+
+import numpy as np
+from conllu import Token, TokenList
+from conllu.models import Metadata
+
+from src.utils.indexutils import make_index_array, make_keep_index_array
+
+
+CONLLU_FIELDS = (
+    "id",
+    "form",
+    "lemma",
+    "upos",
+    "xpos",
+    "feats",
+    "head",
+    "deprel",
+    "deps",
+    "misc",
+)
+
+# Head of tokens whose HEAD column is "_" (None in a TokenList)
+MISSING_HEAD = -1
+
+
+class Vocabulary:
+    """
+    Interns strings as integer codes so that sentences can hold arrays of codes instead of strings
+    """
+
+    __slots__ = ("_codes", "_strings")
+
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+        self._strings: List[str] = []
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __contains__(self, string: str):
+        return string in self._codes
+
+    def encode(self, string: str) -> int:
+        code = self._codes.get(string)
+        if code is None:
+            code = len(self._strings)
+            self._codes[string] = code
+            self._strings.append(string)
+        return code
+
+    def decode(self, code: int) -> str:
+        return self._strings[code]
+
+    def encode_many(self, strings: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.encode(string) for string in strings), dtype=np.int32)
+
+    def decode_many(self, codes: Iterable[int]) -> List[str]:
+        strings = self._strings
+        return [strings[code] for code in codes]
+
+    def strings(self) -> List[str]:
+        return list(self._strings)
+
+
+# Process-wide vocabularies. Codes are only meaningful within a process, so
+# CompactSentence objects are pickled with their strings and re-interned on load.
+DEPREL_VOCAB = Vocabulary()
+UPOS_VOCAB = Vocabulary()
+FORM_VOCAB = Vocabulary()
+
+
+class CompactSentence:
+    """
+    Array-backed sentence holding only what the permuters and analyzers need.
+
+    Token ids are implicit (1..n). heads[i] is the id of the head of token i+1, with 0 for the root
+    and MISSING_HEAD where the head is not given.
+    deprels, upos and forms hold codes from the module vocabularies; upos and forms are optional.
+    """
+
+    __slots__ = ("heads", "deprels", "upos", "forms", "metadata")
+
+    def __init__(
+        self,
+        heads: np.ndarray,
+        deprels: np.ndarray,
+        upos: np.ndarray = None,
+        forms: np.ndarray = None,
+        metadata: Metadata = None,
+    ):
+        self.heads = heads
+        self.deprels = deprels
+        self.upos = upos
+        self.forms = forms
+        self.metadata = metadata if metadata is not None else Metadata()
+
+    def __len__(self):
+        return len(self.heads)
+
+    def __repr__(self):
+        return f"CompactSentence<{len(self)} tokens, metadata={dict(self.metadata)}>"
+
+    def __reduce__(self):
+        return (
+            CompactSentence.from_strings,
+            (
+                self.heads,
+                self.deprel_strings(),
+                self.upos_strings(),
+                self.form_strings(),
+                self.metadata,
+            ),
+        )
+
+    @property
+    def ids(self) -> np.ndarray:
+        return np.arange(1, len(self) + 1, dtype=np.int32)
+
+    @classmethod
+    def from_strings(
+        cls,
+        heads: Union[np.ndarray, Sequence[int]],
+        deprels: Sequence[str],
+        upos: Sequence[str] = None,
+        forms: Sequence[str] = None,
+        metadata: Metadata = None,
+    ):
+        return cls(
+            np.asarray(heads, dtype=np.int32),
+            DEPREL_VOCAB.encode_many(deprels),
+            UPOS_VOCAB.encode_many(upos) if upos is not None else None,
+            FORM_VOCAB.encode_many(forms) if forms is not None else None,
+            metadata,
+        )
+
+    @classmethod
+    def from_tokenlist(cls, tokenlist: TokenList, upos: bool = True, forms: bool = True):
+        """
+        Builds a compact sentence from a TokenList. Non-standard tokens (multi-word tokens
+        and empty nodes) are skipped, so the remaining token ids are expected to be 1..n.
+        """
+        tokens = [token for token in tokenlist if isinstance(token["id"], int)]
+        return cls.from_strings(
+            [
+                token["head"] if token["head"] is not None else MISSING_HEAD
+                for token in tokens
+            ],
+            [token["deprel"] for token in tokens],
+            [token["upos"] for token in tokens] if upos else None,
+            [token["form"] for token in tokens] if forms else None,
+            tokenlist.metadata,
+        )
+
+    def to_tokenlist(self) -> TokenList:
+        """Converts back to a TokenList, with fields that are not held set to None"""
+        deprels = self.deprel_strings()
+        upos = self.upos_strings()
+        forms = self.form_strings()
+        tokens = []
+        for i, head in enumerate(self.heads.tolist()):
+            token = Token.fromkeys(CONLLU_FIELDS)
+            token["id"] = i + 1
+            token["form"] = forms[i] if forms is not None else None
+            token["upos"] = upos[i] if upos is not None else None
+            token["head"] = head if head != MISSING_HEAD else None
+            token["deprel"] = deprels[i]
+            tokens.append(token)
+        return TokenList(tokens, metadata=self.metadata)
+
+    def deprel_strings(self) -> List[str]:
+        return DEPREL_VOCAB.decode_many(self.deprels.tolist())
+
+    def upos_strings(self) -> Union[List[str], None]:
+        if self.upos is None:
+            return None
+        return UPOS_VOCAB.decode_many(self.upos.tolist())
+
+    def form_strings(self) -> Union[List[str], None]:
+        if self.forms is None:
+            return None
+        return FORM_VOCAB.decode_many(self.forms.tolist())
+
+    def copy(self):
+        return CompactSentence(
+            self.heads.copy(),
+            self.deprels.copy(),
+            self.upos.copy() if self.upos is not None else None,
+            self.forms.copy() if self.forms is not None else None,
+            Metadata(self.metadata),
+        )
+
+    @staticmethod
+    def _renumber_heads(new_ids: np.ndarray, heads: np.ndarray):
+        # Missing heads stay missing, as None heads do in fix_token_indices
+        return np.where(heads == MISSING_HEAD, MISSING_HEAD, new_ids[heads])
+
+    def _take(self, indices: np.ndarray, heads: np.ndarray):
+        return CompactSentence(
+            heads,
+            self.deprels[indices],
+            self.upos[indices] if self.upos is not None else None,
+            self.forms[indices] if self.forms is not None else None,
+            self.metadata,
+        )
+
+    def select(self, keep: np.ndarray):
+        """
+        Keeps the tokens where the boolean mask is true and renumbers the heads.
+        Tokens whose head was removed are attached to 0, as with fix_token_indices.
+        """
+        keep = np.asarray(keep, dtype=bool)
+        new_ids = make_keep_index_array(keep)
+        heads = self._renumber_heads(new_ids, self.heads[keep])
+        return self._take(np.flatnonzero(keep), heads)
+
+    def reorder(self, order: Sequence[int]):
+        """
+        Returns the sentence linearised in a new order.
+
+        :param order: The old token ids (1..n) in their new linear order
+        :return: CompactSentence with renumbered heads
+        """
+        indices = np.asarray(order, dtype=np.int32) - 1
+        new_ids = make_index_array(indices + 1, len(self) + 1)
+        heads = self._renumber_heads(new_ids, self.heads[indices])
+        return self._take(indices, heads)
@@ -1,8 +1,10 @@
 import logging
+import mmap
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, List, Tuple
 
-from src.utils.fileutils import serialize_data_item
+from src.utils.fileutils import serialize_data_item, open_file, compression_suffix
 
 
 class FileDumper:
@@ -10,11 +12,33 @@ class FileDumper:
         self.extension = extension
 
     def write_to_file(self, data_stream: Iterable, outfile: Path):
-        with open(outfile, "w", encoding="utf-8") as fout:
+        with open_file(outfile, "w") as fout:
             for data_item in data_stream:
                 serialized_item = serialize_data_item(data_item)
                 print(serialized_item, file=fout)
 
+    def write_routed(self, routed_stream: Iterable[Tuple[List[int], object]], outfiles: List[Path]):
+        """Writes each data item to the outfiles at the indices it is paired with"""
+        with ExitStack() as stack:
+            fouts = [stack.enter_context(open_file(outfile, "w")) for outfile in outfiles]
+            for indices, data_item in routed_stream:
+                if not indices:
+                    continue
+                serialized_item = serialize_data_item(data_item)
+                for i in indices:
+                    print(serialized_item, file=fouts[i])
+
+    @staticmethod
+    def write_byte_ranges(infile: Path, byte_ranges: Iterable[Tuple[int, int]], outfile: Path):
+        """Copies the (offset, length) byte ranges of an uncompressed infile to the outfile as they are"""
+        with open(infile, "rb") as fin, open_file(outfile, "wb") as fout:
+            if fin.seek(0, 2) == 0:
+                return
+            with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                with memoryview(source) as view:
+                    for offset, length in byte_ranges:
+                        fout.write(view[offset : offset + length])
+
     def make_equivalent_paths(self, source_dir: Path, infile: Path, outdir: Path):
         """Creates the fullpath to the file and outputs"""
         # Get path of infile relative to parent path
@@ -23,12 +47,17 @@ class FileDumper:
         # Get the parent directory of the file
         parent = infile_relpath.parent
 
+        # Keep the compression suffix of the infile, e.g. x.conllu.gz -> x.ndjson.gz
+        compression = compression_suffix(infile_relpath)
+        if compression:
+            infile_relpath = infile_relpath.with_suffix("")
+
         stem = infile_relpath.stem
 
         # Put together the output directory and the new file path
         outfile_parent = Path(outdir, parent)
 
-        outfile_name = Path(f"{stem}{self.extension}")
+        outfile_name = Path(f"{stem}{self.extension}{compression}")
 
         if not outfile_parent.exists():
             logging.info(f"Making parent path: {outfile_parent}")
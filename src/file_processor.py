@@ -1,10 +1,16 @@
+import itertools
 import logging
 from abc import ABC
 from pathlib import Path
+from typing import List
+
+from conllu import SentenceList
 
 from src.file_dumper import FileDumper
 from src.load_treebank import TreebankLoader
+from src.sentence_selector import MultiQuerySelector
 from src.treebank_processor import TreebankProcessor
+from src.utils.miscutils import NullProcessor
 
 
 class FileProcessor(ABC):
@@ -16,27 +22,135 @@ class FileProcessor(ABC):
     """
 
     def __init__(
-        self, loader: TreebankLoader, processor: TreebankProcessor, dumper: FileDumper
+        self,
+        loader: TreebankLoader,
+        processor: TreebankProcessor,
+        dumper: FileDumper,
+        limit: int = None,
     ):
         self.loader = loader
         self.processor = processor
         self.dumper = dumper
 
+        # Stop once this many sentences have been loaded, across all files
+        self.limit = limit
+
     def load_conllu_file(self, infile: Path):
         return self.loader.load_treebank(infile)
 
     def process_file(self, infile: Path, outfile: Path):
         # Override this
-        treebank = self.loader.load_treebank(infile)
+        for _, sentences in self.iter_load_files([infile]):
+            self.process_treebank(SentenceList(sentences), outfile)
+
+    def process_treebank(self, treebank: SentenceList, outfile: Path):
         processed_data = self.processor.process_treebank(treebank)
         self.dumper.write_to_file(processed_data, outfile)
 
     def process_glob(self, indir: Path, glob_pattern: str, outdir: Path):
         # Get list of infiles to process
-        indir_path = Path(indir)
-        infiles = indir_path.glob(glob_pattern)
+        infiles = self.loader.glob_treebanks(indir, glob_pattern)
+
+        # Files may be loaded ahead in parallel, but are processed in order
+        for infile, sentences in self.iter_load_files(infiles):
+            logging.info(f"Processing file: {infile}")
+
+            outfile = self.dumper.make_equivalent_paths(indir, infile, outdir)
+
+            self.process_treebank(SentenceList(sentences), outfile)
+
+    def process_glob_to_file(self, indir: Path, glob_pattern: str, outfile: Path):
+        """Processes the files in sorted order and writes their output to a single file"""
+        infiles = sorted(self.loader.glob_treebanks(indir, glob_pattern))
+
+        processed_data = (
+            data_item
+            for _, sentences in self.iter_load_files(infiles)
+            for data_item in self.processor.process_treebank(SentenceList(sentences))
+        )
+        self.dumper.write_to_file(processed_data, outfile)
+
+    def iter_load_files(self, infiles):
+        """Yields (infile, sentences) from the loader, stopping once limit sentences have been loaded"""
+        loaded_files = self.loader.iter_load_files(infiles)
+        if self.limit is None:
+            yield from loaded_files
+            return
+
+        remaining = self.limit
+        try:
+            for infile, sentences in loaded_files:
+                sentences = list(itertools.islice(sentences, remaining))
+                remaining -= len(sentences)
+                yield infile, sentences
+                if remaining <= 0:
+                    break
+        finally:
+            # Stops the loader's workers
+            loaded_files.close()
+
+
+class QueryBatchFileProcessor(FileProcessor):
+    """
+    Matches the sentences of a file or set of files against a batch of queries in one pass,
+    writing the matching sentences of each query to its own output under a directory named
+    after the query.
+    """
+
+    def __init__(
+        self, loader: TreebankLoader, batch_selector: MultiQuerySelector, dumper: FileDumper
+    ):
+        super().__init__(loader, NullProcessor(), dumper)
+        self.batch_selector = batch_selector
 
-        for infile in infiles:
+    def process_file(self, infile: Path, outfile: Path):
+        treebank = self.loader.load_treebank(infile)
+
+        outfiles = []
+        for name in self.batch_selector.names:
+            query_outdir = Path(Path(outfile).parent, name)
+            query_outdir.mkdir(parents=True, exist_ok=True)
+            outfiles.append(Path(query_outdir, Path(outfile).name))
+
+        self.route_treebank(treebank, outfiles)
+
+    def process_glob(self, indir: Path, glob_pattern: str, outdir: Path):
+        infiles = self.loader.glob_treebanks(indir, glob_pattern)
+
+        for infile, sentences in self.loader.iter_load_files(infiles):
+            logging.info(f"Processing file: {infile}")
+
+            outfiles = [
+                self.dumper.make_equivalent_paths(indir, infile, Path(outdir, name))
+                for name in self.batch_selector.names
+            ]
+
+            self.route_treebank(SentenceList(sentences), outfiles)
+
+    def route_treebank(self, treebank: SentenceList, outfiles: List[Path]):
+        routed_data = (
+            (self.batch_selector.matching_queries(sentence), sentence)
+            for sentence in self.processor.process_treebank(treebank)
+        )
+        self.dumper.write_routed(routed_data, outfiles)
+
+
+class ByteRangeFileProcessor(FileProcessor):
+    """
+    Copies the sentences of uncompressed files that pass the loader's selector and length limits
+    to the output byte for byte, instead of serializing the parsed sentences.
+    The loader must not clean sentences, since the output is the original text.
+    """
+
+    def __init__(self, loader: TreebankLoader, dumper: FileDumper):
+        super().__init__(loader, NullProcessor(), dumper)
+
+    def process_file(self, infile: Path, outfile: Path):
+        byte_ranges = self.loader.iter_matching_byte_ranges(infile)
+        self.dumper.write_byte_ranges(infile, byte_ranges, outfile)
+
+    def process_glob(self, indir: Path, glob_pattern: str, outdir: Path):
+        for infile in self.loader.glob_treebanks(indir, glob_pattern):
             logging.info(f"Processing file: {infile}")
 
             outfile = self.dumper.make_equivalent_paths(indir, infile, outdir)
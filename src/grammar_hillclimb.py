@@ -12,6 +12,7 @@ from collections import Counter
 from dataclasses import dataclass, field
 from conllu import TokenList
 
+from src.compact_sentence import CompactSentence
 from src.sentence_analyzer import SentenceAnalyzer
 from src.sentence_permuter import FixedOrderPermuter
 from src.model_treebanks import BigramMutualInformationModeller
@@ -147,6 +148,8 @@ class BigramMutualInformationAnalyzer(CorpusLevelAnalyzer):
         self.modeller = BigramMutualInformationModeller(lowercase=lowercase, threshold=threshold, normalized=normalized)
 
     def ingest_sentence(self, sentence: TokenList):
+        if isinstance(sentence, CompactSentence):
+            sentence = sentence.to_tokenlist()
         self.modeller._ingest_sentence(sentence)
 
     def get_improvement_score(self):
@@ -336,6 +339,11 @@ class GrammarHillclimb:
         raw_frequencies = {deprel: 1 for deprel in self.deprels}
 
         for sentence in train_sentences:
+            if isinstance(sentence, CompactSentence):
+                for deprel in sentence.deprel_strings():
+                    raw_frequencies[deprel] += 1
+                continue
+
             for token in sentence:
                 raw_frequencies[token["deprel"]] += 1
 
@@ -0,0 +1,161 @@
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+from conllu.parser import parse_token_and_metadata
+
+from src.sentence_index import SentenceIndex
+from src.utils.fileutils import file_signature
+
+POSTINGS_SUFFIX = ".postings"
+INDEXED_FIELDS = ("form", "lemma", "upos", "xpos", "deprel")
+
+_KEY_SEPARATOR = "\t"
+
+
+class InvertedIndex:
+    """
+    Posting lists of the sentences of a conllu file that contain each form, lemma, upos, xpos and
+    deprel value.
+
+    Sentences are identified by their position in the file, as in SentenceIndex, so the postings can
+    be turned into byte ranges. The index is stored next to the file as <file>.postings, with the
+    posting lists delta-encoded and compressed, together with the size and modification time of the
+    file so that stale indices are rebuilt.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        starts: np.ndarray,
+        deltas: np.ndarray,
+        n_sentences: int,
+        source_size: int,
+        source_mtime: int,
+    ):
+        self.keys = keys
+        self.starts = starts
+        self.deltas = deltas
+        self.n_sentences = n_sentences
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self._key_positions: Dict[str, int] = {key: i for i, key in enumerate(keys)}
+
+    def __len__(self):
+        return self.n_sentences
+
+    @staticmethod
+    def index_path(infile: Path):
+        infile = Path(infile)
+        return Path(infile.parent, f"{infile.name}{POSTINGS_SUFFIX}")
+
+    @classmethod
+    def build(cls, infile: Path):
+        # Sentences are read through the sentence index so that positions agree with it
+        sentence_index = SentenceIndex.load_or_build(infile)
+
+        postings: Dict[str, List[int]] = {}
+        with open(infile, "rb") as fin:
+            for position, (offset, length) in enumerate(
+                zip(sentence_index.offsets.tolist(), sentence_index.lengths.tolist())
+            ):
+                fin.seek(offset)
+                block = fin.read(length).decode("utf-8").replace("\r\n", "\n").rstrip()
+                for key in _sentence_keys(block):
+                    postings.setdefault(key, []).append(position)
+
+        keys = sorted(postings)
+        starts = np.zeros(len(keys) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum([len(postings[key]) for key in keys])
+        deltas = np.zeros(starts[-1], dtype=np.uint32)
+        for i, key in enumerate(keys):
+            positions = np.asarray(postings[key], dtype=np.uint32)
+            deltas[starts[i] : starts[i + 1]] = np.diff(positions, prepend=0)
+
+        size, mtime = file_signature(infile)
+        return cls(keys, starts, deltas, len(sentence_index), size, mtime)
+
+    def save(self, index_file: Path):
+        with open(index_file, "wb") as fout:
+            np.savez_compressed(
+                fout,
+                keys=np.asarray(self.keys, dtype=str),
+                starts=self.starts,
+                deltas=self.deltas,
+                header=np.asarray(
+                    [self.n_sentences, self.source_size, self.source_mtime], dtype=np.int64
+                ),
+            )
+
+    @classmethod
+    def load(cls, index_file: Path):
+        with open(index_file, "rb") as fin:
+            arrays = np.load(fin)
+            n_sentences, source_size, source_mtime = arrays["header"].tolist()
+            return cls(
+                arrays["keys"].tolist(),
+                arrays["starts"],
+                arrays["deltas"],
+                n_sentences,
+                source_size,
+                source_mtime,
+            )
+
+    @classmethod
+    def load_or_build(cls, infile: Path, save: bool = True):
+        """Loads the index stored next to the file, building it if it is missing or stale"""
+        index_file = cls.index_path(infile)
+        if index_file.exists():
+            index = cls.load(index_file)
+            if (index.source_size, index.source_mtime) == file_signature(infile):
+                return index
+            logging.info(f"Inverted index is stale: {index_file}")
+
+        logging.info(f"Building inverted index: {index_file}")
+        index = cls.build(infile)
+        if save:
+            index.save(index_file)
+        return index
+
+    def positions(self, field: str, value: str) -> np.ndarray:
+        """Sorted positions of the sentences with a token whose field has the value"""
+        i = self._key_positions.get(_make_key(field, value))
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        return np.cumsum(self.deltas[self.starts[i] : self.starts[i + 1]], dtype=np.int64)
+
+    def intersect(self, field_values: Iterable[Tuple[str, str]]) -> Union[np.ndarray, None]:
+        """
+        Positions of the sentences that contain all the field values, starting from the shortest
+        posting list. Returns None if no field values are given.
+        """
+        postings = sorted(
+            (self.positions(field, value) for field, value in set(field_values)), key=len
+        )
+        if not postings:
+            return None
+
+        candidates = postings[0]
+        for positions in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, positions, assume_unique=True)
+        return candidates
+
+
+def _make_key(field: str, value: str) -> str:
+    return f"{field}{_KEY_SEPARATOR}{value}"
+
+
+def _sentence_keys(block: str) -> set:
+    keys = set()
+    for token in parse_token_and_metadata(block):
+        # Only regular tokens are kept by the cleaner
+        if not isinstance(token["id"], int):
+            continue
+        for field in INDEXED_FIELDS:
+            value = token.get(field)
+            if isinstance(value, str):
+                keys.add(_make_key(field, value))
+    return keys
@@ -1,14 +1,27 @@
+import io
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, AnyStr
-from conllu import parse_incr, Token, TokenList, SentenceList
+from typing import List, Dict, AnyStr, Iterable, TextIO
+from conllu import Token, TokenList, SentenceList
+from conllu.models import Metadata
+from conllu.parser import parse_comment_line, parse_sentences, parse_token_and_metadata
 
+from src.columnar_corpus import ColumnarCorpus
+from src.compact_sentence import CompactSentence, MISSING_HEAD
+from src.inverted_index import InvertedIndex, INDEXED_FIELDS, POSTINGS_SUFFIX
 from src.sentence_cleaner import SentenceCleaner
+from src.sentence_index import SentenceIndex, read_byte_range, INDEX_SUFFIX
 from src.sentence_selector import SentenceSelector
+from src.treebank_cache import TreebankCache
+from src.utils.fileutils import open_file, compression_suffix
 
 from src.utils.decorators import (
     fix_token_indices,
     preserve_metadata,
     deepcopy_tokenlist,
+    mark_owned,
 )
 
 
@@ -21,6 +34,12 @@ class TreebankLoader:
         selector: SentenceSelector = None,
         min_len: int = 1,
         max_len: int = 999,
+        compact: bool = False,
+        cache_dir: Path = None,
+        fields: Iterable[str] = None,
+        workers: int = 1,
+        inverted_index: bool = False,
+        chunk_size: int = None,
     ):
 
         if cleaner is None:
@@ -36,9 +55,37 @@ class TreebankLoader:
         self.min_len = min_len
         self.max_len = max_len
 
+        # Yield CompactSentence objects instead of TokenList objects
+        self.compact = compact
+
+        # Parse only the named conllu columns and yield CompactSentence objects directly
+        self.fields = _check_lean_fields(fields) if fields is not None else None
+        if self.fields is not None:
+            self.compact = True
+            _check_lean_query_fields(self.fields, self.selector)
+
+        # Optionally cache loaded treebanks on disk
+        self.cache = TreebankCache(cache_dir) if cache_dir is not None else None
+
+        # Number of processes for loading several files at once
+        self.workers = workers
+
+        # With several workers, split uncompressed files into chunks of this many sentences. The chunks
+        # are found with the sentence index, which is written next to each file if it has none
+        self.chunk_size = chunk_size
+
+        # Only parse the sentences that the inverted index shows can match the selector query
+        self.inverted_index = inverted_index
+
     def load_treebank(self, infile: Path):
-        sentences = self.iter_load_treebank(infile)
-        return SentenceList(sentences)
+        # A single file may still be loaded in chunks by several workers. The sentences are read
+        # before the generator moves on, since that ends the lazily merged chunks of the file.
+        loaded_files = self.iter_load_files([infile])
+        try:
+            _, sentences = next(loaded_files)
+            return SentenceList(list(sentences))
+        finally:
+            loaded_files.close()
 
     def clean_sentence(self, tokenlist: TokenList):
         return self.cleaner.process_sentence(tokenlist)
@@ -55,21 +102,226 @@ class TreebankLoader:
         processed = self.select_tokens(processed)
         return processed
 
+    def config(self):
+        return {
+            "cleaner": self.cleaner.config(),
+            "selector": self.selector.config(),
+            "min_len": self.min_len,
+            "max_len": self.max_len,
+            "compact": self.compact,
+            "fields": self.fields,
+        }
+
     def iter_load_treebank(self, infile: Path):
-        with open(infile, encoding="utf-8") as fin:
-            sentence_generator = parse_incr(fin)
-            for sentence in sentence_generator:
-                sentence = self.process_sentence(sentence)
+        if self.cache is None:
+            yield from self._iter_parse_treebank(infile)
+            return
+
+        key = self.cache.make_key(infile, self.config())
+        sentences = self.cache.load(key)
+        if sentences is None:
+            sentences = list(self._iter_parse_treebank(infile))
+            self.cache.store(key, sentences)
+        yield from sentences
+
+    def _iter_parse_treebank(self, infile: Path):
+        positions = self._candidate_positions(infile)
+        if positions is not None:
+            yield from self._iter_parse_positions(infile, positions)
+            return
+
+        with open_file(infile) as fin:
+            yield from self._iter_parse_stream(fin)
+
+    def _candidate_positions(self, infile: Path):
+        """
+        Positions of the sentences that can match the selector query according to the inverted
+        index stored next to the file, which is built if it does not exist.
+        Returns None if every sentence has to be parsed.
+        """
+        if not self.inverted_index or compression_suffix(infile):
+            return None
+
+        index = InvertedIndex.load_or_build(infile)
+
+        # Values of fields changed by the cleaner are not those in the index
+        fields = self.cleaner.unchanged_fields(INDEXED_FIELDS)
+        return self.selector.candidate_positions(index, fields)
+
+    def _iter_parse_positions(self, infile: Path, positions: Iterable[int]):
+        for offset, length, block in _iter_sentence_blocks(infile, positions):
+            yield from self._iter_parse_stream(io.StringIO(block, newline=None))
+
+    def iter_matching_byte_ranges(self, infile: Path):
+        """
+        Yields the (offset, length) in bytes of the sentence blocks of an uncompressed file that pass
+        the length limits and the selector, with adjacent blocks merged into one range.
+        Sentences are parsed and processed to be matched, but are not returned.
+        """
+        positions = self._candidate_positions(infile)
+
+        range_offset, range_length = 0, 0
+        for offset, length, block in _iter_sentence_blocks(infile, positions):
+            sentences = self._iter_parse_stream(io.StringIO(block, newline=None))
+            if not any(len(sentence) > 0 for sentence in sentences):
+                continue
+
+            if range_length and range_offset + range_length == offset:
+                range_length += length
+            else:
+                if range_length:
+                    yield range_offset, range_length
+                range_offset, range_length = offset, length
 
-                if self.filter_with_length_limits(sentence):
-                    yield sentence
+        if range_length:
+            yield range_offset, range_length
+
+    def _iter_parse_stream(self, fin: TextIO):
+        # Sentences that cannot meet the length limits are skipped before parsing and cleaning
+        if self.fields is not None:
+            sentence_generator = (
+                sentence
+                for sentence in parse_incr_lean(fin, self.fields)
+                if self.prefilter_with_length_limits(len(sentence))
+            )
+        else:
+            sentence_generator = (
+                parse_token_and_metadata(block)
+                for block in parse_sentences(fin)
+                if self.prefilter_with_length_limits(count_token_lines(block))
+            )
+        for sentence in sentence_generator:
+            # Freshly parsed sentences are not shared, so in copy-free mode they need no copy
+            sentence = self.process_sentence(mark_owned(sentence))
+
+            if not self.filter_with_length_limits(sentence):
+                continue
+
+            if self.compact and not isinstance(sentence, CompactSentence):
+                sentence = CompactSentence.from_tokenlist(sentence)
+
+            yield sentence
+
+    def iter_load_range(self, infile: Path, start: int, stop: int):
+        """
+        Loads sentences start to stop (by position in the file) using the sentence index
+        stored next to the file, which is built if it does not exist.
+        """
+        index = SentenceIndex.load_or_build(infile)
+        offset, length = index.byte_range(start, min(stop, len(index)))
+        data = read_byte_range(infile, offset, length).decode("utf-8")
+        yield from self._iter_parse_stream(io.StringIO(data, newline=None))
+
+    def load_sentence_by_id(self, infile: Path, sent_id: str):
+        """Loads a single sentence by sent_id. Returns None if it is excluded by the length limits"""
+        index = SentenceIndex.load_or_build(infile)
+        position = index.position(sent_id)
+        return next(self.iter_load_range(infile, position, position + 1), None)
 
     def iter_load_glob(self, indir: Path, glob_pattern: str):
+        infiles = self.glob_treebanks(indir, glob_pattern)
+
+        for infile, sentences in self.iter_load_files(infiles):
+            yield from sentences
+
+    @staticmethod
+    def glob_treebanks(indir: Path, glob_pattern: str):
+        """Globs for treebanks, skipping the sentence and inverted indices stored next to them"""
         indir_path = Path(indir)
-        infiles = indir_path.glob(glob_pattern)
+        for infile in indir_path.glob(glob_pattern):
+            if infile.suffix not in (INDEX_SUFFIX, POSTINGS_SUFFIX):
+                yield infile
+
+    def iter_load_files(self, infiles: Iterable[Path]):
+        """
+        Yields (infile, sentences) for each file in the order given.
+        With more than one worker, files are loaded in a process pool, with at most
+        two tasks per worker loaded ahead of the one being consumed. If chunk_size is set,
+        uncompressed files are loaded as chunks of sentences in separate tasks and merged back in order,
+        and a sentence index is built next to each of them that has none.
+        """
+        if self.workers <= 1:
+            for infile in infiles:
+                yield infile, self.iter_load_treebank(infile)
+            return
+
+        # Chunks are merged lazily, so the sentences of each file must be consumed before the next file
+        results = self._iter_load_tasks_in_pool(self._iter_load_tasks(infiles))
+        for (_, infile), chunks in itertools.groupby(results, key=lambda result: result[:2]):
+            yield infile, (sentence for _, _, sentences in chunks for sentence in sentences)
+
+    def _iter_load_tasks(self, infiles: Iterable[Path]):
+        """Yields (file number, infile, start, stop) tasks, with start and stop None for whole files"""
+        for i, infile in enumerate(infiles):
+            # Cached and indexed loading work on whole files
+            if (
+                self.chunk_size is None
+                or self.cache is not None
+                or self.inverted_index
+                or compression_suffix(infile)
+            ):
+                yield i, infile, None, None
+                continue
+
+            chunk_ranges = SentenceIndex.load_or_build(infile).chunk_ranges(self.chunk_size)
+            for start, stop in chunk_ranges or [(0, 0)]:
+                yield i, infile, start, stop
+
+    def _iter_load_tasks_in_pool(self, tasks: Iterable):
+        """
+        Yields (file number, infile, sentences) for each task in order. Tasks that have not started
+        are cancelled if the consumer stops early.
+        """
+        max_in_flight = self.workers * 2
+        in_flight = deque()
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker_loader, initargs=(self,)
+        ) as executor:
+            try:
+                for i, infile, start, stop in tasks:
+                    future = executor.submit(_load_treebank_in_worker, infile, start, stop)
+                    in_flight.append((i, infile, future))
+                    if len(in_flight) >= max_in_flight:
+                        i, infile, future = in_flight.popleft()
+                        yield i, infile, future.result()
+
+                while in_flight:
+                    i, infile, future = in_flight.popleft()
+                    yield i, infile, future.result()
+            finally:
+                for _, _, future in in_flight:
+                    future.cancel()
 
-        for infile in infiles:
-            yield from self.iter_load_treebank(infile)
+    def iter_load_corpus(self, corpus_dir: Path, start: int = 0, stop: int = None):
+        """
+        Loads compact sentences from a columnar corpus made with build_columnar_corpus.py.
+        The cleaner and selector are applied as for conllu input, so they must only use
+        fields that compact sentences hold.
+        """
+        corpus = ColumnarCorpus(corpus_dir)
+        for sentence in corpus.iter_sentences(start, stop):
+            sentence = self.process_sentence(sentence)
+
+            if self.filter_with_length_limits(sentence):
+                yield sentence
+
+    def prefilter_with_length_limits(self, n_tokens: int):
+        """
+        Checks the number of tokens of a sentence before it is cleaned and selected. Cleaned sentences
+        are checked again with filter_with_length_limits.
+
+        This relies on cleaning and selection never adding tokens: the cleaner only removes them, and
+        the selector keeps a sentence whole or empties it. Sentences that are too short can then always
+        be skipped. Sentences that are too long can be skipped if the cleaner removes no tokens, and
+        if min_len is above 0, since otherwise a sentence emptied by the selector would be kept.
+        A cleaner or selector that adds tokens would need this check to change.
+        """
+        if n_tokens < self.min_len:
+            return False
+        if n_tokens > self.max_len and not self.cleaner.remove_config and self.min_len > 0:
+            return False
+        return True
 
     def filter_with_length_limits(self, sentence: TokenList):
         if self.min_len <= len(sentence) <= self.max_len:
@@ -78,6 +330,128 @@ class TreebankLoader:
             return False
 
 
+# Loader used by the processes of TreebankLoader.iter_load_files
+_worker_loader: TreebankLoader = None
+
+
+def _init_worker_loader(loader: TreebankLoader):
+    global _worker_loader
+    _worker_loader = loader
+
+
+def _load_treebank_in_worker(infile: Path, start: int = None, stop: int = None):
+    if start is None:
+        return list(_worker_loader.iter_load_treebank(infile))
+    return list(_worker_loader.iter_load_range(infile, start, stop))
+
+
+def _iter_sentence_blocks(infile: Path, positions: Iterable[int] = None):
+    """
+    Yields (offset, length, block) for the sentences of an uncompressed file at the given positions,
+    or for every sentence, using the sentence index stored next to the file
+    """
+    index = SentenceIndex.load_or_build(infile)
+    if positions is None:
+        positions = range(len(index))
+
+    with open(infile, "rb") as fin:
+        for position in positions:
+            offset, length = int(index.offsets[position]), int(index.lengths[position])
+            fin.seek(offset)
+            yield offset, length, fin.read(length).decode("utf-8")
+
+
+def count_token_lines(block: str):
+    """Counts the lines of a conllu sentence block that are regular tokens, i.e. have an integer id"""
+    n_tokens = 0
+    for line in block.split("\n"):
+        if line[:1].isdigit() and line.split("\t", 1)[0].isdigit():
+            n_tokens += 1
+    return n_tokens
+
+
+LEAN_FIELDS = ("id", "form", "upos", "head", "deprel")
+LEAN_REQUIRED_FIELDS = ("id", "head", "deprel")
+
+
+def _check_lean_fields(fields: Iterable[str]):
+    fields = tuple(fields)
+    for field in fields:
+        if field not in LEAN_FIELDS:
+            raise ValueError(
+                f"Field {field} cannot be loaded in lean mode. Choose from {', '.join(LEAN_FIELDS)}"
+            )
+    for field in LEAN_REQUIRED_FIELDS:
+        if field not in fields:
+            raise ValueError(f"Field {field} is required in lean mode")
+    return tuple(field for field in LEAN_FIELDS if field in fields)
+
+
+def _check_lean_query_fields(fields: Iterable[str], selector: SentenceSelector):
+    # A query on a field that is not loaded would quietly match no sentences
+    missing = sorted(set(selector.query_fields) - set(fields))
+    if missing:
+        raise ValueError(
+            f"The selector query uses fields that are not loaded in lean mode: {', '.join(missing)}. "
+            f"Loaded fields: {', '.join(fields)}"
+        )
+
+
+def parse_incr_lean(fin: TextIO, fields: Iterable[str] = LEAN_REQUIRED_FIELDS):
+    """
+    Lightweight alternative to conllu.parse_incr that only reads the named columns.
+    Multi-word tokens and empty nodes are skipped before their columns are split,
+    and each sentence is yielded as a CompactSentence.
+    """
+    keep_form = "form" in fields
+    keep_upos = "upos" in fields
+
+    metadata = Metadata()
+    heads, deprels, upos, forms = [], [], [], []
+
+    for line in fin:
+        if line.startswith("#"):
+            metadata.update(parse_comment_line(line))
+            continue
+
+        line = line.rstrip("\r\n")
+        if not line:
+            if heads or metadata:
+                yield CompactSentence.from_strings(
+                    heads,
+                    deprels,
+                    upos if keep_upos else None,
+                    forms if keep_form else None,
+                    metadata,
+                )
+            metadata = Metadata()
+            heads, deprels, upos, forms = [], [], [], []
+            continue
+
+        token_id, rest = line.split("\t", 1)
+        if not token_id.isdigit():
+            # Multi-word token (1-2) or empty node (1.1)
+            continue
+
+        # Split no further than deprel, leaving deps and misc unparsed
+        columns = rest.split("\t", 7)
+        heads.append(int(columns[5]) if columns[5] != "_" else MISSING_HEAD)
+        deprels.append(columns[6])
+        if keep_upos:
+            upos.append(columns[2])
+        if keep_form:
+            forms.append(columns[0])
+
+    if heads or metadata:
+        yield CompactSentence.from_strings(
+            heads,
+            deprels,
+            upos if keep_upos else None,
+            forms if keep_form else None,
+            metadata,
+        )
+
+
 class SanityChecks:
     """
     General sanity checks to make sure a oonllu sentence is not malformed
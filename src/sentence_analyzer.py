@@ -4,6 +4,13 @@ from dataclasses import dataclass, field
 from conllu import Token, TokenList, TokenTree
 import numpy as np
 
+from src.compact_sentence import CompactSentence, DEPREL_VOCAB
+from src.sentence_permuter import (
+    optimal_dependency_lengths,
+    random_projective_dependency_length_moments,
+)
+from src.utils.treeutils import HeadTree
+
 class SentenceAnalyzer:
     def __init__(
         self,
@@ -12,11 +19,23 @@ class SentenceAnalyzer:
         language: str = None,
         count_root: bool = False,
         aggregate=False,
+        expected_dl=False,
     ):
         self._init_token_analyzers(
             token_analyzers, w2v=w2v, language=language, count_root=count_root
         )
         self.aggregate = aggregate
+        # With expected_dl, aggregate output also has the total DL of the sentence as permuted, with
+        # its exact expectation and variance over RandomProjective permutations to compare it with
+        self.expected_dl_analyzer = None
+        if expected_dl:
+            if not aggregate or "DependencyLength" not in token_analyzers:
+                raise ValueError(
+                    "expected_dl requires aggregate output and the DependencyLength analyzer"
+                )
+            self.expected_dl_analyzer = ExpectedDependencyLengthAnalyzer(
+                count_root=count_root
+            )
 
     def _init_token_analyzers(
         self,
@@ -28,6 +47,10 @@ class SentenceAnalyzer:
         self.token_analyzers = []
         if "DependencyLength" in analyzers:
             self.token_analyzers.append(DependencyLengthAnalyzer(count_root=count_root))
+        if "OptimalDependencyLength" in analyzers:
+            self.token_analyzers.append(
+                OptimalDependencyLengthAnalyzer(count_root=count_root)
+            )
         if "IntervenerComplexity" in analyzers:
             self.token_analyzers.append(
                 IntervenerComplexityAnalyzer(count_root=count_root)
@@ -53,8 +76,14 @@ class SentenceAnalyzer:
             for analyzer_name, analysis_values in analyses.items():
                 analysis_values = list(analysis_values)
                 output_json.update({analyzer_name: np.abs(np.nansum(analysis_values)).item()})
+                if analyzer_name == "DL" and self.expected_dl_analyzer is not None:
+                    output_json["TotalDL"] = np.nansum(np.abs(analysis_values)).item()
+            if self.expected_dl_analyzer is not None:
+                output_json.update(self.expected_dl_analyzer.moments(sentence))
             return output_json
         else:
+            if isinstance(sentence, CompactSentence):
+                sentence = sentence.to_tokenlist()
             for analyzer_name, analysis_values in analyses.items():
                 for i, (token, value) in enumerate(zip(sentence, analysis_values)):
                     if sentence[i]["misc"] is None:
@@ -87,6 +116,9 @@ class DependencyLengthAnalyzer(SentenceTokensAnalyzer):
             return distance
 
     def _process_tokens(self, tokenlist: Union[TokenList, Iterator[Token]]):
+        if isinstance(tokenlist, CompactSentence):
+            return self._process_compact_sentence(tokenlist)
+
         scores = []
         for token in tokenlist:
             if not isinstance(token["id"], int):
@@ -94,6 +126,12 @@ class DependencyLengthAnalyzer(SentenceTokensAnalyzer):
             scores.append(self._process_token(token))
         return scores
 
+    def _process_compact_sentence(self, sentence: CompactSentence):
+        scores = sentence.ids - sentence.heads
+        if not self.count_root:
+            scores[sentence.heads == 0] = 0
+        return scores.tolist()
+
     def process_sentence(
         self, tokenlist: Union[TokenList, Iterator[Token]], aggregate=False
     ):
@@ -101,6 +139,47 @@ class DependencyLengthAnalyzer(SentenceTokensAnalyzer):
         return scores
 
 
+class OptimalDependencyLengthAnalyzer(DependencyLengthAnalyzer):
+    """
+    Dependency lengths of the sentence as permuted by OptimalProjectivePermuter, computed from its
+    head array without permuting it. Token values are in the original token order, so this is
+    meant for aggregate output, where it gives the same DL as permuting and then analyzing.
+    """
+
+    def _process_tokens(self, tokenlist: Union[TokenList, Iterator[Token]]):
+        tree = HeadTree.from_sentence(tokenlist)
+        return optimal_dependency_lengths(tree, count_root=self.count_root)
+
+
+class ExpectedDependencyLengthAnalyzer:
+    """
+    Aggregate output of the exact mean and variance of the total dependency length of each sentence
+    over RandomProjective permutations, in place of sampling permutations.
+
+    The total is the sum of the absolute dependency lengths of the sentence, as ExpectedTotalDL and
+    VarianceTotalDL. This is not the aggregate DL column, which is the absolute value of the sum of
+    signed lengths; the comparable sampled value is TotalDL (see SentenceAnalyzer).
+    """
+
+    def __init__(self, count_root=False):
+        self.count_root = count_root
+
+    def moments(self, sentence: TokenList):
+        # The moments depend only on the tree, so a permuted sentence gives those of its original
+        mean, variance = random_projective_dependency_length_moments(
+            HeadTree.from_sentence(sentence), count_root=self.count_root
+        )
+        return {"ExpectedTotalDL": mean, "VarianceTotalDL": variance}
+
+    def process_sentence(self, sentence: TokenList, **kwargs):
+        output_json = {
+            "ID": sentence.metadata["sent_id"],
+            "Length": len(sentence),
+        }
+        output_json.update(self.moments(sentence))
+        return output_json
+
+
 class IntervenerComplexityAnalyzer(SentenceTokensAnalyzer):
 
     name = "ICM"
@@ -125,6 +204,11 @@ class IntervenerComplexityAnalyzer(SentenceTokensAnalyzer):
         return n_intervening_heads
 
     def _process_tokens(self, tokenlist: Union[TokenList, Iterator[Token]]):
+        if isinstance(tokenlist, CompactSentence):
+            return self._process_compact_sentence(tokenlist)
+        return self._process_tokenlist(tokenlist)
+
+    def _process_tokenlist(self, tokenlist: Union[TokenList, Iterator[Token]]):
 
         mapping = make_tokens_mapping(tokenlist)
 
@@ -134,6 +218,23 @@ class IntervenerComplexityAnalyzer(SentenceTokensAnalyzer):
 
             yield self._process_token(mapping, token)
 
+    def _process_compact_sentence(self, sentence: CompactSentence):
+        ids, heads = sentence.ids, sentence.heads
+
+        # Prefix counts of tokens (including the root position 0) that have dependents
+        is_head = np.zeros(len(sentence) + 1, dtype=np.int32)
+        is_head[heads] = 1
+        n_heads_upto = np.cumsum(is_head)
+
+        lo = np.where(ids < heads, ids + 1, heads)
+        hi = np.where(ids < heads, heads, ids - 1)
+        n_below_lo = np.where(lo > 0, n_heads_upto[lo - 1], 0)
+        scores = n_heads_upto[hi] - n_below_lo
+
+        if not self.count_root:
+            scores[heads == 0] = 0
+        return scores.tolist()
+
     def process_sentence(
         self, tokenlist: Union[TokenList, Iterator[Token]], aggregate=False
     ):
@@ -159,10 +260,37 @@ class HeadDependentDepthAnalyzer(SentenceTokensAnalyzer):
             return self._process_token(mapping, head_token) + 1
 
     def _process_tokens(self, tokenlist: TokenList):
+        if isinstance(tokenlist, CompactSentence):
+            return self._process_compact_sentence(tokenlist)
         mapping = make_tokens_mapping(tokenlist)
         result = list(self._process_token(mapping, token) for token in tokenlist)
         return result
 
+    def _process_compact_sentence(self, sentence: CompactSentence):
+        root_code = DEPREL_VOCAB.encode("root")
+        heads = sentence.heads.tolist()
+        deprels = sentence.deprels.tolist()
+
+        depths = {0: 0 if self.count_root else -1}
+        result = []
+        for token_id in range(1, len(sentence) + 1):
+            # Walk up to the nearest token of known depth, then fill in the chain
+            chain = []
+            current = token_id
+            while current not in depths:
+                if deprels[current - 1] == root_code:
+                    depths[current] = 1 if self.count_root else 0
+                    break
+                chain.append(current)
+                current = heads[current - 1]
+
+            depth = depths[current]
+            for chain_id in reversed(chain):
+                depth += 1
+                depths[chain_id] = depth
+            result.append(depths[token_id])
+        return result
+
 
     def process_sentence(self, sentence: TokenList, aggregate=False, **kwargs):
         pass
@@ -189,6 +317,10 @@ class SemanticSimilarityAnalyzer(SentenceTokensAnalyzer):
         return self.word_cosine(token_form, head_form)
 
     def _process_tokens(self, tokenlist: Union[TokenList, Iterator[Token]]):
+        if isinstance(tokenlist, CompactSentence):
+            yield from self._process_compact_sentence(tokenlist)
+            return
+
         mapping = make_tokens_mapping(tokenlist)
         for token in tokenlist:
             if not isinstance(token["id"], int):
@@ -202,6 +334,18 @@ class SemanticSimilarityAnalyzer(SentenceTokensAnalyzer):
 
                 yield self.word_cosine(token_form, head_form)
 
+    def _process_compact_sentence(self, sentence: CompactSentence):
+        forms = sentence.form_strings()
+        if forms is None:
+            raise ValueError(
+                "SemanticSimilarity analysis needs the form field, which this sentence was loaded without"
+            )
+        for token_form, head in zip(forms, sentence.heads.tolist()):
+            if head == 0:
+                yield np.nan
+            else:
+                yield self.word_cosine(token_form, forms[head - 1])
+
     def process_sentence(
         self, tokenlist: Union[TokenList, Iterator[Token]], aggregate=False
     ):
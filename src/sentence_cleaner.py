@@ -1,7 +1,10 @@
-from typing import List, Dict, Tuple, AnyStr
+from typing import List, Dict, Iterable, AnyStr, Set, Tuple
 
-from conllu import TokenList
+import numpy as np
+from conllu import Token, TokenList
+from conllu.models import traverse_dict
 
+from src.compact_sentence import CompactSentence, UPOS_VOCAB, FORM_VOCAB, DEPREL_VOCAB
 from src.utils.abstractclasses import SentencePreProcessor
 from src.utils.treeutils import standardize_deprels
 
@@ -23,12 +26,30 @@ class SentenceCleaner(SentencePreProcessor):
         self.remove_config = (
             [obj for obj in remove_config] if remove_config is not None else []
         )
+        self.remove_matcher = RemoveRuleMatcher(self.remove_config)
         self.fields_to_empty = (
             fields_to_empty if isinstance(fields_to_empty, list) else []
         )
         self.mask_words = mask_words
         self.standardize_deprels = standardize_deprels
 
+    def config(self):
+        return {
+            "remove_config": self.remove_config,
+            "fields_to_empty": self.fields_to_empty,
+            "mask_words": self.mask_words,
+            "standardize_deprels": self.standardize_deprels,
+        }
+
+    def unchanged_fields(self, fields: Iterable[str]) -> List[str]:
+        """The fields among those given whose values are not changed by cleaning"""
+        changed_fields = set(self.fields_to_empty)
+        if self.mask_words:
+            changed_fields.update(("form", "lemma"))
+        if self.standardize_deprels:
+            changed_fields.add("deprel")
+        return [field for field in fields if field not in changed_fields]
+
     @deepcopy_tokenlist
     def process_sentence(self, sentence: TokenList, **kwargs):
         sentence = self.remove_nonstandard_tokens(sentence)
@@ -42,34 +63,41 @@ class SentenceCleaner(SentencePreProcessor):
 
     def remove_tokens(self, tokenlist: TokenList):
 
-        remove_ids = set()
-
         # Find ids of tokens that would initially be removed by the filters
-        for filter_item in self.remove_config:
-            ids = (token["id"] for token in tokenlist.filter(**filter_item))
-            remove_ids.update(ids)
+        remove_ids = self.remove_matcher.match_ids(tokenlist)
 
-        # While loop to find tokens in subtrees of removed items
-        stack = list(remove_ids)  # Initialise as remove ids found at top level
-        queue: List[Tuple] = [(token["id"], token["head"]) for token in tokenlist]
+        if not remove_ids:
+            return tokenlist
 
+        # Walk down from the removed tokens to find the tokens in their subtrees
+        children = self._children_index(tokenlist)
+        stack = list(remove_ids)
         while stack:
-
-            new_ids = []
-            for i, (dep_id, head_id) in enumerate(queue):
-                if head_id in stack:
-                    new_ids.append(dep_id)
-            remove_ids.update(stack)
-            stack = new_ids  # Terminate when there are no new ids
-            queue = list((di, hi) for (di, hi) in queue if di not in stack)
-
-        remove_ids = list(remove_ids)
+            for dep_id in children.get(stack.pop(), ()):
+                if dep_id not in remove_ids:
+                    remove_ids.add(dep_id)
+                    stack.append(dep_id)
 
         tokenlist = self.remove_tokens_by_id(tokenlist, remove_ids)
 
         return tokenlist
 
+    @staticmethod
+    def _children_index(tokenlist: TokenList) -> Dict[int, List[int]]:
+        if isinstance(tokenlist, CompactSentence):
+            id_head_pairs = zip(tokenlist.ids.tolist(), tokenlist.heads.tolist())
+        else:
+            id_head_pairs = ((token["id"], token["head"]) for token in tokenlist)
+
+        children: Dict[int, List[int]] = {}
+        for dep_id, head_id in id_head_pairs:
+            children.setdefault(head_id, []).append(dep_id)
+        return children
+
     def empty_fields(self, tokenlist: TokenList):
+        if isinstance(tokenlist, CompactSentence):
+            return self._empty_compact_fields(tokenlist)
+
         new_tokenlist = tokenlist.copy()
         for i, token in enumerate(new_tokenlist):
             for field in self.fields_to_empty:
@@ -81,16 +109,30 @@ class SentenceCleaner(SentencePreProcessor):
                     new_tokenlist[i][field] = "_"
         return new_tokenlist
 
+    def _empty_compact_fields(self, sentence: CompactSentence):
+        # Compact sentences only hold form and upos; other fields are already empty
+        new_sentence = sentence.copy()
+        if "form" in self.fields_to_empty:
+            new_sentence.forms = None
+        if "upos" in self.fields_to_empty:
+            new_sentence.upos = None
+        return new_sentence
+
     @staticmethod
     def remove_nonstandard_tokens(tokenlist: TokenList):
         """
         Removes any non-standard tokens, such as multi-word tokens or
         enhanced dependencies, from the sentence.
         """
+        if isinstance(tokenlist, CompactSentence):
+            return tokenlist
         return tokenlist.filter(id=lambda x: isinstance(x, int))
 
     @staticmethod
-    def remove_tokens_by_id(tokenlist: TokenList, ids: List[int]):
+    def remove_tokens_by_id(tokenlist: TokenList, ids: Iterable[int]):
+        ids = set(ids)
+        if isinstance(tokenlist, CompactSentence):
+            return tokenlist.select(~np.isin(tokenlist.ids, list(ids)))
         return tokenlist.filter(id=lambda x: x not in ids)
 
     def mask_token_lexicon(self, tokenlist: TokenList):
@@ -98,6 +140,12 @@ class SentenceCleaner(SentencePreProcessor):
         token form and lemma with [sent_id]+[token_id], e.g. 4-1, 4-2, ..., 4-n"""
         sent_id = tokenlist.metadata["sent_id"]
         tokenlist.metadata["text"] = "*MASKED*"
+        if isinstance(tokenlist, CompactSentence):
+            tokenlist.forms = FORM_VOCAB.encode_many(
+                f"f{sent_id}-{token_id}" for token_id in tokenlist.ids.tolist()
+            )
+            return tokenlist
+
         for i, token in enumerate(tokenlist):
             token_id = token["id"]
             replace_value = f"f{sent_id}-{token_id}"
@@ -105,3 +153,123 @@ class SentenceCleaner(SentencePreProcessor):
             tokenlist[i]["lemma"] = replace_value
 
         return tokenlist
+
+
+_COMPACT_FIELD_VOCABS = {
+    "deprel": ("deprels", DEPREL_VOCAB),
+    "upos": ("upos", UPOS_VOCAB),
+    "form": ("forms", FORM_VOCAB),
+}
+
+
+class RemoveRuleMatcher:
+    """
+    Matches tokens against all the rules of a remove config in a single pass.
+
+    Rules are grouped by the fields they test and the values of each group are held in a set,
+    so each token is looked up once per group of fields rather than tested once per rule.
+    Rules with values that cannot be hashed (e.g. callables) are tested one by one as with
+    TokenList.filter.
+    """
+
+    def __init__(self, rules: List[Dict]):
+        self.value_sets: Dict[Tuple[str, ...], Set[Tuple]] = {}
+        self.fallback_rules: List[Dict] = []
+
+        for rule in rules:
+            fields = tuple(sorted(rule))
+            values = tuple(rule[field] for field in fields)
+            if _is_hashable(values) and not any(callable(value) for value in values):
+                self.value_sets.setdefault(fields, set()).add(values)
+            else:
+                self.fallback_rules.append(rule)
+
+    def __bool__(self):
+        return bool(self.value_sets or self.fallback_rules)
+
+    def matches(self, token: Token) -> bool:
+        for fields, values in self.value_sets.items():
+            key = tuple(traverse_dict(token, field) for field in fields)
+            try:
+                if key in values:
+                    return True
+            except TypeError:
+                # Unhashable token values (e.g. feats dicts) cannot equal the rule values
+                continue
+        return any(_token_matches_rule(token, rule) for rule in self.fallback_rules)
+
+    def match_ids(self, tokenlist: TokenList) -> Set[int]:
+        if not self:
+            return set()
+        if isinstance(tokenlist, CompactSentence):
+            return self._match_compact_ids(tokenlist)
+        return {token["id"] for token in tokenlist if self.matches(token)}
+
+    def _match_compact_ids(self, sentence: CompactSentence) -> Set[int]:
+        match = np.zeros(len(sentence), dtype=bool)
+
+        for fields, values in self.value_sets.items():
+            if len(fields) == 1:
+                # All rules on the same single field are matched with one lookup over the codes
+                codes, vocab = _compact_field_codes(sentence, fields[0])
+                value_codes = [vocab.encode(value) for (value,) in values if value in vocab]
+                match |= np.isin(codes, value_codes)
+            else:
+                for rule_values in values:
+                    match |= _compact_rule_match(sentence, dict(zip(fields, rule_values)))
+
+        for rule in self.fallback_rules:
+            match |= _compact_rule_match(sentence, rule)
+
+        return set(sentence.ids[match].tolist())
+
+
+def _is_hashable(value) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _token_matches_rule(token: Token, rule: Dict) -> bool:
+    for query, value in rule.items():
+        token_value = traverse_dict(token, query)
+        if callable(value) and value(token_value) is True:
+            continue
+        if token_value != value:
+            return False
+    return True
+
+
+def _compact_rule_match(sentence: CompactSentence, rule: Dict) -> np.ndarray:
+    match = np.ones(len(sentence), dtype=bool)
+    for field, value in rule.items():
+        match &= _compact_field_equals(sentence, field, value)
+    return match
+
+
+def _compact_field_codes(sentence: CompactSentence, field: str):
+    if field not in _COMPACT_FIELD_VOCABS:
+        raise ValueError(
+            f"Compact sentences do not hold field {field}; it cannot be used to remove tokens"
+        )
+    attribute, vocab = _COMPACT_FIELD_VOCABS[field]
+    codes = getattr(sentence, attribute)
+    if codes is None:
+        raise ValueError(f"Field {field} has been emptied in this compact sentence")
+    return codes, vocab
+
+
+def _compact_field_equals(sentence: CompactSentence, field: str, value) -> np.ndarray:
+    codes, vocab = _compact_field_codes(sentence, field)
+    if callable(value):
+        # Callables are tested on the strings, as they are for TokenLists
+        return np.fromiter(
+            (value(string) is True for string in vocab.decode_many(codes)),
+            dtype=bool,
+            count=len(codes),
+        )
+    if not _is_hashable(value) or value not in vocab:
+        return np.zeros(len(sentence), dtype=bool)
+    return codes == vocab.encode(value)
@@ -0,0 +1,159 @@
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from src.utils.fileutils import compression_suffix, file_signature
+
+INDEX_SUFFIX = ".idx"
+SENT_ID_KEY = b"sent_id"
+
+
+class SentenceIndex:
+    """
+    Byte offsets of the sentence blocks in a conllu file.
+
+    Each entry holds the offset and length in bytes of a sentence block (including its
+    terminating blank line) and its sent_id. The index is stored next to the file as <file>.idx
+    together with the size and modification time of the file, so stale indices are rebuilt.
+    """
+
+    def __init__(
+        self,
+        offsets: np.ndarray,
+        lengths: np.ndarray,
+        sent_ids: List[str],
+        source_size: int,
+        source_mtime: int,
+    ):
+        self.offsets = offsets
+        self.lengths = lengths
+        self.sent_ids = sent_ids
+        self.source_size = source_size
+        self.source_mtime = source_mtime
+        self._positions = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def index_path(infile: Path):
+        infile = Path(infile)
+        return Path(infile.parent, f"{infile.name}{INDEX_SUFFIX}")
+
+    @classmethod
+    def build(cls, infile: Path):
+        if compression_suffix(infile):
+            raise ValueError(
+                f"Cannot index compressed file {infile}; byte offsets need an uncompressed file"
+            )
+
+        offsets, lengths, sent_ids = [], [], []
+
+        with open(infile, "rb") as fin:
+            position = 0
+            block_start = None
+            sent_id = ""
+            for line in fin:
+                if line.strip():
+                    if block_start is None:
+                        block_start = position
+                        sent_id = ""
+                    if line.startswith(b"#"):
+                        key, _, value = line[1:].partition(b"=")
+                        if key.strip() == SENT_ID_KEY:
+                            sent_id = value.strip().decode("utf-8")
+                elif block_start is not None:
+                    # Blank line terminates the block and is included in it
+                    offsets.append(block_start)
+                    lengths.append(position + len(line) - block_start)
+                    sent_ids.append(sent_id)
+                    block_start = None
+                position += len(line)
+
+            if block_start is not None:
+                offsets.append(block_start)
+                lengths.append(position - block_start)
+                sent_ids.append(sent_id)
+
+        size, mtime = file_signature(infile)
+        return cls(
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(lengths, dtype=np.int64),
+            sent_ids,
+            size,
+            mtime,
+        )
+
+    def save(self, index_file: Path):
+        with open(index_file, "w", encoding="utf-8") as fout:
+            print(f"# size = {self.source_size}", file=fout)
+            print(f"# mtime = {self.source_mtime}", file=fout)
+            for offset, length, sent_id in zip(
+                self.offsets.tolist(), self.lengths.tolist(), self.sent_ids
+            ):
+                print(f"{offset}\t{length}\t{sent_id}", file=fout)
+
+    @classmethod
+    def load(cls, index_file: Path):
+        offsets, lengths, sent_ids = [], [], []
+        with open(index_file, encoding="utf-8") as fin:
+            source_size = int(fin.readline().split("=")[1])
+            source_mtime = int(fin.readline().split("=")[1])
+            for line in fin:
+                offset, length, sent_id = line.rstrip("\n").split("\t", 2)
+                offsets.append(int(offset))
+                lengths.append(int(length))
+                sent_ids.append(sent_id)
+        return cls(
+            np.asarray(offsets, dtype=np.int64),
+            np.asarray(lengths, dtype=np.int64),
+            sent_ids,
+            source_size,
+            source_mtime,
+        )
+
+    @classmethod
+    def load_or_build(cls, infile: Path, save: bool = True):
+        """Loads the index stored next to the file, building it if it is missing or stale"""
+        index_file = cls.index_path(infile)
+        if index_file.exists():
+            index = cls.load(index_file)
+            if (index.source_size, index.source_mtime) == file_signature(infile):
+                return index
+            logging.info(f"Sentence index is stale: {index_file}")
+
+        logging.info(f"Building sentence index: {index_file}")
+        index = cls.build(infile)
+        if save:
+            index.save(index_file)
+        return index
+
+    def position(self, sent_id: str) -> int:
+        if self._positions is None:
+            self._positions = {sid: i for i, sid in enumerate(self.sent_ids)}
+        if sent_id not in self._positions:
+            raise KeyError(f"No sentence with sent_id {sent_id} in index")
+        return self._positions[sent_id]
+
+    def byte_range(self, start: int, stop: int) -> Tuple[int, int]:
+        """Returns the (offset, length) of the bytes spanning sentences start to stop"""
+        if start >= stop:
+            return 0, 0
+        offset = int(self.offsets[start])
+        end = int(self.offsets[stop - 1] + self.lengths[stop - 1])
+        return offset, end - offset
+
+    def chunk_ranges(self, chunk_size: int) -> List[Tuple[int, int]]:
+        """Splits the file into (start, stop) sentence ranges of at most chunk_size sentences"""
+        return [
+            (start, min(start + chunk_size, len(self)))
+            for start in range(0, len(self), chunk_size)
+        ]
+
+
+def read_byte_range(infile: Path, offset: int, length: int) -> bytes:
+    with open(infile, "rb") as fin:
+        fin.seek(offset)
+        return fin.read(length)
@@ -1,11 +1,13 @@
 import logging
 import random
-from typing import Callable, List, Dict
+from typing import Callable, List, Dict, Sequence, Tuple, Union
 from collections import defaultdict
 
-from conllu import TokenList, TokenTree
+import numpy as np
+from conllu import TokenList
 
-from src.utils.treeutils import get_tree_weight, Node
+from src.compact_sentence import CompactSentence
+from src.utils.treeutils import HeadTree
 from src.utils.decorators import (
     preserve_metadata,
     fix_token_indices,
@@ -15,6 +17,13 @@ from src.utils.abstractclasses import SentenceMainProcessor
 
 
 class SentencePermuter(SentenceMainProcessor):
+    """
+    Permutes sentences projectively by linearising each head with its dependant branches.
+
+    The permutation is computed on the head array of the sentence (see HeadTree) as a vector of
+    nodes in their new linear order, and the permuted sentence is only built from it at the end.
+    """
+
     fileext = ".conllu"
 
     _shuffle_left = False
@@ -23,40 +32,81 @@ class SentencePermuter(SentenceMainProcessor):
     _reverse_right = False
 
     @deepcopy_tokenlist
-    def process_sentence(self, sentence: TokenList, **kwargs):
-        permuted_sentence = self.permutation_function(sentence)
+    def process_sentence(
+        self, sentence: TokenList, tree: HeadTree = None, order: List[int] = None, **kwargs
+    ):
+        permuted_sentence = self.permutation_function(sentence, tree=tree, order=order)
         return permuted_sentence
 
     @preserve_metadata
     @fix_token_indices
-    def permutation_function(self, sentence: TokenList):
-        sentence_tree = sentence.to_tree()
-        nodetree = self.build_tree(sentence_tree)
-        new_sentence = self._make_new_tokenlist_from_tree(nodetree)
-        return new_sentence
-
-    def _make_new_tokenlist_from_tree(self, nodetree: Node):
-        tokens = list(nodetree.traverse())
-        new_sentence = TokenList(tokens)
-        return new_sentence
-
-    def build_tree(self, tokentree: TokenTree):
-        left = []
-        right = []
-
-        children = self._ordering_function(tokentree.children)
+    def permutation_function(
+        self, sentence: TokenList, tree: HeadTree = None, order: List[int] = None
+    ):
+        """
+        :param tree: The HeadTree of the sentence, if already built, e.g. to share it between permuters
+        :param order: The permutation order, if already computed, e.g. by a FixedOrderGrammarBatch
+        """
+        if order is None:
+            if tree is None:
+                tree = HeadTree.from_sentence(sentence)
+            order = self.permutation_order(tree)
+        if isinstance(sentence, CompactSentence):
+            return sentence.reorder(order)
+        return TokenList([sentence[node - 1] for node in order])
+
+    def permutation_order(self, tree: HeadTree) -> List[int]:
+        """
+        :return: The nodes (token positions 1..n) of the tree in their permuted linear order
+        """
+        order = self.build_order(tree, tree.root())
+        # Skip the root node that stands in for several root tokens
+        return [node for node in order if node != 0]
+
+    def build_order(self, tree: HeadTree, node: int) -> List[int]:
+        """
+        Linearises the subtree of the node, without recursion so that deep trees do not reach the
+        recursion limit. Each node's dependants are ordered when it is entered, each branch is
+        placed once its subtree is built, and the branches are arranged when the node is left,
+        which is the same order of random draws as a depth-first recursion.
+        """
+        offsets = tree.offsets
+        stack = [self._enter_branch(tree, node, None)]
+        while True:
+            parent = stack[-1]
+            if parent.i < len(parent.children):
+                child = parent.children[parent.i]
+                if offsets[child] < offsets[child + 1]:
+                    stack.append(self._enter_branch(tree, child, parent))
+                    continue
+                # A leaf is a branch of its own, and makes no random draws to order and arrange
+                new_branch = child
+            else:
+                stack.pop()
+                new_branch = self._linearise(parent.node, parent.left, parent.right)
+                if not stack:
+                    return _flatten_branch([new_branch])
+                parent = stack[-1]
 
-        for i, subtree in enumerate(children):
-            new_branch = self.build_tree(subtree)
-            branch_direction: int = self._directionality_function(subtree)
+            branch_direction: int = self._branch_direction(tree, parent)
 
             if branch_direction < 0:
-                left.append(new_branch)
+                parent.left.append(new_branch)
             elif branch_direction > 0:
-                right.append(new_branch)
+                parent.right.append(new_branch)
             else:
                 raise ValueError("Directionality function must return [-1,1]")
+            parent.i += 1
+
+    def _enter_branch(self, tree: HeadTree, node: int, parent: "_BranchFrame"):
+        children = self._ordering_function(tree, tree.children(node))
+        return _BranchFrame(node, children)
+
+    def _branch_direction(self, tree: HeadTree, frame: "_BranchFrame") -> int:
+        """Direction of the current dependant branch of the frame"""
+        return self._directionality_function(tree, frame.children[frame.i])
 
+    def _linearise(self, node: int, left: List[list], right: List[list]) -> list:
         if self._shuffle_left:
             random.shuffle(left)
         if self._shuffle_right:
@@ -66,24 +116,19 @@ class SentencePermuter(SentenceMainProcessor):
         if self._reverse_right:
             right.reverse()
 
-        permutation_tree = Node.make_node(
-            centre=tokentree.token, left=left, right=right
-        )
-        return permutation_tree
-
-    def _directionality_function(self, subtree: TokenTree) -> int:
-        # Must be overriden with a function that takes subtree as an argument and returns [-1,1]
-        head_position = subtree.token["head"]
-        dependent_position = subtree.token["id"]
+        # Branches stay nested until the whole tree is built, so deep trees are not copied per level
+        return [*left, node, *right]
 
-        if dependent_position < head_position:
+    def _directionality_function(self, tree: HeadTree, node: int) -> int:
+        # Must be overriden with a function that takes a node as an argument and returns [-1,1]
+        if tree.is_left_dependant(node):
             return -1
         else:
             return 1
 
-    def _ordering_function(self, tree_children: List[TokenTree]):
+    def _ordering_function(self, tree: HeadTree, children: List[int]):
         # Override this as necessary
-        return tree_children
+        return children
 
 
 class RandomProjectivePermuter(SentencePermuter):
@@ -91,7 +136,7 @@ class RandomProjectivePermuter(SentencePermuter):
     _shuffle_left = True
     _shuffle_right = True
 
-    def _directionality_function(self, subtree: TokenTree, **kwargs) -> int:
+    def _directionality_function(self, tree: HeadTree, node: int, **kwargs) -> int:
         return random.choice([-1, 1])
 
 
@@ -108,55 +153,28 @@ class RandomSameValencyPermuter(SentencePermuter):
     _shuffle_left = True
     _shuffle_right = True
 
-    @deepcopy_tokenlist
-    def build_tree(self, tokentree: TokenTree):
-        left = []
-        right = []
-
-        children = self._ordering_function(tokentree.children)
+    def _enter_branch(self, tree: HeadTree, node: int, parent: "_BranchFrame"):
+        frame = super()._enter_branch(tree, node, parent)
 
         # Find the number of tokens that can be on the left
-        left_branches: int = sum(
-            1 for child in children if child.token["id"] < child.token["head"]
-        )
-
-        for i, subtree in enumerate(children):
-            new_branch = self.build_tree(subtree)
-            branch_direction: int = self._directionality_function(
-                subtree, i, left_branches
-            )
-
-            if branch_direction < 0:
-                left.append(new_branch)
-            elif branch_direction > 0:
-                right.append(new_branch)
-            else:
-                raise ValueError("Directionality function must return [-1,1]")
+        frame.n_left = sum(1 for child in frame.children if tree.is_left_dependant(child))
+        return frame
 
-        if self._shuffle_left:
-            random.shuffle(left)
-        if self._shuffle_right:
-            random.shuffle(right)
-        if self._reverse_left:
-            left.reverse()
-        if self._reverse_right:
-            right.reverse()
-
-        permutation_tree = Node.make_node(
-            centre=tokentree.token, left=left, right=right
+    def _branch_direction(self, tree: HeadTree, frame: "_BranchFrame") -> int:
+        return self._directionality_function(
+            tree, frame.children[frame.i], frame.i, frame.n_left
         )
-        return permutation_tree
 
     def _directionality_function(
-        self, subtree: TokenTree, i: int = 0, n_left: int = 0
+        self, tree: HeadTree, node: int, i: int = 0, n_left: int = 0
     ) -> int:
         if i < n_left:
             return -1
         else:
             return 1
 
-    def _ordering_function(self, tree_children: List[TokenTree]):
-        return random.sample(tree_children, len(tree_children))
+    def _ordering_function(self, tree: HeadTree, children: List[int]):
+        return random.sample(children, len(children))
 
 
 class OptimalProjectivePermuter(SentencePermuter):
@@ -164,55 +182,164 @@ class OptimalProjectivePermuter(SentencePermuter):
 
     _reverse_left = True
 
-    def build_tree(self, tokentree: TokenTree, isRight=False):
-        left = []
-        right = []
+    def _enter_branch(self, tree: HeadTree, node: int, parent: "_BranchFrame"):
+        frame = super()._enter_branch(tree, node, parent)
+        frame.is_right = parent is not None and self._branch_direction(tree, parent) > 0
+        return frame
 
-        children = self._ordering_function(tokentree.children)
+    def _branch_direction(self, tree: HeadTree, frame: "_BranchFrame") -> int:
+        i = frame.i
+        nChildrenIsOdd = len(frame.children) % 2 != 0
 
-        nChildrenIsOdd = len(children) % 2 != 0
+        # We need to reverse the direction in light of number of children
+        if frame.is_right and nChildrenIsOdd:
+            i += 1
+        elif not frame.is_right and not nChildrenIsOdd:
+            i += 1
 
-        for i, subtree in enumerate(children):
+        return self._directionality_function(tree, frame.children[frame.i], i)
 
-            # We need to reverse the direction in light of number of children
-            if isRight and nChildrenIsOdd:
-                i += 1
-            elif not isRight and not nChildrenIsOdd:
-                i += 1
+    def _directionality_function(self, tree: HeadTree, node: int, i=0) -> int:
+        if i % 2 == 0:
+            return -1
+        else:
+            return 1
 
-            branch_direction: int = self._directionality_function(subtree, i)
+    def _ordering_function(self, tree: HeadTree, children: List[int]):
+        # Subtree weights are computed once per sentence and shared by all nodes
+        weights = tree.subtree_weights()
+        return sorted(children, key=weights.__getitem__)
+
+
+def optimal_dependency_lengths(
+    tree: Union[HeadTree, Sequence[int]], count_root: bool = False
+) -> List[int]:
+    """
+    Signed dependency lengths (dependant minus head position, as DependencyLengthAnalyzer) of the
+    tokens of a sentence when linearised by OptimalProjectivePermuter, computed from subtree weights
+    without building the permuted sentence.
+
+    Dependants are placed inside out by weight, alternating sides as in the permuter, so the
+    distance of a dependant from its head is the weight of the siblings placed between them plus
+    the weight of its own subtree on the side facing the head.
+
+    :param tree: The HeadTree of the sentence, or its head array
+    :param count_root: If true, root tokens hold their position (their distance to 0), else 0
+    :return: The lengths of the tokens in their original order; unreachable tokens hold 0
+    """
+    if not isinstance(tree, HeadTree):
+        tree = HeadTree.from_heads(tree)
+
+    weights = tree.subtree_weights()
+    root = tree.root()
+
+    n_nodes = len(tree.ids)
+    is_right = [False] * n_nodes
+    # Weight of the siblings placed between each dependant and its head
+    between = [0] * n_nodes
+    # Weight of the dependants placed to the left of each node
+    left_weights = [0] * n_nodes
+
+    for node in tree.breadth_first_nodes():
+        if root != 0 and node == 0:
+            continue
+
+        children = sorted(tree.children(node), key=weights.__getitem__)
+        nChildrenIsOdd = len(children) % 2 != 0
 
-            if branch_direction < 0:
-                new_branch = self.build_tree(subtree, isRight=False)
-                left.append(new_branch)
-            elif branch_direction > 0:
-                new_branch = self.build_tree(subtree, isRight=True)
-                right.append(new_branch)
+        left_weight = right_weight = 0
+        for i, child in enumerate(children):
+            # Direction as in OptimalProjectivePermuter; each side is filled from the head outwards
+            if is_right[node] == nChildrenIsOdd:
+                i += 1
+            if i % 2 == 0:
+                between[child] = left_weight
+                left_weight += weights[child]
             else:
-                raise ValueError("Directionality function must return [-1,1]")
+                is_right[child] = True
+                between[child] = right_weight
+                right_weight += weights[child]
+        left_weights[node] = left_weight
+
+    lengths = [0] * n_nodes
+    for node in tree.breadth_first_nodes()[1:]:
+        if is_right[node]:
+            lengths[node] = between[node] + left_weights[node] + 1
+        else:
+            lengths[node] = -(weights[node] - left_weights[node] + between[node])
+
+    # Roots hold their position, skipping the root node that stands in for several root tokens
+    for node in tree.children(0):
+        if not count_root:
+            lengths[node] = 0
+        elif root == 0:
+            lengths[node] += left_weights[0] + 1 - is_right[node]
+        else:
+            lengths[node] = left_weights[node] + 1
 
-        if self._shuffle_left:
-            random.shuffle(left)
-        if self._shuffle_right:
-            random.shuffle(right)
-        if self._reverse_left:
-            left.reverse()
-        if self._reverse_right:
-            right.reverse()
+    return lengths[1:]
 
-        permutation_tree = Node.make_node(
-            centre=tokentree.token, left=left, right=right
-        )
-        return permutation_tree
 
-    def _directionality_function(self, subtree: TokenTree, i=0) -> int:
-        if i % 2 == 0:
-            return -1
-        else:
-            return 1
+def optimal_dependency_length(tree: Union[HeadTree, Sequence[int]]) -> int:
+    """Minimum total projective dependency length of a sentence, not counting the root"""
+    return sum(abs(length) for length in optimal_dependency_lengths(tree))
+
+
+def random_projective_dependency_length_moments(
+    tree: Union[HeadTree, Sequence[int]], count_root: bool = False
+) -> Tuple[float, float]:
+    """
+    Exact mean and variance of the total dependency length (sum of absolute lengths) of a sentence
+    over the permutations of RandomProjectivePermuter, computed from subtree weights in one pass.
+
+    Each dependant is placed on either side of its head with equal probability, and the branches on
+    each side are shuffled, so a dependant of weight w is separated from its head by itself, by each
+    sibling with probability 1/4, and by each of its own dependants with probability 1/2. For a head
+    with k dependants of total weight W and total squared weight Q, the sibling terms contribute
+    ((k^2 + 7k - 6)Q - (k + 1)W^2) / 48 to the variance, and the terms of the dependants' own
+    dependants contribute Q / 4 to it for each dependant, uncorrelated with the sibling terms.
 
-    def _ordering_function(self, tree_children: List[TokenTree]):
-        return sorted(tree_children, key=get_tree_weight)
+    :param tree: The HeadTree of the sentence, or its head array
+    :param count_root: If true, the positions of root tokens (their distance to 0) are included
+    :return: (mean, variance)
+    """
+    if not isinstance(tree, HeadTree):
+        tree = HeadTree.from_heads(tree)
+
+    weights = tree.subtree_weights()
+    head_nodes = tree.head_nodes.tolist()
+    # Sentences without a root cannot be permuted
+    tree.root()
+
+    mean = 0.0
+    variance = 0.0
+    for node in tree.breadth_first_nodes()[1:]:
+        children = tree.children(node)
+        if not children:
+            continue
+
+        k = len(children)
+        child_weights = [weights[child] for child in children]
+        W = sum(child_weights)
+        Q = sum(weight * weight for weight in child_weights)
+
+        mean += k + (k - 1) * W / 4 + (W - k) / 2
+        variance += ((k * k + 7 * k - 6) * Q - (k + 1) * W * W) / 48
+
+        # Part of each dependant's subtree facing the head, or facing 0 for roots
+        if head_nodes[node] != 0 or count_root:
+            variance += Q / 4
+
+    if count_root:
+        # Root tokens are in a uniformly random order, each also preceded by its own left dependants
+        roots = tree.children(0)
+        k = len(roots)
+        W = sum(weights[root] for root in roots)
+        Q = sum(weights[root] ** 2 for root in roots)
+        mean += k * (W + 1) / 2
+        variance += (k + 1) * (k * Q - W * W) / 12
+
+    return mean, variance
 
 
 class FixedOrderPermuter(SentencePermuter):
@@ -222,15 +349,155 @@ class FixedOrderPermuter(SentencePermuter):
         super().__init__()
         self.grammar = defaultdict(float, grammar)
 
-    def _lookup_deprel(self, subtree: TokenTree):
-        return self.grammar[subtree.token["deprel"]]
+    def _lookup_deprel(self, tree: HeadTree, node: int):
+        return self.grammar[tree.deprels[node]]
 
-    def _ordering_function(self, tree_children: List[TokenTree]):
-        return sorted(tree_children, key=lambda child: abs(self._lookup_deprel(child)))
+    def _ordering_function(self, tree: HeadTree, children: List[int]):
+        return sorted(children, key=lambda child: abs(self._lookup_deprel(tree, child)))
 
-    def _directionality_function(self, subtree: TokenTree) -> int:
-        position_value: float = self._lookup_deprel(subtree)
+    def _directionality_function(self, tree: HeadTree, node: int) -> int:
+        position_value: float = self._lookup_deprel(tree, node)
         if position_value < 0:
             return -1
         else:
             return 1
+
+
+class _BranchFrame:
+    """A node whose dependant branches are being built by SentencePermuter.build_order"""
+
+    __slots__ = ("node", "children", "i", "left", "right", "n_left", "is_right")
+
+    def __init__(self, node: int, children: List[int]):
+        self.node = node
+        self.children = children
+        self.i = 0
+        self.left = []
+        self.right = []
+
+        # Used by RandomSameValencyPermuter and OptimalProjectivePermuter respectively
+        self.n_left = 0
+        self.is_right = False
+
+
+def _flatten_branch(branch: list) -> List[int]:
+    order = []
+    stack = [iter(branch)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, list):
+                stack.append(iter(item))
+                break
+            order.append(item)
+        else:
+            stack.pop()
+    return order
+
+
+class FixedOrderGrammarBatch:
+    """
+    Linearises sentences under many fixed order grammars at once, giving the same orders as a
+    FixedOrderPermuter for each grammar.
+
+    The grammars are held as a matrix of grammars x deprels. For each sentence, the deprel values of
+    its tokens are looked up for all grammars at once, and the siblings under each head are sorted
+    by value in one lexsort over the whole matrix: left dependants (negative values) outermost first,
+    then right dependants innermost first. Subtree sizes do not depend on the grammar, so the
+    position of each token follows from the sizes of the siblings placed before it.
+    """
+
+    def __init__(self, grammars: List[Dict]):
+        deprels = sorted({deprel for grammar in grammars for deprel in grammar})
+        self.deprel_columns = {deprel: i for i, deprel in enumerate(deprels)}
+
+        # Deprels missing from a grammar have value 0, as with the defaultdict of FixedOrderPermuter.
+        # The last column is for deprels missing from all grammars.
+        self.values = np.zeros((len(grammars), len(deprels) + 1), dtype=np.float64)
+        for i, grammar in enumerate(grammars):
+            for deprel, value in grammar.items():
+                self.values[i, self.deprel_columns[deprel]] = value
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def from_permuters(cls, permuters: List[SentencePermuter]):
+        """Returns a batch of the grammars of the permuters, or None unless all are FixedOrderPermuters"""
+        if not permuters or not all(
+            type(permuter) is FixedOrderPermuter for permuter in permuters
+        ):
+            return None
+        return cls([permuter.grammar for permuter in permuters])
+
+    def permutation_orders(self, tree: HeadTree) -> np.ndarray:
+        """
+        :return: Array of grammars x tokens, with the nodes (token positions 1..n) of the tree
+                 in their linear order under each grammar
+        """
+        # Nodes reachable from the root, in breadth-first order so that heads come before dependants
+        root = tree.root()
+        nodes = tree.breadth_first_nodes()
+        if root != 0:
+            nodes = nodes[1:]
+        n_nodes = len(nodes)
+        n_grammars = len(self.values)
+
+        local = {node: i for i, node in enumerate(nodes)}
+        head_nodes = tree.head_nodes.tolist()
+        heads = np.asarray([-1] + [local[head_nodes[node]] for node in nodes[1:]])
+        weights = np.asarray(tree.subtree_weights())[nodes]
+        columns = [
+            self.deprel_columns.get(tree.deprels[node], len(self.deprel_columns))
+            for node in nodes
+        ]
+
+        values = self.values[:, columns]
+        is_left = values < 0
+
+        # Siblings by value, ties in linear order on the right and reversed on the left
+        indices = np.arange(n_nodes)
+        ties = np.where(is_left, -indices, indices)
+        sorted_indices = np.lexsort((ties, values, np.broadcast_to(heads, values.shape)))
+
+        # Sibling groups are at the same positions in every row, since heads are the primary key
+        sorted_heads = heads[sorted_indices[0]]
+        group_starts = np.flatnonzero(np.diff(sorted_heads, prepend=-2))
+        group_sizes = np.diff(group_starts, append=n_nodes)
+
+        # Size of the siblings placed before each node within its head's span, plus the head itself
+        # for right dependants
+        sorted_weights = weights[sorted_indices]
+        preceding = np.cumsum(sorted_weights, axis=1) - sorted_weights
+        preceding -= np.repeat(preceding[:, group_starts], group_sizes, axis=1)
+        offsets = np.empty((n_grammars, n_nodes), dtype=np.int64)
+        np.put_along_axis(offsets, sorted_indices, preceding, axis=1)
+        offsets += ~is_left
+
+        # Size of the left dependant subtrees of each node
+        left_weights = np.zeros((n_grammars, n_nodes), dtype=np.int64)
+        dependants = indices[1:]
+        np.add.at(
+            left_weights,
+            (slice(None), heads[dependants]),
+            weights[dependants] * is_left[:, dependants],
+        )
+
+        # Start of the span of each node, accumulated level by level from the root
+        starts = np.zeros((n_grammars, n_nodes), dtype=np.int64)
+        depths = np.zeros(n_nodes, dtype=np.int64)
+        for i in dependants.tolist():
+            depths[i] = depths[heads[i]] + 1
+        for depth in range(1, int(depths.max()) + 1):
+            level = np.flatnonzero(depths == depth)
+            starts[:, level] = starts[:, heads[level]] + offsets[:, level]
+
+        positions = starts + left_weights
+        orders = np.empty((n_grammars, n_nodes), dtype=np.int64)
+        np.put_along_axis(
+            orders, positions, np.broadcast_to(np.asarray(nodes), positions.shape), axis=1
+        )
+
+        # Skip the root node that stands in for several root tokens
+        if root == 0:
+            orders = orders[orders != 0].reshape(n_grammars, n_nodes - 1)
+        return orders
@@ -1,34 +1,125 @@
-from typing import List, Dict, SupportsInt, AnyStr, Union
+from typing import List, Dict, SupportsInt, AnyStr, Union, Iterable
 
+import numpy as np
 from conllu import Token, TokenList
 
+from src.compact_sentence import CompactSentence
+from src.inverted_index import InvertedIndex
 from src.utils.decorators import (
     fix_token_indices,
     preserve_metadata,
     deepcopy_tokenlist,
 )
 from src.utils.abstractclasses import SentencePreProcessor
-from src.utils.sentence_selector_functions import sentence_recursive_match
+from src.utils.sentence_selector_functions import (
+    QueryBatch,
+    compile_query,
+    sentence_matches,
+)
 from src.utils.recursive_query import Query, make_query_from_dict
 
 TOKEN_FIELDS = ("form", "lemma", "upos", "xpos", "deprel")
 
+# Query fields that compact sentences can hold, by the attribute that holds them
+COMPACT_FIELD_ATTRIBUTES = {"form": "forms", "upos": "upos", "deprel": "deprels"}
+
+
+def check_compact_query_fields(query_fields: Iterable[str], sentence: CompactSentence):
+    """
+    Raises ValueError if a query constrains a field that the compact sentence does not hold, since
+    the query would then quietly match nothing
+    """
+    for field in query_fields:
+        attribute = COMPACT_FIELD_ATTRIBUTES.get(field)
+        if attribute is None or getattr(sentence, attribute) is None:
+            raise ValueError(
+                f"The query uses field {field}, which this compact sentence does not hold; "
+                "load it as a TokenList or with the field to select sentences with it"
+            )
+
 
 class SentenceSelector(SentencePreProcessor):
     def __init__(self, query: dict = None):
         if query is None:
             query = {}
         self.query = make_query_from_dict(query)
+        self.matcher = compile_query(self.query)
+        self.query_fields = self.matcher.field_names()
+
+    def config(self):
+        return {"query": repr(self.query)}
+
+    def candidate_positions(
+        self, index: InvertedIndex, fields: Iterable[str] = TOKEN_FIELDS
+    ) -> Union[np.ndarray, None]:
+        """
+        Positions of the sentences of an indexed file that can match the query, by intersecting the
+        posting lists of the literal field values that the query requires. Only the given fields are
+        used, so that fields changed by cleaning can be left out.
+        Returns None if the query requires no literal values in those fields.
+        """
+        fields = set(fields)
+        field_values = [
+            (field, value)
+            for field, value in self.matcher.required_field_values()
+            if field in fields
+        ]
+        return index.intersect(field_values)
 
     @deepcopy_tokenlist
     def process_sentence(self, sentence: TokenList, **kwargs):
-        matching_tokens = sentence_recursive_match(self.query, sentence)
+        if isinstance(sentence, CompactSentence):
+            return self._process_compact_sentence(sentence)
 
-        # TODO: The recursive match is currently broken and does not return dependant matches below the first level,
+        # TODO: The recursive match does not return dependant matches below the first level,
         #       though the absence of them still cause the query to fail as expected
         #       Until it is fixed, return the full sentence
 
-        if len(matching_tokens) > 0:
+        if sentence_matches(self.matcher, sentence):
             return sentence
         else:
             return TokenList()
+
+    def _process_compact_sentence(self, sentence: CompactSentence):
+        # An empty query matches every sentence, so there is no need to convert
+        if self.query == Query():
+            return sentence
+
+        check_compact_query_fields(self.query_fields, sentence)
+        if sentence_matches(self.matcher, sentence.to_tokenlist()):
+            return sentence
+        else:
+            return sentence.select(np.zeros(len(sentence), dtype=bool))
+
+
+class MultiQuerySelector:
+    """
+    Matches each sentence against several queries in a single pass.
+
+    Each query may hold a "name" key, used to name its output; otherwise queries are named
+    query_<n> by their position.
+    """
+
+    def __init__(self, queries: List[dict]):
+        self.names = []
+        self.queries = []
+        for i, query in enumerate(queries):
+            query = dict(query)
+            self.names.append(str(query.pop("name", f"query_{i}")))
+            self.queries.append(make_query_from_dict(query))
+
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Query names must be unique")
+
+        self.batch = QueryBatch(self.queries)
+        self.query_fields = set().union(*(query.field_names() for query in self.batch.queries))
+
+    def config(self):
+        return {"queries": {name: repr(query) for name, query in zip(self.names, self.queries)}}
+
+    def matching_queries(self, sentence: TokenList) -> List[int]:
+        """Indices of the queries that match the sentence"""
+        if isinstance(sentence, CompactSentence):
+            check_compact_query_fields(self.query_fields, sentence)
+            sentence = sentence.to_tokenlist()
+        return self.batch.matching_queries(sentence)
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import List, Dict, Union
+
+CACHE_VERSION = 1
+CACHE_EXTENSION = ".pickle"
+
+
+class TreebankCache:
+    """
+    On-disk cache of loaded treebanks.
+
+    Entries are keyed by a hash of the input file contents together with the loader configuration
+    (cleaner, selector and length limits), so a change to either produces a new entry.
+    Sentences are stored after cleaning and selection as a pickled list.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def make_key(self, infile: Path, loader_config: Dict):
+        hasher = hashlib.sha256()
+        hasher.update(f"v{CACHE_VERSION}".encode("utf-8"))
+        hasher.update(json.dumps(loader_config, sort_keys=True, default=str).encode("utf-8"))
+        hasher.update(file_digest(infile).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _entry_path(self, key: str):
+        return Path(self.cache_dir, f"{key}{CACHE_EXTENSION}")
+
+    def load(self, key: str) -> Union[List, None]:
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return None
+        logging.info(f"Loading cached treebank: {entry_path}")
+        with open(entry_path, "rb") as fin:
+            return pickle.load(fin)
+
+    def store(self, key: str, sentences: List):
+        entry_path = self._entry_path(key)
+        logging.info(f"Caching treebank: {entry_path}")
+
+        # Write to a temporary file first so that interrupted runs leave no partial entry
+        temp_path = Path(self.cache_dir, f"{key}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as fout:
+            pickle.dump(sentences, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path)
+
+
+def file_digest(infile: Path, chunk_size: int = 1 << 20) -> str:
+    hasher = hashlib.sha256()
+    with open(infile, "rb") as fin:
+        for chunk in iter(lambda: fin.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
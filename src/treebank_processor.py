@@ -1,9 +1,14 @@
 import copy
+import pickle
+import tempfile
 from abc import ABC, abstractmethod
-from typing import List
+from array import array
+from typing import Callable, Iterator, List
 
 from src.sentence_analyzer import SentenceAnalyzer
-from src.sentence_permuter import SentencePermuter
+from src.sentence_permuter import SentencePermuter, FixedOrderGrammarBatch
+from src.utils.decorators import copy_free_enabled, is_owned, mark_owned
+from src.utils.treeutils import HeadTree
 
 
 class TreebankProcessor(ABC):
@@ -20,13 +25,41 @@ class TreebankProcessor(ABC):
 
 
 class TreebankPermuter(TreebankProcessor):
-    def __init__(self, sentence_permuters: List[SentencePermuter]):
+    """
+    Permutes a treebank once per permuter, yielding the output of each permuter in turn.
+
+    By default the treebank is copied for each permuter. In sentence-major mode, each sentence is
+    instead given to all permuters before moving on to the next, with its tree built once, and the
+    output is buffered on disk so that it is still yielded permuter by permuter. Random
+    permutations are drawn in a different order in the two modes, so for the same seed they differ.
+
+    Fixed order permuters are deterministic, so they are always run sentence-major, with each
+    sentence linearised under all of their grammars at once by a FixedOrderGrammarBatch.
+    """
+
+    def __init__(
+        self, sentence_permuters: List[SentencePermuter], sentence_major: bool = False
+    ):
         super().__init__()
         self.sentence_permuters = sentence_permuters
+        self.grammar_batch = _make_grammar_batch(sentence_permuters)
+        self.sentence_major = sentence_major or self.grammar_batch is not None
 
     def process_treebank(self, treebank: list, **kwargs):
-        for permuter in self.sentence_permuters:
-            new_treebank = copy.deepcopy(treebank)  # Avoids modifying previous output
+        if self.sentence_major:
+            yield from _permute_sentence_major(
+                treebank,
+                self.sentence_permuters,
+                lambda sentence: sentence,
+                self.grammar_batch,
+                **kwargs,
+            )
+            return
+
+        for i, permuter in enumerate(self.sentence_permuters):
+            new_treebank = _copy_treebank_for_permuter(
+                treebank, i, len(self.sentence_permuters)
+            )
             for sentence in new_treebank:
                 yield permuter.process_sentence(sentence, **kwargs)
 
@@ -47,17 +80,109 @@ class TreebankPermuterAnalyzer(TreebankProcessor):
         self,
         sentence_permuters: List[SentencePermuter],
         sentence_analyzer: SentenceAnalyzer,
+        sentence_major: bool = False,
     ):
         super().__init__()
         self.sentence_permuters = sentence_permuters
         self.sentence_analyzer = sentence_analyzer
 
+        # See TreebankPermuter
+        self.grammar_batch = _make_grammar_batch(sentence_permuters)
+        self.sentence_major = sentence_major or self.grammar_batch is not None
+
     def process_treebank(self, treebank: list, **kwargs):
-        for permuter in self.sentence_permuters:
-            new_treebank = copy.deepcopy(treebank)  # Avoids modifying previous output
+        if self.sentence_major:
+            yield from _permute_sentence_major(
+                treebank,
+                self.sentence_permuters,
+                self.sentence_analyzer.process_sentence,
+                self.grammar_batch,
+                **kwargs,
+            )
+            return
+
+        for i, permuter in enumerate(self.sentence_permuters):
+            new_treebank = _copy_treebank_for_permuter(
+                treebank, i, len(self.sentence_permuters)
+            )
             for sentence in new_treebank:
                 permuted_sentence = permuter.process_sentence(sentence, **kwargs)
                 analyzed_sentence = self.sentence_analyzer.process_sentence(
                     permuted_sentence
                 )
                 yield analyzed_sentence
+
+
+def _copy_treebank_for_permuter(treebank: list, i: int, n_permuters: int):
+    # In copy-free mode the last permuter consumes the treebank in place
+    if copy_free_enabled() and i == n_permuters - 1:
+        return treebank
+    return copy.deepcopy(treebank)  # Avoids modifying previous output
+
+
+class PermuterOutputBuffer:
+    """
+    Output of several permuters, appended sentence by sentence to a temporary file and read back
+    permuter by permuter. Only the offsets of the items are held in memory.
+    """
+
+    def __init__(self, n_permuters: int):
+        self.file = tempfile.TemporaryFile()
+        self.offsets = [array("q") for _ in range(n_permuters)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def append(self, i: int, data_item):
+        self.offsets[i].append(self.file.tell())
+        pickle.dump(data_item, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __iter__(self) -> Iterator:
+        self.file.flush()
+        for offsets in self.offsets:
+            for offset in offsets:
+                self.file.seek(offset)
+                yield pickle.load(self.file)
+
+
+def _permute_sentence_major(
+    treebank: list,
+    permuters: List[SentencePermuter],
+    postprocess: Callable,
+    grammar_batch: FixedOrderGrammarBatch = None,
+    **kwargs,
+):
+    with PermuterOutputBuffer(len(permuters)) as buffer:
+        for sentence in treebank:
+            tree = HeadTree.from_sentence(sentence)
+            orders = (
+                grammar_batch.permutation_orders(tree).tolist()
+                if grammar_batch is not None
+                else [None] * len(permuters)
+            )
+            for i, permuter in enumerate(permuters):
+                permuted_sentence = permuter.process_sentence(
+                    _copy_sentence_for_permuter(sentence, i, len(permuters)),
+                    tree=tree,
+                    order=orders[i],
+                    **kwargs,
+                )
+                buffer.append(i, postprocess(permuted_sentence))
+        yield from buffer
+
+
+def _make_grammar_batch(permuters: List[SentencePermuter]):
+    # A single grammar is permuted as fast on its own
+    if len(permuters) < 2:
+        return None
+    return FixedOrderGrammarBatch.from_permuters(permuters)
+
+
+def _copy_sentence_for_permuter(sentence, i: int, n_permuters: int):
+    # Owned sentences are permuted in place, so all but the last permuter get their own copy
+    if is_owned(sentence) and i < n_permuters - 1:
+        return mark_owned(copy.deepcopy(sentence))
+    return sentence
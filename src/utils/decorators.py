@@ -1,20 +1,66 @@
 from conllu import TokenList
+from conllu.models import Metadata
 from functools import wraps, singledispatch
 import copy
 from typing import Callable
 
-from src.utils.treeutils import make_index_mapping
+from src.compact_sentence import CompactSentence
 from src.utils.abstractclasses import SentenceProcessor
 
 
+# Copy-free mode: sentences are copied once when they enter the pipeline and are marked as owned,
+# so later stages mutate them in place instead of each taking its own deep copy.
+# Only enable this when no caller holds on to sentences after passing them to a stage.
+_COPY_FREE = False
+OWNED_ATTRIBUTE = "_owned_by_pipeline"
+
+
+def set_copy_free(enabled: bool = True):
+    global _COPY_FREE
+    _COPY_FREE = enabled
+
+
+def copy_free_enabled() -> bool:
+    return _COPY_FREE
+
+
+def is_owned(tokenlist) -> bool:
+    return _COPY_FREE and getattr(tokenlist, OWNED_ATTRIBUTE, False)
+
+
+def mark_owned(tokenlist):
+    """
+    Marks a TokenList as owned by the pipeline.
+    Compact sentences are not marked, since copying them is cheap.
+    """
+    if not _COPY_FREE:
+        return tokenlist
+
+    if isinstance(tokenlist, TokenList):
+        setattr(tokenlist, OWNED_ATTRIBUTE, True)
+
+    return tokenlist
+
+
 @singledispatch
 def deepcopy_tokenlist(function: Callable):
     @wraps(function)
     def inner(self: SentenceProcessor, tokenlist: TokenList, **kwargs):
-        new_tokenlist = copy.deepcopy(tokenlist)
+        if isinstance(tokenlist, CompactSentence):
+            new_tokenlist = tokenlist.copy()
+        elif is_owned(tokenlist):
+            # Tokens are shared, but the metadata is not, since preserve_metadata restores the
+            # input's metadata around a stage and so must see it unchanged, as with a deep copy.
+            # The copy is owned too, so that decorated stages called within do not copy it again.
+            new_tokenlist = mark_owned(
+                TokenList(tokenlist, Metadata(tokenlist.metadata), tokenlist.default_fields)
+            )
+        else:
+            new_tokenlist = copy.deepcopy(tokenlist)
         new_tokenlist = function(self, new_tokenlist, **kwargs)
 
-        return new_tokenlist
+        # The output is built from the copy, so the next stage may mutate it
+        return mark_owned(new_tokenlist)
 
     return inner
 
@@ -53,15 +99,29 @@ def fix_token_indices(function: Callable):
 
 def _fix_token_indices(tokenlist: TokenList):
 
-    index_mapping = make_index_mapping(tokenlist)
+    # Compact sentences are renumbered whenever tokens are removed or reordered
+    if isinstance(tokenlist, CompactSentence):
+        return tokenlist
+
+    if len(tokenlist) == 0:
+        return tokenlist
+
+    # Remap through an index array where index old_id holds the new id. For TokenList objects
+    # the array is a list, since converting the token values to numpy costs more than it saves.
+    ids = [token["id"] for token in tokenlist]
+    size = max(ids) + 1
+    new_ids = [0] * size
+    for new_id, token_id in enumerate(ids, start=1):
+        new_ids[token_id] = new_id
 
-    for i, token in enumerate(tokenlist):
-        token_id = token["id"]
+    for token, token_id in zip(tokenlist, ids):
         token_head = token["head"]
-        tokenlist[i]["id"] = index_mapping[token_id]
-        if token_head not in index_mapping:
-            tokenlist[i]["head"] = 0
+        token["id"] = new_ids[token_id]
+        if token_head is None:
+            continue
+        if 0 <= token_head < size:
+            token["head"] = new_ids[token_head]
         else:
-            tokenlist[i]["head"] = index_mapping[token_head]
+            token["head"] = 0
 
     return tokenlist
@@ -1,14 +1,67 @@
+import bz2
+import gzip
 import json
+import lzma
+import os
 from pathlib import Path
-from typing import Union, Dict
+from typing import Union, Dict, IO, Tuple
 import numpy as np
 
 from conllu import TokenList
 import logging
 
+from src.compact_sentence import CompactSentence
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+
+def compression_suffix(path: Path) -> str:
+    """Returns the compression suffix of a path, or an empty string if it is uncompressed"""
+    suffix = Path(path).suffix
+    return suffix if suffix in COMPRESSION_SUFFIXES else ""
+
+
+def open_file(path: Path, mode: str = "r", encoding: str = "utf-8") -> IO:
+    """
+    Opens a file for reading or writing, streaming through gzip, bz2, xz or zstd
+    according to the file extension. Files are opened as text unless the mode is binary.
+    """
+    suffix = compression_suffix(path)
+    if "b" in mode:
+        compressed_mode, encoding = mode, None
+    else:
+        compressed_mode = f"{mode}t"
+
+    if suffix == ".gz":
+        return gzip.open(path, compressed_mode, encoding=encoding)
+    elif suffix == ".bz2":
+        return bz2.open(path, compressed_mode, encoding=encoding)
+    elif suffix == ".xz":
+        return lzma.open(path, compressed_mode, encoding=encoding)
+    elif suffix == ".zst":
+        if zstandard is None:
+            raise ImportError(
+                f"The zstandard module is required to read or write {path}. Install it with pip install zstandard"
+            )
+        return zstandard.open(path, compressed_mode, encoding=encoding)
+    else:
+        return open(path, mode, encoding=encoding)
+
+
+def file_signature(path: Union[str, Path]) -> Tuple[int, int]:
+    """Returns the size and modification time of a file, for telling whether files stored next to it are stale"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
 
 def load_ndjson(ndjson_file: Path):
-    with open(ndjson_file, encoding="utf-8") as fin:
+    with open_file(ndjson_file) as fin:
         for line in fin:
             yield json.loads(line.strip())
 
@@ -16,6 +69,8 @@ def load_ndjson(ndjson_file: Path):
 def serialize_data_item(data_item: Union[TokenList, Dict]):
     if isinstance(data_item, TokenList):
         return data_item.serialize()
+    elif isinstance(data_item, CompactSentence):
+        return data_item.to_tokenlist().serialize()
     elif isinstance(data_item, dict):
         return json.dumps(data_item)
 
@@ -0,0 +1,32 @@
+from typing import Sequence
+
+import numpy as np
+
+
+def make_index_array(ids: Sequence[int], size: int = None) -> np.ndarray:
+    """
+    Index array mapping old token ids to new ids, for tokens in a new order.
+
+    :param ids: The old token ids in their new linear order
+    :param size: Length of the returned array; must exceed every old id and head
+    :return: Array where index old_id holds the new id (position 1..n), 0 for ids not in ids
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if size is None:
+        size = int(ids.max()) + 1 if len(ids) else 1
+    new_ids = np.zeros(size, dtype=np.int32)
+    new_ids[ids] = np.arange(1, len(ids) + 1, dtype=np.int32)
+    return new_ids
+
+
+def make_keep_index_array(keep: np.ndarray) -> np.ndarray:
+    """
+    Index array for keeping the tokens (ids 1..n) where the mask is true, in their original order.
+    New ids are the running count of kept tokens; removed tokens map to 0.
+    """
+    keep = np.asarray(keep, dtype=bool)
+    new_ids = np.zeros(len(keep) + 1, dtype=np.int32)
+    new_ids[1:] = np.cumsum(keep, dtype=np.int32)
+    new_ids[1:][~keep] = 0
+    return new_ids
+
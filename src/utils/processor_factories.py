@@ -1,4 +1,4 @@
-from src.sentence_analyzer import SentenceAnalyzer
+from src.sentence_analyzer import SentenceAnalyzer, ExpectedDependencyLengthAnalyzer
 from src.sentence_permuter import *
 from src.treebank_processor import (
     TreebankPermuter,
@@ -13,6 +13,7 @@ def sentence_analyzer_factory(
     w2v: dict = None,
     language: str = None,
     aggregate: bool = False,
+    expected_dl: bool = False,
 ):
     return SentenceAnalyzer(
         token_analyzers,
@@ -20,6 +21,7 @@ def sentence_analyzer_factory(
         w2v=w2v,
         language=language,
         aggregate=aggregate,
+        expected_dl=expected_dl,
     )
 
 
@@ -40,6 +42,18 @@ def treebank_analyzer_factory(
     return TreebankAnalyzer(sentence_analyzer)
 
 
+def treebank_optimal_dependency_length_factory(count_root: bool = False):
+    """Aggregate DL of the optimal orders of sentences, computed without permuting them"""
+    return treebank_analyzer_factory(
+        ["OptimalDependencyLength"], count_root=count_root, aggregate=True
+    )
+
+
+def treebank_expected_dependency_length_factory(count_root: bool = False):
+    """Exact mean and variance of the total DL of sentences over RandomProjective permutations"""
+    return TreebankAnalyzer(ExpectedDependencyLengthAnalyzer(count_root=count_root))
+
+
 def sentence_permuter_factory(mode: str, grammar: Dict = None):
     if mode == "RandomProjective":
         return RandomProjectivePermuter()
@@ -65,7 +79,9 @@ def sentence_permuter_factory(mode: str, grammar: Dict = None):
         )
 
 
-def treebank_permuter_factory(mode: str, grammars: List[Dict] = None, n_times=1):
+def treebank_permuter_factory(
+    mode: str, grammars: List[Dict] = None, n_times=1, sentence_major: bool = False
+):
     if isinstance(grammars, list) and mode == "FixedOrder":
         sentence_permuters = list(
             sentence_permuter_factory(mode, grammar=grammar) for grammar in grammars
@@ -76,7 +92,7 @@ def treebank_permuter_factory(mode: str, grammars: List[Dict] = None, n_times=1)
         )
     else:
         sentence_permuters = [sentence_permuter_factory(mode)]
-    return TreebankPermuter(sentence_permuters)
+    return TreebankPermuter(sentence_permuters, sentence_major=sentence_major)
 
 
 def treebank_permuter_analyzer_factory(
@@ -88,6 +104,8 @@ def treebank_permuter_analyzer_factory(
     w2v: dict = None,
     language: str = None,
     aggregate: bool = False,
+    sentence_major: bool = False,
+    expected_dl: bool = False,
 ):
     if isinstance(grammars, list) and permutation_mode == "FixedOrder":
         sentence_permuters = list(
@@ -107,6 +125,9 @@ def treebank_permuter_analyzer_factory(
         w2v=w2v,
         language=language,
         aggregate=aggregate,
+        expected_dl=expected_dl,
     )
 
-    return TreebankPermuterAnalyzer(sentence_permuters, sentence_analyzer)
+    return TreebankPermuterAnalyzer(
+        sentence_permuters, sentence_analyzer, sentence_major=sentence_major
+    )
@@ -1,210 +1,325 @@
 from src.utils.recursive_query import Query
 from conllu import Token, TokenList
-from typing import List, Generator, Union
-from dataclasses import dataclass, field
+from typing import List, Dict, Iterator, Set, Tuple, Union
 
 
-@dataclass
-class TokenEntry:
-    token: Token
-    head: Union[int, None]
-    children: List[int] = field(default_factory=list)
+# Token fields ordered so that the most selective are compared first
+QUERY_FIELD_ORDER = ("form", "lemma", "xpos", "deprel", "upos")
 
-    def has_children(self):
-        return len(self.children) > 0
+_MISSING = object()
 
-    def is_root(self):
-        return not isinstance(self.head, int)
 
+class CompiledQuery:
+    """
+    A Query compiled for matching.
+
+    The field constraints are held as (field, value) pairs with unset fields dropped, and the
+    dependant queries are checked with the required ones first, so that tokens that cannot
+    match are rejected as early as possible.
+    """
+
+    __slots__ = (
+        "fields",
+        "direction",
+        "n_required",
+        "head",
+        "dependants",
+        "dependant_check_order",
+        "test_ids",
+    )
+
+    def __init__(self, query: Query):
+        self.fields: Tuple[Tuple[str, str], ...] = tuple(
+            (field, getattr(query, field))
+            for field in QUERY_FIELD_ORDER
+            if getattr(query, field) is not None
+        )
+        self.direction = query.direction
+        self.n_required = query.n_required
+        self.head = CompiledQuery(query.head) if query.head is not None else None
+        self.dependants: Tuple[CompiledQuery, ...] = tuple(
+            CompiledQuery(dependant) for dependant in query.dependants or ()
+        )
+
+        # Required dependants first, then those with the tightest upper bound
+        self.dependant_check_order = sorted(
+            range(len(self.dependants)),
+            key=lambda i: (-self.dependants[i].n_required[0], self.dependants[i].n_required[1]),
+        )
+
+        # Ids of the field tests of this query in a QueryBatch, which evaluates them once per token
+        self.test_ids: Union[frozenset, None] = None
+
+    def iter_nodes(self) -> Iterator["CompiledQuery"]:
+        """This query and all of its head and dependant queries"""
+        yield self
+        if self.head is not None:
+            yield from self.head.iter_nodes()
+        for dependant in self.dependants:
+            yield from dependant.iter_nodes()
+
+    def field_names(self) -> Set[str]:
+        """The token fields constrained by this query or any of its head and dependant queries"""
+        return {field for node in self.iter_nodes() for field, _ in node.fields}
+
+    def required_field_values(self) -> List[Tuple[str, str]]:
+        """
+        The (field, value) pairs that any sentence matching the query must contain:
+        those of this query and of the head and dependant queries that must match at least once.
+        """
+        field_values = list(self.fields)
+        if self.head is not None and self.head.n_required[0] > 0:
+            field_values.extend(self.head.required_field_values())
+        for dependant in self.dependants:
+            if dependant.n_required[0] > 0:
+                field_values.extend(dependant.required_field_values())
+        return field_values
+
+    def fields_match(self, token: Token) -> bool:
+        for field, value in self.fields:
+            # Fields the token does not hold are not constrained
+            token_value = token.get(field, _MISSING)
+            if token_value is not _MISSING and token_value != value:
+                return False
+        return True
 
-class TokenMapping(dict):
-    def get_token(self, id_):
-        return self[id_].token
+    def direction_match(self, token: Token) -> bool:
+        if self.direction == 0:
+            return True
+        token_direction = 1 if token["id"] - token["head"] > 0 else -1
+        return token_direction == self.direction
 
-    def get_head_token(self, id_):
-        head_id = self[id_].head
-        return self.get_token(head_id)
 
-    def get_child_tokens(self, id_):
-        return [self.get_token(dep_id) for dep_id in self[id_].children]
+def compile_query(query: Union[Query, CompiledQuery]) -> CompiledQuery:
+    if isinstance(query, CompiledQuery):
+        return query
+    return CompiledQuery(query)
 
 
-def make_tokens_mapping(sentence: TokenList) -> TokenMapping:
+class ChildrenIndex:
+    """
+    Tokens of a sentence by id and the children of each token, built once per sentence.
+    Also holds the match results of (query node, token id) pairs, so that each pair is matched
+    once per sentence however often it is reached.
+    """
 
-    token_mapping = TokenMapping()
-    token_mapping.update({0: TokenEntry(Token(id=0, form="___root___"), None)})
+    __slots__ = ("tokens", "children", "token_tests", "matches")
 
-    for token in sentence:
-        if not isinstance(token["id"], int):
-            continue
-        token_mapping[token["id"]] = TokenEntry(token, token["head"])
+    def __init__(self, sentence: TokenList):
+        self.tokens: Dict[int, Token] = {}
+        self.children: Dict[int, List[Token]] = {}
 
-    for token in sentence:
-        token_mapping[token["head"]].children.append(token["id"])
+        # Ids of the QueryBatch field tests that each token passes, if evaluated for a batch
+        self.token_tests: Union[Dict[int, Set[int]], None] = None
 
-    return token_mapping
+        # (id of query node, token id) -> matched tokens or None
+        self.matches: Dict[Tuple[int, int], Union[List[Token], None]] = {}
 
+        for token in sentence:
+            if not isinstance(token["id"], int):
+                continue
+            self.tokens[token["id"]] = token
+            self.children.setdefault(token["head"], []).append(token)
 
-def _token_fields_match(query: Query, token: Token):
+    def get_head_token(self, token: Token) -> Union[Token, None]:
+        return self.tokens.get(token["head"])
 
-    query_token_fields = query.token_fields_dict()
+    def get_child_tokens(self, token: Token) -> List[Token]:
+        return self.children.get(token["id"], [])
 
-    for field, value in query_token_fields.items():
-        if value is None:
-            pass
-        elif field not in token:
-            pass
-        elif value != token[field]:
-            return False
 
-    return True
+class QueryBatch:
+    """
+    Several queries matched against each sentence in a single pass.
 
+    The distinct field tests of all the queries (e.g. upos == NOUN) are numbered, and each token is
+    tested once per field against all of them, so tests shared by several queries or query nodes
+    are evaluated once. The children index of each sentence is shared by all queries.
+    """
 
-def _token_direction_match(query: Query, token: Token):
-    if query.direction == 0:
-        return True
+    def __init__(self, queries: List[Query]):
+        # Compiled here, since the test ids belong to this batch
+        self.queries = [CompiledQuery(query) for query in queries]
+
+        # field -> value -> test id
+        self.tests: Dict[str, Dict[str, int]] = {}
+        self.n_tests = 0
+        for query in self.queries:
+            for node in query.iter_nodes():
+                node.test_ids = frozenset(
+                    self._test_id(field, value) for field, value in node.fields
+                )
+
+    def _test_id(self, field: str, value: str) -> int:
+        values = self.tests.setdefault(field, {})
+        if value not in values:
+            values[value] = self.n_tests
+            self.n_tests += 1
+        return values[value]
+
+    def _token_tests(self, token: Token) -> Set[int]:
+        passed = set()
+        for field, values in self.tests.items():
+            token_value = token.get(field, _MISSING)
+            if token_value is _MISSING:
+                # Fields the token does not hold are not constrained
+                passed.update(values.values())
+            elif token_value in values:
+                passed.add(values[token_value])
+        return passed
+
+    def matching_queries(self, tokenlist: TokenList) -> List[int]:
+        """Indices of the queries that match the sentence"""
+        index = ChildrenIndex(tokenlist)
+        index.token_tests = {
+            token_id: self._token_tests(token) for token_id, token in index.tokens.items()
+        }
+
+        return [
+            i
+            for i, query in enumerate(self.queries)
+            if any(
+                _token_recursive_match(index, query, token) is not None
+                for token in index.tokens.values()
+            )
+        ]
+
+
+def _fields_match(index: ChildrenIndex, query: CompiledQuery, token: Token) -> bool:
+    if query.test_ids is not None and index.token_tests is not None:
+        return query.test_ids <= index.token_tests[token["id"]]
+    return query.fields_match(token)
+
+
+def _head_match(index: ChildrenIndex, query: CompiledQuery, token: Token):
+    # Root tokens have no head token, so they count as zero head matches
+    head_token = index.get_head_token(token)
+    head_match = (
+        _token_recursive_match(index, query, head_token)
+        if head_token is not None
+        else None
+    )
 
-    token_direction = 1 if token["id"] - token["head"] > 0 else -1
-    if token_direction == query.direction:
-        return True
-    else:
-        return False
+    lo, hi = query.n_required
+    if lo <= (head_match is not None) <= hi:
+        return head_match or []
+    return None
 
 
-def _query_match_dependants(
-    mapping: TokenMapping, query: Query, dependants: List[Token]
-):
+def _dependant_match(index: ChildrenIndex, query: CompiledQuery, dependants: List[Token]):
     lo, hi = query.n_required
     matched_tokens = []
 
     for d_tok in dependants:
-        if _token_recursive_match(mapping, query, d_tok):
+        if _token_recursive_match(index, query, d_tok) is not None:
             matched_tokens.append(d_tok)
 
-            # If the query matches more than the maximum allowed number of tokens, break and return False
+            # Stop as soon as the query matches more than the maximum allowed number of tokens
             if len(matched_tokens) > hi:
-                return False
+                return None
 
-    # Return false if there are not enough matched tokens
     if len(matched_tokens) < lo:
-        return False
-
-    return matched_tokens
-
-
-def _token_dependants_match(mapping: TokenMapping, query: Query, token: Token):
-    dependant_tokens: List[Token] = mapping.get_child_tokens(token["id"])
-    dependant_queries: List[Query] = query.dependants
-
-    if dependant_queries is None:
         return None
 
-    dependant_matches = []
-
-    for dq in dependant_queries:
-        query_match = _query_match_dependants(mapping, dq, dependant_tokens)
-        if query_match is False:
-            return False
-        else:
-            dependant_matches.append(query_match)
-
-    return dependant_matches
-
-
-def _token_head_match(mapping: TokenMapping, query: Query, token: Token):
-
-    head_token = mapping[token["id"]].head
-    head_query = query.head
-
-    if head_query is None:
-        return None
-
-    head_match = _token_recursive_match(mapping, head_query, head_token)
-
-    lo, hi = head_query.n_required
+    return matched_tokens
 
-    if lo <= len(head_match) <= hi:
-        return head_match
-    else:
-        return False
 
+def _token_recursive_match(index: ChildrenIndex, query: CompiledQuery, token: Token):
+    """
+    :return: The matched tokens, starting with the token itself, or None if the token does not match
+    """
+    key = (id(query), token["id"])
+    if key in index.matches:
+        return index.matches[key]
 
-def _token_recursive_match(mapping: TokenMapping, query: Query, token: Token):
+    matching_tokens = _match_token(index, query, token)
+    index.matches[key] = matching_tokens
+    return matching_tokens
 
-    matching_tokens = []
 
-    if query is None:
-        return matching_tokens
+def _match_token(index: ChildrenIndex, query: CompiledQuery, token: Token):
 
     # 1. Check fields match
-    if not _token_fields_match(query, token):
-        return matching_tokens
+    if not _fields_match(index, query, token):
+        return None
 
     # 2. Check direction match
-    if not _token_direction_match(query, token):
-        return matching_tokens
+    if not query.direction_match(token):
+        return None
 
     # 3. Check head match
-    head_match = _token_head_match(mapping, query, token)
-    if head_match is False:
-        return matching_tokens
-
-    # 4. Check dependants match
-    dependants_match = _token_dependants_match(mapping, query, token)
-    if dependants_match is False:
-        return matching_tokens
-
-    matching_tokens.append(token)
-
-    if head_match is not None:
-        matching_tokens.append(head_match)
-
-    if dependants_match is not None:
-        matching_tokens.append(dependants_match)
+    head_match = []
+    if query.head is not None:
+        head_match = _head_match(index, query.head, token)
+        if head_match is None:
+            return None
+
+    # 4. Check dependants match, in check order but collected in query order
+    dependant_matches = [None] * len(query.dependants)
+    if query.dependants:
+        dependant_tokens = index.get_child_tokens(token)
+        for i in query.dependant_check_order:
+            query_match = _dependant_match(index, query.dependants[i], dependant_tokens)
+            if query_match is None:
+                return None
+            dependant_matches[i] = query_match
+
+    matching_tokens = [token]
+    matching_tokens.extend(head_match)
+    for query_match in dependant_matches:
+        matching_tokens.extend(query_match)
 
     return matching_tokens
 
 
-def flatten_nested_list(nested_list) -> Generator:
-    for item in nested_list:
-        if isinstance(item, list):
-            yield from flatten_nested_list(item)
-        else:
-            yield item
-
-
-def token_recursive_match(mapping: TokenMapping, query: Query, token: Token):
+def token_recursive_match(index: ChildrenIndex, query: CompiledQuery, token: Token):
 
     """
-    :param mapping: A mapping of the relations between tokens
-    :param query: A query object
+    :param index: The children index of the sentence
+    :param query: A compiled query
     :param token: A conllu token object
     :return: A list of unique matched tokens
     """
 
-    output_tokens = []
+    matched_tokens = _token_recursive_match(index, query, token)
+    if matched_tokens is None:
+        return []
 
-    matched_tokens_nested = _token_recursive_match(mapping, query, token)
-    matched_tokens_generator = flatten_nested_list(matched_tokens_nested)
+    return _unique_tokens(matched_tokens)
 
-    for tok in matched_tokens_generator:
-        if tok not in output_tokens:
-            output_tokens.append(tok)
 
-    return output_tokens
+def sentence_recursive_match(query: Union[Query, CompiledQuery], tokenlist: TokenList):
 
+    query = compile_query(query)
+    index = ChildrenIndex(tokenlist)
 
-def sentence_recursive_match(query: Query, tokenlist: TokenList):
+    output_tokens = []
 
-    mapping = make_tokens_mapping(tokenlist)
+    for token in index.tokens.values():
+        result = _token_recursive_match(index, query, token)
+        if result is not None:
+            output_tokens.extend(result)
 
-    output_tokens = []
+    return _unique_tokens(output_tokens)
+
+
+def sentence_matches(query: Union[Query, CompiledQuery], tokenlist: TokenList) -> bool:
+    """Whether any token of the sentence matches the query, stopping at the first match"""
+
+    query = compile_query(query)
+    index = ChildrenIndex(tokenlist)
+
+    return any(
+        _token_recursive_match(index, query, token) is not None
+        for token in index.tokens.values()
+    )
 
-    for token in tokenlist:
-        result = token_recursive_match(mapping, query, token)
-        if result:
-            for token in result:
-                if token not in output_tokens:
-                    output_tokens.append(token)
 
-    return output_tokens
+def _unique_tokens(tokens: List[Token]) -> List[Token]:
+    seen = set()
+    unique_tokens = []
+    for token in tokens:
+        if token["id"] not in seen:
+            seen.add(token["id"])
+            unique_tokens.append(token)
+    return unique_tokens
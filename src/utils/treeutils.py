@@ -1,54 +1,125 @@
 import logging
 
-from conllu import Token, TokenList, TokenTree
-from typing import List
-from dataclasses import dataclass, field
+from conllu import TokenList
+from typing import List, Sequence, Union
 
+import numpy as np
 
-@dataclass
-class Node:
-    """ "
-    Utility class for constructing a tree with attention to which side branches are on
-    """
-
-    centre: Token
-    left: List = field(default_factory=list)
-    right: List = field(default_factory=list)
+from src.compact_sentence import CompactSentence, DEPREL_VOCAB
 
-    def traverse(self):
-        for branch in self.left:
-            yield from branch.traverse()
-        yield self.centre
-        for branch in self.right:
-            yield from branch.traverse()
-
-    @classmethod
-    def make_node(cls, centre: Token, left: List[TokenTree], right: List[TokenTree]):
-        return Node(centre, left, right)
 
+class HeadTree:
+    """
+    Dependency tree of a sentence held as arrays, for permuting without building token trees.
 
-def get_tree_weight(tree: TokenTree):
-    """ "Recursive function for getting the total number of dependents in a tree"""
-    weight = 0
-    for branch in tree.children:
-        weight += get_tree_weight(branch)
-    weight += 1
-
-    return weight
+    Tokens are numbered as nodes 1..n by their position in the sentence, and node 0 is the root
+    that all root tokens attach to. The children of each node are held in CSR form, i.e. the
+    children of node v are child_nodes[offsets[v]:offsets[v + 1]], in their linear order.
+    Tokens whose head is not in the sentence are not reachable from the root.
+    """
 
+    __slots__ = (
+        "ids",
+        "heads",
+        "deprels",
+        "head_nodes",
+        "offsets",
+        "child_nodes",
+        "_breadth_first",
+        "_weights",
+    )
+
+    def __init__(self, ids: Sequence[int], heads: Sequence[int], deprels: Sequence[str]):
+        # Node 0 is the root, with the id, head and deprel of the fake root of TokenList.to_tree
+        self.ids: List[int] = [0, *ids]
+        self.heads: List[Union[int, None]] = [None, *heads]
+        self.deprels: List[str] = ["root", *deprels]
+
+        nodes = {token_id: node for node, token_id in enumerate(self.ids)}
+        self.head_nodes = np.asarray(
+            [-1] + [nodes.get(head, -1) for head in heads], dtype=np.int64
+        )
+
+        # Stable sort keeps the children of each node in linear order
+        attached = np.flatnonzero(self.head_nodes >= 0)
+        self.child_nodes: List[int] = attached[
+            np.argsort(self.head_nodes[attached], kind="stable")
+        ].tolist()
+        offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(
+            np.bincount(self.head_nodes[attached], minlength=len(self.ids))
+        )
+        self.offsets: List[int] = offsets.tolist()
+
+        self._breadth_first = None
+        self._weights = None
 
-def make_index_mapping(tokenlist: TokenList) -> dict:
-    index_mapping = {0: 0, None: None}
-    i = 1
+    @classmethod
+    def from_sentence(cls, sentence: Union[TokenList, CompactSentence]):
+        if isinstance(sentence, CompactSentence):
+            return cls(
+                range(1, len(sentence) + 1),
+                sentence.heads.tolist(),
+                sentence.deprel_strings(),
+            )
+        return cls(
+            [token["id"] for token in sentence],
+            [token["head"] for token in sentence],
+            [token["deprel"] for token in sentence],
+        )
 
-    for token in tokenlist:
-        if isinstance(token["id"], int):
-            index_mapping[token["id"]] = i
-            i += 1
-    return index_mapping
+    @classmethod
+    def from_heads(cls, heads: Sequence[int]):
+        """Tree of tokens 1..n with the given heads and no deprels"""
+        heads = list(heads)
+        return cls(range(1, len(heads) + 1), heads, [None] * len(heads))
+
+    def __len__(self):
+        return len(self.ids) - 1
+
+    def children(self, node: int) -> List[int]:
+        return self.child_nodes[self.offsets[node] : self.offsets[node + 1]]
+
+    def root(self) -> int:
+        """The root token, or node 0 if the sentence has several roots, as in TokenList.to_tree"""
+        roots = self.children(0)
+        if not roots:
+            raise ValueError("Sentence has no root token")
+        return roots[0] if len(roots) == 1 else 0
+
+    def is_left_dependant(self, node: int) -> bool:
+        return self.ids[node] < self.heads[node]
+
+    def breadth_first_nodes(self) -> List[int]:
+        """Nodes reachable from node 0 in breadth-first order, so that each node comes after its head"""
+        if self._breadth_first is None:
+            nodes = [0]
+            for node in nodes:
+                nodes.extend(self.children(node))
+            self._breadth_first = nodes
+        return self._breadth_first
+
+    def subtree_weights(self) -> List[int]:
+        """
+        Number of nodes in the subtree of each node (the node and its descendants). Computed once per tree
+        in a single pass from the leaves up, rather than recounting each subtree for every ancestor.
+        """
+        if self._weights is None:
+            weights = [1] * len(self.ids)
+            head_nodes = self.head_nodes.tolist()
+            for node in reversed(self.breadth_first_nodes()[1:]):
+                weights[head_nodes[node]] += weights[node]
+            self._weights = weights
+        return self._weights
+
+    def weight(self, node: int) -> int:
+        return self.subtree_weights()[node]
 
 
 def standardize_deprels(sentence: TokenList):
+    if isinstance(sentence, CompactSentence):
+        return _standardize_compact_deprels(sentence)
+
     new_sentence = sentence.copy()
 
     for i, token in enumerate(new_sentence):
@@ -56,3 +127,14 @@ def standardize_deprels(sentence: TokenList):
         new_sentence[i]["deprel"] = new_sentence[i]["deprel"].split(":")[0]
 
     return new_sentence
+
+
+def _standardize_compact_deprels(sentence: CompactSentence):
+    new_sentence = sentence.copy()
+    codes = np.unique(new_sentence.deprels)
+    for code in codes.tolist():
+        deprel = DEPREL_VOCAB.decode(code)
+        if ":" in deprel:
+            base_code = DEPREL_VOCAB.encode(deprel.split(":")[0])
+            new_sentence.deprels[sentence.deprels == code] = base_code
+    return new_sentence
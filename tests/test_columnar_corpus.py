@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import pytest
+
+from src.columnar_corpus import ColumnarCorpus, ColumnarCorpusWriter
+from src.load_treebank import TreebankLoader
+from src.sentence_cleaner import SentenceCleaner
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _columns(sentence):
+    return (
+        sentence.metadata["sent_id"],
+        sentence.heads.tolist(),
+        sentence.deprel_strings(),
+        sentence.upos_strings(),
+        sentence.form_strings(),
+    )
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    # Two files, written as build_columnar_corpus.py does
+    text = Path(DATA_DIR, "small.conllu").read_text(encoding="utf-8")
+    infiles = [Path(tmp_path, "a.conllu"), Path(tmp_path, "b.conllu")]
+    infiles[0].write_text(text, encoding="utf-8")
+    infiles[1].write_text(text.replace("# sent_id = ", "# sent_id = b-"), encoding="utf-8")
+
+    loader = TreebankLoader(compact=True)
+    writer = ColumnarCorpusWriter(Path(tmp_path, "corpus"))
+    for infile in infiles:
+        writer.add_file(infile, loader.iter_load_treebank(infile))
+    writer.write()
+    return Path(tmp_path, "corpus")
+
+
+def test_corpus_matches_compact_loading(corpus_dir):
+    loader = TreebankLoader(compact=True)
+    expected = [
+        _columns(sentence)
+        for name in ("a.conllu", "b.conllu")
+        for sentence in loader.iter_load_treebank(Path(corpus_dir.parent, name))
+    ]
+
+    corpus = ColumnarCorpus(corpus_dir)
+    assert len(corpus) == 6
+    assert [_columns(sentence) for sentence in corpus.iter_sentences()] == expected
+    assert [(Path(name).name, start, stop) for name, start, stop in corpus.file_ranges()] == [
+        ("a.conllu", 0, 3),
+        ("b.conllu", 3, 6),
+    ]
+
+
+def test_corpus_loading_is_cleaned_as_conllu_loading(corpus_dir):
+    cleaner = SentenceCleaner(remove_config=[{"upos": "PUNCT"}], standardize_deprels=True)
+    loader = TreebankLoader(cleaner=cleaner, compact=True, max_len=8)
+    expected = [
+        _columns(sentence)
+        for sentence in loader.iter_load_treebank(Path(corpus_dir.parent, "b.conllu"))
+    ]
+
+    loaded = list(loader.iter_load_corpus(corpus_dir, start=3, stop=6))
+    assert [_columns(sentence) for sentence in loaded] == expected
+    assert [sentence.metadata["sent_id"] for sentence in loaded] == ["b-1", "b-3"]
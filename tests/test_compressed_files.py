@@ -0,0 +1,60 @@
+import bz2
+import gzip
+import lzma
+from pathlib import Path
+
+import pytest
+
+from src.file_dumper import FileDumper
+from src.load_treebank import TreebankLoader
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _compress_zstd(data: bytes) -> bytes:
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSORS = {
+    ".gz": gzip.compress,
+    ".bz2": bz2.compress,
+    ".xz": lzma.compress,
+    ".zst": _compress_zstd,
+}
+
+
+def _serialize(sentences):
+    return [sentence.serialize() for sentence in sentences]
+
+
+@pytest.mark.parametrize("suffix", COMPRESSORS)
+def test_load_compressed_treebank(tmp_path, suffix):
+    data = Path(DATA_DIR, "small.conllu").read_bytes()
+    infile = Path(tmp_path, f"treebank.conllu{suffix}")
+    infile.write_bytes(COMPRESSORS[suffix](data))
+
+    expected = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    assert _serialize(TreebankLoader().load_treebank(infile)) == _serialize(expected)
+
+    # Lean parsing streams the same way
+    lean = TreebankLoader(fields=("id", "form", "head", "deprel")).load_treebank(infile)
+    assert [sentence.form_strings() for sentence in lean] == [
+        [token["form"] for token in sentence] for sentence in expected
+    ]
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".bz2", ".xz"])
+def test_write_compressed_output(tmp_path, suffix):
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    dumper = FileDumper(extension=".conllu")
+
+    # Outputs keep the compression suffix of their input
+    outfile = dumper.make_equivalent_paths(
+        tmp_path, Path(tmp_path, "in", f"treebank.conllu{suffix}"), Path(tmp_path, "out")
+    )
+    assert outfile == Path(tmp_path, "out", "in", f"treebank.conllu{suffix}")
+
+    dumper.write_to_file(treebank, outfile)
+    assert outfile.read_bytes()[:2] != b"# "
+    assert _serialize(TreebankLoader().load_treebank(outfile)) == _serialize(treebank)
@@ -0,0 +1,75 @@
+import copy
+import random
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from src.load_treebank import TreebankLoader
+from src.sentence_analyzer import SentenceAnalyzer
+from src.sentence_cleaner import SentenceCleaner
+from src.treebank_processor import TreebankPermuterAnalyzer
+from src.sentence_permuter import RandomSameValencyPermuter
+from src.utils import decorators
+from src.utils.decorators import set_copy_free
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def copy_free():
+    yield set_copy_free
+    set_copy_free(False)
+
+
+def _run_pipeline(**cleaner_options):
+    random.seed(1)
+    cleaner = SentenceCleaner(**cleaner_options)
+    loader = TreebankLoader(cleaner=cleaner)
+    treebank = loader.load_treebank(Path(DATA_DIR, "small.conllu"))
+    processor = TreebankPermuterAnalyzer(
+        [RandomSameValencyPermuter() for _ in range(3)],
+        SentenceAnalyzer(["DependencyLength", "IntervenerComplexity"]),
+    )
+    return [sentence.serialize() for sentence in processor.process_treebank(treebank)]
+
+
+@pytest.mark.parametrize(
+    "cleaner_options",
+    [
+        {},
+        {"mask_words": True},
+        {"mask_words": True, "fields_to_empty": ["feats", "lemma"]},
+        {"standardize_deprels": True},
+    ],
+)
+def test_copy_free_output_is_unchanged(copy_free, cleaner_options):
+    copy_free(False)
+    expected = _run_pipeline(**cleaner_options)
+
+    copy_free(True)
+    assert _run_pipeline(**cleaner_options) == expected
+
+
+@pytest.fixture
+def deepcopy_count(monkeypatch):
+    # Counts the deep copies taken by deepcopy_tokenlist, but not the recursive calls within them
+    count = [0]
+
+    def deepcopy(value):
+        count[0] += 1
+        return copy.deepcopy(value)
+
+    monkeypatch.setattr(decorators, "copy", SimpleNamespace(deepcopy=deepcopy))
+    return count
+
+
+@pytest.mark.parametrize("enabled, expected_copies", [(False, 9), (True, 0)])
+def test_copy_free_loading_takes_no_copies(copy_free, deepcopy_count, enabled, expected_copies):
+    copy_free(enabled)
+    loader = TreebankLoader(cleaner=SentenceCleaner(mask_words=True, standardize_deprels=True))
+    treebank = loader.load_treebank(Path(DATA_DIR, "small.conllu"))
+
+    assert len(treebank) == 3
+    # The loader, the cleaner and the selector each copy every sentence unless it is owned
+    assert deepcopy_count[0] == expected_copies
@@ -0,0 +1,105 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from src.file_dumper import FileDumper
+from src.file_processor import ByteRangeFileProcessor, QueryBatchFileProcessor
+from src.load_treebank import TreebankLoader
+from src.sentence_index import SentenceIndex, read_byte_range
+from src.sentence_selector import MultiQuerySelector, SentenceSelector
+
+DATA_DIR = Path(__file__).parent / "data"
+
+QUERIES = [
+    {"name": "adjectives", "upos": "NOUN", "dependants": [{"upos": "ADJ"}]},
+    {"name": "subjects", "deprel": "nsubj"},
+    {"name": "cats", "form": "cat"},
+]
+
+
+def _serialize(sentences):
+    return [sentence.serialize() for sentence in sentences]
+
+
+def _expected_outputs(infile):
+    outputs = {}
+    for query in QUERIES:
+        query = dict(query)
+        name = query.pop("name")
+        outputs[name] = _serialize(
+            TreebankLoader(selector=SentenceSelector(query)).load_treebank(infile)
+        )
+    return outputs
+
+
+def test_query_batch_routes_to_each_query(tmp_path):
+    infile = Path(DATA_DIR, "small.conllu")
+    processor = QueryBatchFileProcessor(
+        TreebankLoader(), MultiQuerySelector(QUERIES), FileDumper(extension=".conllu")
+    )
+    processor.process_file(infile, Path(tmp_path, "small.conllu"))
+
+    outputs = {
+        name: _serialize(TreebankLoader().load_treebank(Path(tmp_path, name, "small.conllu")))
+        for name in ("adjectives", "subjects", "cats")
+    }
+    assert outputs == _expected_outputs(infile)
+    assert [len(sentences) for sentences in outputs.values()] == [1, 2, 0]
+
+
+def test_query_batch_routes_a_glob(tmp_path):
+    indir = Path(tmp_path, "in")
+    Path(indir, "sub").mkdir(parents=True)
+    text = Path(DATA_DIR, "small.conllu").read_text(encoding="utf-8")
+    Path(indir, "a.conllu").write_text(text, encoding="utf-8")
+    Path(indir, "sub", "b.conllu").write_text(text.replace("dog", "cat"), encoding="utf-8")
+
+    processor = QueryBatchFileProcessor(
+        TreebankLoader(), MultiQuerySelector(QUERIES), FileDumper(extension=".conllu")
+    )
+    outdir = Path(tmp_path, "out")
+    processor.process_glob(indir, "**/*.conllu", outdir)
+
+    for relpath in (Path("a.conllu"), Path("sub", "b.conllu")):
+        expected = _expected_outputs(Path(indir, relpath))
+        for name, sentences in expected.items():
+            outfile = Path(outdir, name, relpath)
+            assert _serialize(TreebankLoader().load_treebank(outfile)) == sentences
+
+
+def _blocks(infile, positions):
+    index = SentenceIndex.load_or_build(infile)
+    return b"".join(
+        read_byte_range(infile, *index.byte_range(position, position + 1))
+        for position in positions
+    )
+
+
+@pytest.mark.parametrize(
+    "query, max_len, positions, n_ranges",
+    [
+        ({"deprel": "nsubj"}, 999, [1, 2], 1),
+        ({"upos": "DET", "head": {"upos": "NOUN"}}, 999, [0, 1, 2], 1),
+        ({"deprel": "root", "dependants": [{"deprel": "nsubj", "n_required": 0}]}, 999, [0], 1),
+        ({"upos": "PUNCT"}, 6, [0, 2], 2),
+        ({"form": "cat"}, 999, [], 0),
+    ],
+)
+@pytest.mark.parametrize("inverted_index", [False, True])
+def test_extract_raw_copies_matching_blocks(
+    tmp_path, query, max_len, positions, n_ranges, inverted_index
+):
+    infile = Path(tmp_path, "treebank.conllu")
+    shutil.copy(Path(DATA_DIR, "small.conllu"), infile)
+    loader = TreebankLoader(
+        selector=SentenceSelector(query), max_len=max_len, inverted_index=inverted_index
+    )
+
+    # Adjacent blocks are merged into one range
+    assert len(list(loader.iter_matching_byte_ranges(infile))) == n_ranges
+
+    outfile = Path(tmp_path, "out", "treebank.conllu")
+    outfile.parent.mkdir()
+    ByteRangeFileProcessor(loader, FileDumper(extension=".conllu")).process_file(infile, outfile)
+    assert outfile.read_bytes() == _blocks(infile, positions)
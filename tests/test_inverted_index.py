@@ -0,0 +1,100 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from src.inverted_index import InvertedIndex
+from src.load_treebank import TreebankLoader
+from src.sentence_cleaner import SentenceCleaner
+from src.sentence_selector import SentenceSelector
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def treebank(tmp_path):
+    infile = Path(tmp_path, "treebank.conllu")
+    shutil.copy(Path(DATA_DIR, "small.conllu"), infile)
+    return infile
+
+
+def _serialize(sentences):
+    return [sentence.serialize() for sentence in sentences]
+
+
+def test_postings_hold_sentence_positions(treebank):
+    index = InvertedIndex.load_or_build(treebank)
+    assert InvertedIndex.index_path(treebank).exists()
+    assert len(index) == 3
+
+    assert index.positions("upos", "NOUN").tolist() == [0, 1, 2]
+    assert index.positions("form", "fox").tolist() == [1]
+    assert index.positions("lemma", "ir").tolist() == [0]
+    assert index.positions("deprel", "nsubj").tolist() == [1, 2]
+
+    # Multiword tokens and empty nodes are not indexed, since the cleaner removes them
+    assert index.positions("form", "Vámonos").tolist() == []
+    assert index.positions("form", "jumped").tolist() == []
+
+    assert index.intersect([("upos", "ADJ"), ("deprel", "nsubj")]).tolist() == [1]
+    assert index.intersect([("upos", "PRON"), ("deprel", "nsubj")]).tolist() == []
+    assert index.intersect([]) is None
+
+    # The stored index is read back rather than rebuilt
+    loaded = InvertedIndex.load_or_build(treebank)
+    assert loaded.keys == index.keys
+    assert loaded.positions("deprel", "nsubj").tolist() == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        {"upos": "NOUN", "dependants": [{"upos": "ADJ"}]},
+        {"deprel": "nsubj", "head": {"lemma": "bark"}},
+        {"form": "mar", "dependants": [{"deprel": "det", "n_required": "?"}]},
+        {"deprel": "obl"},
+        {"upos": "PRON", "deprel": "nsubj"},
+        {"deprel": "root"},
+    ],
+)
+@pytest.mark.parametrize("standardize_deprels", [False, True])
+def test_indexed_loading_matches_full_loading(treebank, query, standardize_deprels):
+    cleaner = SentenceCleaner(standardize_deprels=standardize_deprels)
+    selector = SentenceSelector(query)
+    expected = TreebankLoader(cleaner=cleaner, selector=selector).load_treebank(treebank)
+
+    loader = TreebankLoader(cleaner=cleaner, selector=selector, inverted_index=True)
+    assert _serialize(loader.load_treebank(treebank)) == _serialize(expected)
+
+
+@pytest.mark.parametrize(
+    "inverted_index, expected_parsed", [(False, ["1", "2", "3"]), (True, ["2"])]
+)
+def test_only_candidate_sentences_are_parsed(
+    treebank, monkeypatch, inverted_index, expected_parsed
+):
+    selector = SentenceSelector({"form": "fox"})
+    loader = TreebankLoader(selector=selector, inverted_index=inverted_index)
+    parsed = []
+    process_sentence = loader.process_sentence
+
+    def recording_process_sentence(sentence, **kwargs):
+        parsed.append(sentence.metadata["sent_id"])
+        return process_sentence(sentence, **kwargs)
+
+    monkeypatch.setattr(loader, "process_sentence", recording_process_sentence)
+    assert [sentence.metadata["sent_id"] for sentence in loader.load_treebank(treebank)] == ["2"]
+    assert parsed == expected_parsed
+
+
+def test_stale_postings_are_rebuilt(treebank):
+    selector = SentenceSelector({"form": "cat"})
+    loader = TreebankLoader(selector=selector, inverted_index=True)
+    assert loader.load_treebank(treebank) == []
+
+    text = treebank.read_text(encoding="utf-8")
+    block = text.split("\n\n")[2].replace("sent_id = 3", "sent_id = 4").replace("dog", "cat")
+    treebank.write_text(text + "\n" + block, encoding="utf-8")
+
+    assert [sentence.metadata["sent_id"] for sentence in loader.load_treebank(treebank)] == ["4"]
+    assert InvertedIndex.load_or_build(treebank).positions("form", "cat").tolist() == [3]
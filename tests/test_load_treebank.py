@@ -0,0 +1,156 @@
+from pathlib import Path
+
+import pytest
+
+from src.compact_sentence import MISSING_HEAD
+from src.load_treebank import TreebankLoader
+from src.sentence_cleaner import SentenceCleaner
+from src.sentence_selector import SentenceSelector
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def treebank(tmp_path):
+    # Several copies of the sample sentences, so that the file is split into several chunks
+    text = Path(DATA_DIR, "small.conllu").read_text(encoding="utf-8")
+    infile = Path(tmp_path, "treebank.conllu")
+    infile.write_text(
+        "".join(text.replace("# sent_id = ", f"# sent_id = {i}-") for i in range(10)),
+        encoding="utf-8",
+    )
+    return infile
+
+
+def _serialize(sentences):
+    return [sentence.serialize() for sentence in sentences]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 4])
+def test_load_treebank_with_workers(treebank, chunk_size):
+    expected = TreebankLoader().load_treebank(treebank)
+    loaded = TreebankLoader(workers=2, chunk_size=chunk_size).load_treebank(treebank)
+
+    assert len(expected) == 30
+    assert _serialize(loaded) == _serialize(expected)
+
+
+    # Files are only indexed to split them into chunks
+    assert Path(f"{treebank}.idx").exists() == (chunk_size is not None)
+
+
+@pytest.fixture
+def treebank_dir(tmp_path):
+    text = Path(DATA_DIR, "small.conllu").read_text(encoding="utf-8")
+    for i in range(5):
+        Path(tmp_path, f"treebank_{i}.conllu").write_text(
+            text.replace("# sent_id = ", f"# sent_id = {i}-"), encoding="utf-8"
+        )
+    return tmp_path
+
+
+def test_load_glob_with_workers(treebank_dir):
+    expected = _serialize(TreebankLoader().iter_load_glob(treebank_dir, "*.conllu"))
+    loaded = _serialize(TreebankLoader(workers=3).iter_load_glob(treebank_dir, "*.conllu"))
+
+    assert len(expected) == 15
+    assert loaded == expected
+
+
+def test_load_files_with_workers_in_given_order(treebank_dir):
+    infiles = [Path(treebank_dir, f"treebank_{i}.conllu") for i in (3, 0, 4)]
+    loaded = TreebankLoader(workers=2).iter_load_files(infiles)
+    try:
+        # Only the first two files are read
+        for infile, (loaded_file, sentences) in zip(infiles[:2], loaded):
+            assert loaded_file == infile
+            prefix = infile.stem.split("_")[1]
+            assert [sentence.metadata["sent_id"] for sentence in sentences] == [
+                f"{prefix}-{i}" for i in (1, 2, 3)
+            ]
+    finally:
+        # Stopping early cancels the remaining tasks, rather than waiting on them
+        loaded.close()
+
+
+def test_lean_loader_with_missing_head(tmp_path):
+    infile = Path(tmp_path, "treebank.conllu")
+    infile.write_text(
+        "# sent_id = 1\n"
+        "1\tA\ta\tDET\t_\t_\t2\tdet\t_\t_\n"
+        "2\tdog\tdog\tNOUN\t_\t_\t0\troot\t_\t_\n"
+        "3\tbarks\tbark\tVERB\t_\t_\t_\t_\t_\t_\n"
+        "\n",
+        encoding="utf-8",
+    )
+    expected = TreebankLoader(compact=True).load_treebank(infile)
+    loaded = TreebankLoader(fields=["id", "form", "head", "deprel"]).load_treebank(infile)
+
+    assert loaded[0].heads.tolist() == [2, 0, MISSING_HEAD]
+    assert loaded[0].heads.tolist() == expected[0].heads.tolist()
+    assert loaded[0].deprel_strings() == expected[0].deprel_strings()
+
+    # Missing heads stay missing when tokens are renumbered, and are None again in a TokenList
+    assert loaded[0].reorder([3, 1, 2]).heads.tolist() == [MISSING_HEAD, 3, 0]
+    assert loaded[0].select([False, True, True]).heads.tolist() == [0, MISSING_HEAD]
+    assert [token["head"] for token in loaded[0].to_tokenlist()] == [2, 0, None]
+
+
+@pytest.mark.parametrize("query", [{"lemma": "dog"}, {"upos": "NOUN"}, {"head": {"form": "barks"}}])
+def test_lean_loader_rejects_query_on_fields_not_loaded(query):
+    with pytest.raises(ValueError, match="not loaded in lean mode"):
+        TreebankLoader(selector=SentenceSelector(query), fields=("id", "head", "deprel"))
+
+
+def test_lean_loader_with_query_on_loaded_fields():
+    selector = SentenceSelector({"upos": "NOUN", "dependants": [{"deprel": "amod"}]})
+    loader = TreebankLoader(selector=selector, fields=("id", "upos", "head", "deprel"))
+    sentences = loader.load_treebank(Path(DATA_DIR, "small.conllu"))
+
+    assert [sentence.metadata["sent_id"] for sentence in sentences] == ["2"]
+
+
+@pytest.mark.parametrize(
+    "min_len, max_len, remove_config",
+    [
+        (5, 8, None),
+        (4, 999, None),
+        (1, 5, None),
+        (1, 8, [{"upos": "PUNCT"}]),
+        # Sentence 1 is too long until its obl subtree is removed
+        (1, 4, [{"deprel": "obl"}]),
+    ],
+)
+@pytest.mark.parametrize("fields", [None, ("id", "head", "deprel", "upos")])
+def test_length_limits_match_filtering_after_loading(min_len, max_len, remove_config, fields):
+    infile = Path(DATA_DIR, "small.conllu")
+    cleaner = SentenceCleaner(remove_config)
+    expected = [
+        sentence
+        for sentence in TreebankLoader(cleaner=cleaner, fields=fields).load_treebank(infile)
+        if min_len <= len(sentence) <= max_len
+    ]
+    loader = TreebankLoader(cleaner=cleaner, fields=fields, min_len=min_len, max_len=max_len)
+    loaded = loader.load_treebank(infile)
+
+    assert [sentence.metadata["sent_id"] for sentence in loaded] == [
+        sentence.metadata["sent_id"] for sentence in expected
+    ]
+
+
+def test_sentences_out_of_range_are_not_cleaned(monkeypatch):
+    cleaned = []
+    cleaner = SentenceCleaner()
+    process_sentence = cleaner.process_sentence
+
+    def counting_process_sentence(sentence, **kwargs):
+        cleaned.append(sentence.metadata["sent_id"])
+        return process_sentence(sentence, **kwargs)
+
+    monkeypatch.setattr(cleaner, "process_sentence", counting_process_sentence)
+    loader = TreebankLoader(cleaner=cleaner, min_len=5, max_len=8)
+    loaded = loader.load_treebank(Path(DATA_DIR, "small.conllu"))
+
+    # Sentence 2 has 10 tokens and sentence 3 has 4, so only sentence 1 is parsed and cleaned
+    assert [sentence.metadata["sent_id"] for sentence in loaded] == ["1"]
+    assert cleaned == ["1"]
@@ -0,0 +1,67 @@
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.compact_sentence import CompactSentence
+from src.load_treebank import TreebankLoader
+from src.sentence_analyzer import SentenceAnalyzer, SemanticSimilarityAnalyzer
+from src.sentence_permuter import (
+    RandomProjectivePermuter,
+    random_projective_dependency_length_moments,
+)
+from src.utils.treeutils import HeadTree
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.mark.parametrize("count_root", [False, True])
+def test_expected_dl_alongside_sampled_dl(count_root):
+    random.seed(0)
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    analyzer = SentenceAnalyzer(
+        ["DependencyLength"], count_root=count_root, aggregate=True, expected_dl=True
+    )
+    permuter = RandomProjectivePermuter()
+
+    for sentence in treebank:
+        mean, variance = random_projective_dependency_length_moments(
+            HeadTree.from_sentence(sentence), count_root=count_root
+        )
+        for _ in range(5):
+            permuted = permuter.process_sentence(sentence)
+            lengths = [
+                token["id"] - token["head"] if token["head"] != 0 else token["id"]
+                for token in permuted
+                if isinstance(token["id"], int) and (token["head"] != 0 or count_root)
+            ]
+            output = analyzer.process_sentence(permuted)
+
+            assert output["DL"] == abs(sum(lengths))
+            assert output["TotalDL"] == sum(map(abs, lengths))
+            assert output["ExpectedTotalDL"] == pytest.approx(mean)
+            assert output["VarianceTotalDL"] == pytest.approx(variance)
+
+
+def test_expected_dl_requires_aggregate_dependency_length():
+    with pytest.raises(ValueError):
+        SentenceAnalyzer(["DependencyLength"], expected_dl=True)
+    with pytest.raises(ValueError):
+        SentenceAnalyzer(["IntervenerComplexity"], aggregate=True, expected_dl=True)
+
+
+def test_semantic_similarity_of_compact_sentence():
+    w2v = {"A": np.array([1.0, 0.0]), "dog": np.array([0.6, 0.8]), "barks": np.array([0.0, 1.0])}
+    analyzer = SemanticSimilarityAnalyzer(w2v)
+    heads, deprels, forms = [2, 0, 2], ["det", "root", "nsubj"], ["A", "dog", "barks"]
+
+    sentence = CompactSentence.from_strings(heads, deprels, forms=forms)
+    scores = analyzer.process_sentence(sentence)
+    assert scores[0] == pytest.approx(0.6)
+    assert np.isnan(scores[1])
+    assert scores[2] == pytest.approx(0.8)
+
+    # Sentences loaded without forms cannot be analyzed
+    with pytest.raises(ValueError, match="form"):
+        analyzer.process_sentence(CompactSentence.from_strings(heads, deprels))
@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import pytest
+
+from src.compact_sentence import CompactSentence
+from src.load_treebank import TreebankLoader
+from src.sentence_cleaner import SentenceCleaner
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _forms_and_heads(sentence):
+    return [(token["form"], token["head"]) for token in sentence]
+
+
+def test_remove_tokens_removes_subtrees():
+    infile = Path(DATA_DIR, "small.conllu")
+    cleaner = SentenceCleaner(remove_config=[{"deprel": "obl:over"}, {"deprel": "obj"}])
+    cleaned = TreebankLoader(cleaner=cleaner).load_treebank(infile)
+
+    assert _forms_and_heads(cleaned[0]) == [("Vamos", 0), ("a", 4), ("el", 4), ("mar", 1), (".", 1)]
+    assert _forms_and_heads(cleaned[1]) == [
+        ("The", 4), ("quick", 4), ("brown", 4), ("fox", 5), ("jumps", 0), (".", 5)
+    ]
+    assert _forms_and_heads(cleaned[2]) == [("A", 2), ("dog", 3), ("barks", 0), (".", 3)]
+
+    # Compact sentences lose the same tokens
+    lean_loader = TreebankLoader(cleaner=cleaner, fields=("id", "form", "head", "deprel"))
+    compact = lean_loader.load_treebank(infile)
+    assert [
+        list(zip(sentence.form_strings(), sentence.heads.tolist())) for sentence in compact
+    ] == [_forms_and_heads(sentence) for sentence in cleaned]
+
+
+def test_remove_deep_subtree():
+    # A chain deeper than the recursion limit, cut below its second token
+    n_tokens = 5000
+    heads = [0] + list(range(1, n_tokens))
+    deprels = ["root", "obj"] + ["dep"] * (n_tokens - 2)
+    sentence = CompactSentence.from_strings(heads, deprels, forms=[str(i) for i in range(n_tokens)])
+    cleaner = SentenceCleaner(remove_config=[{"deprel": "dep"}])
+
+    compact = cleaner.process_sentence(sentence)
+    assert compact.heads.tolist() == [0, 1]
+
+    tokenlist = sentence.to_tokenlist()
+    tokenlist.metadata["sent_id"] = "1"
+    assert _forms_and_heads(cleaner.process_sentence(tokenlist)) == [("0", 0), ("1", 1)]
+
+
+REMOVE_RULES = [
+    {"upos": "PUNCT"},
+    {"upos": "ADP"},
+    {"deprel": "amod", "form": "lazy"},
+    {"deprel": "det", "upos": "DET", "form": "A"},
+    {"form": lambda form: form.startswith("b")},
+]
+
+
+def _naive_match_ids(sentence, rules):
+    return {token["id"] for rule in rules for token in sentence.filter(**rule)}
+
+
+@pytest.mark.parametrize(
+    "rules",
+    [
+        REMOVE_RULES,
+        REMOVE_RULES + [{"feats__Degree": "Pos", "upos": "ADJ"}],
+        [{"feats__Number": "Sing"}, {"lemma": "ir"}],
+    ],
+)
+def test_remove_matcher_matches_filtering_rule_by_rule(rules):
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    matcher = SentenceCleaner(remove_config=rules).remove_matcher
+
+    assert [matcher.match_ids(sentence) for sentence in treebank] == [
+        _naive_match_ids(sentence, rules) for sentence in treebank
+    ]
+
+
+def test_remove_matcher_on_compact_sentences():
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    matcher = SentenceCleaner(remove_config=REMOVE_RULES).remove_matcher
+
+    for sentence in treebank:
+        compact = CompactSentence.from_tokenlist(sentence)
+        assert matcher.match_ids(compact) == _naive_match_ids(sentence, REMOVE_RULES)
+
+    # Fields that compact sentences do not hold cannot be matched
+    lemma_matcher = SentenceCleaner(remove_config=[{"lemma": "ir"}]).remove_matcher
+    with pytest.raises(ValueError):
+        lemma_matcher.match_ids(CompactSentence.from_tokenlist(treebank[0]))
@@ -0,0 +1,74 @@
+import gzip
+import shutil
+from pathlib import Path
+
+import pytest
+
+from src.load_treebank import TreebankLoader
+from src.sentence_index import SentenceIndex, read_byte_range
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def treebank(tmp_path):
+    infile = Path(tmp_path, "treebank.conllu")
+    shutil.copy(Path(DATA_DIR, "small.conllu"), infile)
+    return infile
+
+
+def _serialize(sentences):
+    return [sentence.serialize() for sentence in sentences]
+
+
+def test_index_holds_sentence_blocks(treebank):
+    index = SentenceIndex.load_or_build(treebank)
+    assert SentenceIndex.index_path(treebank).exists()
+    assert index.sent_ids == ["1", "2", "3"]
+
+    blocks = [
+        read_byte_range(treebank, offset, length).decode("utf-8")
+        for offset, length in zip(index.offsets.tolist(), index.lengths.tolist())
+    ]
+    assert "".join(blocks) == treebank.read_text(encoding="utf-8")
+    assert all(block.startswith("# sent_id = ") for block in blocks)
+
+    # The stored index is read back rather than rebuilt
+    loaded = SentenceIndex.load_or_build(treebank)
+    assert loaded.offsets.tolist() == index.offsets.tolist()
+    assert loaded.sent_ids == index.sent_ids
+
+
+def test_load_range_and_sentence_by_id(treebank):
+    loader = TreebankLoader()
+    expected = loader.load_treebank(treebank)
+
+    assert _serialize(loader.iter_load_range(treebank, 1, 3)) == _serialize(expected[1:3])
+    assert loader.load_sentence_by_id(treebank, "3").serialize() == expected[2].serialize()
+    with pytest.raises(KeyError):
+        loader.load_sentence_by_id(treebank, "4")
+
+    # Sentences excluded by the length limits are not returned
+    assert TreebankLoader(max_len=5).load_sentence_by_id(treebank, "2") is None
+
+
+def test_stale_index_is_rebuilt(treebank):
+    SentenceIndex.load_or_build(treebank)
+    text = treebank.read_text(encoding="utf-8")
+    treebank.write_text(
+        text + "\n" + text.split("\n\n")[2].replace("sent_id = 3", "sent_id = 4"),
+        encoding="utf-8",
+    )
+
+    index = SentenceIndex.load_or_build(treebank)
+    assert index.sent_ids == ["1", "2", "3", "4"]
+    assert TreebankLoader().load_sentence_by_id(treebank, "4")[2]["form"] == "barks"
+
+
+def test_compressed_file_cannot_be_indexed(tmp_path, treebank):
+    infile = Path(tmp_path, "treebank.conllu.gz")
+    with gzip.open(infile, "wb") as fout:
+        fout.write(treebank.read_bytes())
+
+    with pytest.raises(ValueError):
+        SentenceIndex.build(infile)
@@ -0,0 +1,415 @@
+import itertools
+import math
+import random
+from collections import defaultdict
+from fractions import Fraction
+from pathlib import Path
+
+import pytest
+
+from src.compact_sentence import CompactSentence
+from src.load_treebank import TreebankLoader
+from src.sentence_permuter import (
+    SentencePermuter,
+    RandomProjectivePermuter,
+    RandomSameSidePermuter,
+    RandomSameValencyPermuter,
+    OptimalProjectivePermuter,
+    FixedOrderPermuter,
+    FixedOrderGrammarBatch,
+    optimal_dependency_length,
+    optimal_dependency_lengths,
+    random_projective_dependency_length_moments,
+)
+from src.sentence_analyzer import SentenceAnalyzer
+from src.treebank_processor import (
+    PermuterOutputBuffer,
+    TreebankPermuter,
+    TreebankPermuterAnalyzer,
+)
+from src.utils.treeutils import HeadTree
+
+DATA_DIR = Path(__file__).parent / "data"
+
+GRAMMAR = {"det": -0.5, "amod": -0.2, "nsubj": -0.9, "obj": 0.4, "obl": 0.7, "case": -0.1}
+
+
+def _sentences():
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    sentences = [CompactSentence.from_tokenlist(sentence) for sentence in treebank]
+    sentences += [
+        # Several roots
+        CompactSentence.from_strings([0, 1, 0, 3, 3], ["root", "obj", "root", "nsubj", "obj"]),
+        CompactSentence.from_strings(
+            [2, 0, 2, 0, 4, 4, 6], ["det", "root", "obj", "root", "amod", "obl", "case"]
+        ),
+        # Non-projective
+        CompactSentence.from_strings(
+            [3, 4, 0, 3, 2, 3, 4], ["nsubj", "det", "root", "obj", "amod", "obl", "case"]
+        ),
+    ]
+    return sentences
+
+
+SENTENCES = _sentences()
+
+
+def _reference_order(sentence: CompactSentence, mode: str):
+    """Recursive linearisation over the dependants of each token, as permuters used to do it"""
+    heads = sentence.heads.tolist()
+    deprels = sentence.deprel_strings()
+    grammar = defaultdict(float, GRAMMAR)
+    children = defaultdict(list)
+    for node, head in enumerate(heads, 1):
+        children[head].append(node)
+
+    def weight(node):
+        return 1 + sum(weight(child) for child in children[node])
+
+    def head_of(node):
+        return heads[node - 1]
+
+    def build(node, is_right=False):
+        dependants = children[node]
+        if mode == "RandomSameValency":
+            n_left = sum(1 for child in dependants if child < head_of(child))
+            dependants = random.sample(dependants, len(dependants))
+        elif mode == "OptimalOrder":
+            dependants = sorted(dependants, key=weight)
+        elif mode == "FixedOrder":
+            dependants = sorted(dependants, key=lambda child: abs(grammar[deprels[child - 1]]))
+
+        odd = len(dependants) % 2 != 0
+        left, right = [], []
+        for i, child in enumerate(dependants):
+            if mode == "OptimalOrder":
+                i += 1 if (is_right and odd) or (not is_right and not odd) else 0
+                is_left = i % 2 == 0
+                branch = build(child, is_right=not is_left)
+            else:
+                branch = build(child)
+                if mode == "RandomProjective":
+                    is_left = random.choice([-1, 1]) < 0
+                elif mode == "RandomSameValency":
+                    is_left = i < n_left
+                elif mode == "FixedOrder":
+                    is_left = grammar[deprels[child - 1]] < 0
+                else:
+                    is_left = child < head_of(child)
+            (left if is_left else right).append(branch)
+
+        if mode.startswith("Random"):
+            random.shuffle(left)
+            random.shuffle(right)
+        if mode in ("OptimalOrder", "FixedOrder"):
+            left.reverse()
+        return [node for branch in left for node in branch] + [node] + [
+            node for branch in right for node in branch
+        ]
+
+    roots = children[0]
+    order = build(roots[0]) if len(roots) == 1 else build(0)
+    return [node for node in order if node != 0]
+
+
+PERMUTERS = {
+    "OriginalOrder": SentencePermuter,
+    "RandomProjective": RandomProjectivePermuter,
+    "RandomSameSide": RandomSameSidePermuter,
+    "RandomSameValency": RandomSameValencyPermuter,
+    "OptimalOrder": OptimalProjectivePermuter,
+    "FixedOrder": lambda: FixedOrderPermuter(GRAMMAR),
+}
+
+
+@pytest.mark.parametrize("mode", PERMUTERS)
+def test_permuter_matches_recursive_reference(mode):
+    permuter = PERMUTERS[mode]()
+    for i, sentence in enumerate(SENTENCES):
+        random.seed(i)
+        expected = [_reference_order(sentence, mode) for _ in range(5)]
+        random.seed(i)
+        permuted = [permuter.process_sentence(sentence) for _ in range(5)]
+
+        for order, permuted_sentence in zip(expected, permuted):
+            reordered = sentence.reorder(order)
+            assert permuted_sentence.heads.tolist() == reordered.heads.tolist()
+            assert permuted_sentence.form_strings() == reordered.form_strings()
+
+
+def _grammars():
+    random.seed(0)
+    deprels = sorted({deprel for sentence in SENTENCES for deprel in sentence.deprel_strings()})
+    grammars = [
+        GRAMMAR,
+        {},
+        # Ties, and values on both sides
+        {"det": -1, "amod": -1, "nsubj": -1, "obj": 1, "obl": 1},
+        {"det": 1, "amod": 1, "case": 0, "obl": -2},
+    ]
+    grammars += [
+        {deprel: random.uniform(-1, 1) for deprel in deprels if random.random() < 0.8}
+        for _ in range(20)
+    ]
+    return grammars
+
+
+def test_grammar_batch_matches_fixed_order_permuters():
+    permuters = [FixedOrderPermuter(grammar) for grammar in _grammars()]
+    batch = FixedOrderGrammarBatch.from_permuters(permuters)
+
+    for sentence in SENTENCES:
+        tree = HeadTree.from_sentence(sentence)
+        expected = [permuter.permutation_order(tree) for permuter in permuters]
+        assert batch.permutation_orders(tree).tolist() == expected
+
+
+def test_treebank_permuter_with_grammar_batch():
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+    permuters = [FixedOrderPermuter(grammar) for grammar in _grammars()]
+    expected = [
+        permuter.process_sentence(sentence).serialize()
+        for permuter in permuters
+        for sentence in treebank
+    ]
+
+    processor = TreebankPermuter(permuters)
+    assert processor.grammar_batch is not None
+    assert [sentence.serialize() for sentence in processor.process_treebank(treebank)] == expected
+
+
+def test_permuter_output_buffer_yields_items_by_permuter():
+    with PermuterOutputBuffer(3) as buffer:
+        for sentence_i in range(4):
+            for permuter_i in range(3):
+                buffer.append(permuter_i, {"sentence": sentence_i, "permuter": permuter_i})
+
+        assert [(item["permuter"], item["sentence"]) for item in buffer] == [
+            (permuter_i, sentence_i) for permuter_i in range(3) for sentence_i in range(4)
+        ]
+        # The buffer can be read again
+        assert len(list(buffer)) == 12
+    assert buffer.file.closed
+
+
+def _deterministic_permuters():
+    return [OptimalProjectivePermuter(), FixedOrderPermuter(GRAMMAR)]
+
+
+def _serialize(sentences):
+    return [
+        sentence.heads.tolist() if isinstance(sentence, CompactSentence) else sentence.serialize()
+        for sentence in sentences
+    ]
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_sentence_major_matches_permuter_major(compact):
+    treebank = TreebankLoader(compact=compact).load_treebank(Path(DATA_DIR, "small.conllu"))
+
+    expected = _serialize(TreebankPermuter(_deterministic_permuters()).process_treebank(treebank))
+    processor = TreebankPermuter(_deterministic_permuters(), sentence_major=True)
+    assert processor.grammar_batch is None
+    assert _serialize(processor.process_treebank(treebank)) == expected
+
+    # A single random permuter draws in the same order in both modes
+    random.seed(3)
+    expected = _serialize(TreebankPermuter([RandomProjectivePermuter()]).process_treebank(treebank))
+    random.seed(3)
+    processor = TreebankPermuter([RandomProjectivePermuter()], sentence_major=True)
+    assert _serialize(processor.process_treebank(treebank)) == expected
+
+
+def test_sentence_major_analysis_matches_permuter_major():
+    treebank = TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+
+    def analyze(sentence_major):
+        processor = TreebankPermuterAnalyzer(
+            _deterministic_permuters(),
+            SentenceAnalyzer(["DependencyLength"]),
+            sentence_major=sentence_major,
+        )
+        return list(processor.process_treebank(treebank))
+
+    expected = analyze(False)
+    assert len(expected) == 2 * len(treebank)
+    assert analyze(True) == expected
+
+
+def _edges(sentence):
+    """(form, head form) of each token, which permutation keeps"""
+    if isinstance(sentence, CompactSentence):
+        forms = ["ROOT", *sentence.form_strings()]
+        return sorted(
+            (forms[node], forms[head]) for node, head in enumerate(sentence.heads.tolist(), 1)
+        )
+    forms = {0: "ROOT", **{token["id"]: token["form"] for token in sentence}}
+    return sorted((token["form"], forms[token["head"]]) for token in sentence)
+
+
+@pytest.mark.parametrize("head_final", [False, True])
+@pytest.mark.parametrize(
+    "permuter",
+    [
+        RandomProjectivePermuter(),
+        RandomSameSidePermuter(),
+        RandomSameValencyPermuter(),
+        OptimalProjectivePermuter(),
+        FixedOrderPermuter(GRAMMAR),
+    ],
+    ids=lambda permuter: type(permuter).__name__,
+)
+def test_deep_chain_is_permuted_without_recursion(permuter, head_final):
+    # A chain deeper than the recursion limit, each token the head of the next
+    n_tokens = 5000
+    heads = [0] + list(range(1, n_tokens))
+    deprels = ["root"] + [("obj", "nsubj")[i % 2] for i in range(1, n_tokens)]
+    forms = [str(i) for i in range(n_tokens)]
+    sentence = CompactSentence.from_strings(heads, deprels, forms=forms)
+    if head_final:
+        sentence = sentence.reorder(range(n_tokens, 0, -1))
+
+    tree = HeadTree.from_sentence(sentence)
+    assert len(tree.breadth_first_nodes()) == n_tokens + 1
+    assert tree.weight(tree.root()) == n_tokens
+
+    permuted = permuter.process_sentence(sentence)
+    assert _edges(permuted) == _edges(sentence)
+
+    tokenlist = sentence.to_tokenlist()
+    permuted = permuter.process_sentence(tokenlist)
+    assert _edges(permuted) == _edges(tokenlist)
+
+
+def test_deep_chain_lengths():
+    n_tokens = 5000
+    heads = [0] + list(range(1, n_tokens))
+    assert optimal_dependency_length(heads) == n_tokens - 1
+
+    # Between the adjacent and the fully nested arrangement of the chain
+    mean, variance = random_projective_dependency_length_moments(heads)
+    assert n_tokens - 1 < mean < n_tokens * (n_tokens - 1) / 2
+    assert variance > 0
+
+
+def _naive_subtree_weight(heads, node):
+    """Counts the node and every token whose chain of heads reaches it"""
+    weight = 0
+    for token in range(1, len(heads) + 1):
+        ancestor = token
+        while ancestor not in (0, node) and 0 < ancestor <= len(heads):
+            ancestor = heads[ancestor - 1]
+        weight += ancestor == node
+    return weight
+
+
+def test_subtree_weights_match_naive_counts():
+    trees = [sentence.heads.tolist() for sentence in SENTENCES] + list(_small_trees(max_nodes=5))
+    for heads in trees:
+        tree = HeadTree.from_heads(heads)
+        weights = tree.subtree_weights()
+        assert weights[0] == len(heads) + 1
+        assert weights[1:] == [
+            _naive_subtree_weight(heads, node) for node in range(1, len(heads) + 1)
+        ]
+        assert [tree.weight(node) for node in range(len(heads) + 1)] == weights
+
+    # Tokens whose head is not in the sentence are not reachable, so the root does not count them
+    tree = HeadTree.from_heads([0, 1, 7, 3])
+    assert tree.breadth_first_nodes() == [0, 1, 2]
+    assert tree.subtree_weights()[:3] == [3, 2, 1]
+
+
+def test_optimal_order_sorts_dependants_by_weight():
+    # The root has dependants of weights 1, 3 and 2, which must be ordered by weight
+    heads = [2, 0, 2, 3, 3, 2, 6]
+    tree = HeadTree.from_heads(heads)
+    assert [tree.weight(node) for node in tree.children(2)] == [1, 3, 2]
+
+    order = OptimalProjectivePermuter().permutation_order(tree)
+    assert sorted(order) == list(range(1, 8))
+    assert _dependency_length(heads, order) == optimal_dependency_length(heads)
+
+
+def _small_trees(max_nodes=6):
+    """Head arrays of every tree shape of up to max_nodes tokens, with one or several roots"""
+    random.seed(0)
+    for n in range(1, max_nodes + 1):
+        for heads in itertools.product(*(range(i) for i in range(1, n + 1))):
+            # Shuffle the token positions, so that heads are not always before their dependants
+            positions = random.sample(range(1, n + 1), n)
+            shuffled = [0] * n
+            for node, head in enumerate(heads):
+                shuffled[positions[node] - 1] = positions[head - 1] if head else 0
+            yield shuffled
+
+
+def _projective_orders(children, node):
+    """Every linear order of the subtree of the node in which each subtree is contiguous"""
+    blocks = [[[node]]] + [list(_projective_orders(children, child)) for child in children[node]]
+    for branches in itertools.product(*blocks):
+        for arrangement in itertools.permutations(branches):
+            yield [node for branch in arrangement for node in branch]
+
+
+def _dependency_length(heads, order, count_root=False):
+    positions = {node: i for i, node in enumerate(order, 1)}
+    return sum(
+        abs(positions[node] - positions[head]) if head != 0 else positions[node]
+        for node, head in enumerate(heads, 1)
+        if head != 0 or count_root
+    )
+
+
+def test_optimal_dependency_length_is_minimum():
+    for heads in _small_trees():
+        children = defaultdict(list)
+        for node, head in enumerate(heads, 1):
+            children[head].append(node)
+        minimum = min(
+            _dependency_length(heads, [node for node in order if node != 0])
+            for order in _projective_orders(children, 0)
+        )
+
+        assert optimal_dependency_length(heads) == minimum
+        assert sum(map(abs, optimal_dependency_lengths(heads))) == minimum
+
+
+def _random_projective_orders(children, node):
+    """Probabilities of the linear orders of the subtree of the node under RandomProjective permutation"""
+    branches = [_random_projective_orders(children, child) for child in children[node]]
+    orders = defaultdict(Fraction)
+    for sides in itertools.product([True, False], repeat=len(branches)):
+        left = [branch for branch, is_left in zip(branches, sides) if is_left]
+        right = [branch for branch, is_left in zip(branches, sides) if not is_left]
+        probability = Fraction(
+            1, 2 ** len(branches) * math.factorial(len(left)) * math.factorial(len(right))
+        )
+        for left_order in itertools.permutations(left):
+            for right_order in itertools.permutations(right):
+                arranged = [*left_order, {(node,): Fraction(1)}, *right_order]
+                for outcome in itertools.product(*(branch.items() for branch in arranged)):
+                    order = tuple(node for branch, _ in outcome for node in branch)
+                    orders[order] += probability * math.prod(p for _, p in outcome)
+    return orders
+
+
+@pytest.mark.parametrize("count_root", [False, True])
+def test_random_projective_moments_match_enumeration(count_root):
+    for heads in _small_trees(max_nodes=5):
+        children = defaultdict(list)
+        for node, head in enumerate(heads, 1):
+            children[head].append(node)
+        orders = _random_projective_orders(children, 0)
+        assert sum(orders.values()) == 1
+
+        lengths = {
+            order: _dependency_length(heads, [node for node in order if node != 0], count_root)
+            for order in orders
+        }
+        mean = sum(p * lengths[order] for order, p in orders.items())
+        variance = sum(p * (lengths[order] - mean) ** 2 for order, p in orders.items())
+
+        assert random_projective_dependency_length_moments(
+            heads, count_root=count_root
+        ) == pytest.approx((float(mean), float(variance)))
@@ -0,0 +1,159 @@
+from pathlib import Path
+
+import pytest
+
+from src.compact_sentence import CompactSentence
+from src.load_treebank import TreebankLoader
+from src.sentence_selector import SentenceSelector, MultiQuerySelector
+from src.utils.recursive_query import make_query_from_dict
+from src.utils import sentence_selector_functions
+from src.utils.sentence_selector_functions import compile_query, sentence_recursive_match
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def treebank():
+    return TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))
+
+
+def test_compact_selection_matches_tokenlist_selection(treebank):
+    query = {"upos": "NOUN", "dependants": [{"deprel": "amod"}]}
+    selector = SentenceSelector(query)
+    expected = [len(selector.process_sentence(sentence)) > 0 for sentence in treebank]
+
+    compact = [CompactSentence.from_tokenlist(sentence) for sentence in treebank]
+    assert [len(selector.process_sentence(sentence)) > 0 for sentence in compact] == expected
+    assert expected == [False, True, False]
+
+
+QUERIES = [
+    ({"upos": "NOUN", "head": {"upos": "VERB"}}, [True, True, True]),
+    ({"deprel": "root", "dependants": [{"deprel": "nsubj"}]}, [False, True, True]),
+    ({"upos": "NOUN", "dependants": [{"upos": "ADJ", "n_required": 2}]}, [False, True, False]),
+    (
+        {"upos": "NOUN", "dependants": [{"upos": "ADJ", "n_required": 0}, {"upos": "DET"}]},
+        [True, False, True],
+    ),
+    ({"upos": "NOUN", "dependants": [{"upos": "ADP", "n_required": "?"}]}, [True, True, True]),
+    ({"deprel": "obl", "direction": 1}, [True, False, False]),
+    ({"deprel": "nsubj", "direction": 1}, [False, False, False]),
+    ({"deprel": "nsubj", "direction": -1}, [False, True, True]),
+    ({"deprel": "root", "head": {"n_required": 0}}, [True, True, True]),
+    ({"form": "dog", "head": {"deprel": "root", "n_required": 1}}, [False, True, True]),
+    ({"upos": "DET", "head": {"form": "fox"}}, [False, True, False]),
+]
+
+
+@pytest.mark.parametrize("query, expected", QUERIES)
+def test_query_selects_sentences(treebank, query, expected):
+    selector = SentenceSelector(query)
+    assert [len(selector.process_sentence(sentence)) > 0 for sentence in treebank] == expected
+
+    compact = [CompactSentence.from_tokenlist(sentence) for sentence in treebank]
+    assert [len(selector.process_sentence(sentence)) > 0 for sentence in compact] == expected
+
+
+def test_recursive_match_returns_matched_tokens(treebank):
+    query = make_query_from_dict(
+        {"upos": "NOUN", "dependants": [{"upos": "ADJ", "n_required": "+"}]}
+    )
+
+    assert [token["form"] for token in sentence_recursive_match(query, treebank[1])] == [
+        "fox", "quick", "brown", "dog", "lazy"
+    ]
+    assert sentence_recursive_match(query, treebank[2]) == []
+
+
+def _bushy_sentence(n_tokens):
+    # Every token has up to three children, with labels cycling through their positions
+    heads = [0] + [i // 3 + 1 for i in range(1, n_tokens)]
+    deprels = ["root"] + [("nsubj", "obj", "amod")[i % 3] for i in range(1, n_tokens)]
+    upos = [("NOUN", "VERB", "ADJ", "DET")[i % 4] for i in range(n_tokens)]
+    forms = [str(i) for i in range(n_tokens)]
+    return CompactSentence.from_strings(heads, deprels, upos, forms).to_tokenlist()
+
+
+NESTED_QUERIES = [
+    {
+        "upos": "NOUN",
+        "dependants": [{"n_required": "+", "head": {"dependants": [{"upos": "ADJ"}]}}],
+    },
+    {
+        "upos": "VERB",
+        "dependants": [
+            {
+                "n_required": "+",
+                "dependants": [{"n_required": "+", "head": {"head": {"deprel": "obj"}}}],
+            }
+        ],
+    },
+    {
+        "dependants": [
+            {"deprel": "obj", "dependants": [{"deprel": "amod", "n_required": "*"}]},
+            {"head": {"upos": "ADJ", "n_required": "?"}, "n_required": [0, 2]},
+        ]
+    },
+]
+
+
+@pytest.mark.parametrize("query", NESTED_QUERIES)
+def test_memoised_matching_matches_each_pair_once(monkeypatch, query):
+    sentence = _bushy_sentence(40)
+    compiled = compile_query(make_query_from_dict(query))
+    matched = [token["id"] for token in sentence_recursive_match(compiled, sentence)]
+    assert matched
+
+    calls = []
+    match_token = sentence_selector_functions._match_token
+
+    def counting_match_token(index, query, token):
+        calls.append((id(query), token["id"]))
+        return match_token(index, query, token)
+
+    monkeypatch.setattr(sentence_selector_functions, "_match_token", counting_match_token)
+    assert [token["id"] for token in sentence_recursive_match(compiled, sentence)] == matched
+    assert len(calls) == len(set(calls))
+
+    # Without the memo every path re-evaluates its pairs, but finds the same tokens
+    calls.clear()
+    monkeypatch.setattr(sentence_selector_functions, "_token_recursive_match", counting_match_token)
+    assert [token["id"] for token in sentence_recursive_match(compiled, sentence)] == matched
+    assert len(calls) > len(set(calls))
+
+
+def test_query_batch_matches_each_query_alone(treebank):
+    queries = [query for query, _ in QUERIES]
+    batch_selector = MultiQuerySelector(queries)
+    assert batch_selector.names == [f"query_{i}" for i in range(len(queries))]
+
+    for i, sentence in enumerate(treebank):
+        expected = [j for j, (_, matches) in enumerate(QUERIES) if matches[i]]
+        assert batch_selector.matching_queries(sentence) == expected
+        assert batch_selector.matching_queries(CompactSentence.from_tokenlist(sentence)) == expected
+
+
+def test_query_batch_names():
+    batch_selector = MultiQuerySelector([{"name": "nouns", "upos": "NOUN"}, {"deprel": "root"}])
+    assert batch_selector.names == ["nouns", "query_1"]
+
+    with pytest.raises(ValueError):
+        MultiQuerySelector([{"name": "a", "upos": "NOUN"}, {"name": "a", "deprel": "root"}])
+
+
+@pytest.mark.parametrize(
+    "query, compact_options",
+    [
+        ({"lemma": "dog"}, {}),
+        ({"xpos": "NN"}, {}),
+        ({"upos": "NOUN"}, {"upos": False}),
+        ({"deprel": "nsubj", "head": {"form": "barks"}}, {"forms": False}),
+    ],
+)
+def test_query_on_fields_not_held_by_compact_sentence(treebank, query, compact_options):
+    sentence = CompactSentence.from_tokenlist(treebank[2], **compact_options)
+
+    with pytest.raises(ValueError, match="query uses field"):
+        SentenceSelector(query).process_sentence(sentence)
+    with pytest.raises(ValueError, match="query uses field"):
+        MultiQuerySelector([query]).matching_queries(sentence)
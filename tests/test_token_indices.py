@@ -0,0 +1,79 @@
+import copy
+from pathlib import Path
+
+import numpy as np
+import pytest
+from conllu import TokenList
+
+from src.compact_sentence import MISSING_HEAD, CompactSentence
+from src.load_treebank import TreebankLoader
+from src.utils.decorators import _fix_token_indices
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def sentence():
+    # The quick brown fox jumps over the lazy dog .
+    return TreebankLoader().load_treebank(Path(DATA_DIR, "small.conllu"))[1]
+
+
+def _naive_fix_token_indices(tokenlist):
+    new_ids = {token["id"]: new_id for new_id, token in enumerate(tokenlist, start=1)}
+    for token in tokenlist:
+        token["id"] = new_ids[token["id"]]
+        if token["head"] is not None:
+            token["head"] = new_ids.get(token["head"], 0)
+    return tokenlist
+
+
+def _take(sentence, order):
+    # Deep copies of the tokens with the given ids, in the given order
+    return TokenList([copy.deepcopy(sentence.filter(id=token_id)[0]) for token_id in order])
+
+
+def _ids_and_heads(tokenlist):
+    return [(token["id"], token["head"]) for token in tokenlist]
+
+
+@pytest.mark.parametrize(
+    "order",
+    [
+        [1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+        [10, 9, 8, 7, 6, 5, 4, 3, 2, 1],
+        [1, 2, 3, 4, 5, 6, 7, 8, 10],  # The head of 6-8 is removed
+        [4, 5, 9, 7],
+        [5],
+    ],
+)
+def test_fix_token_indices_matches_dict_remapping(sentence, order):
+    sentence[4]["head"] = None
+    result = _fix_token_indices(_take(sentence, order))
+    expected = _naive_fix_token_indices(_take(sentence, order))
+
+    assert _ids_and_heads(result) == _ids_and_heads(expected)
+    assert [token["form"] for token in result] == [token["form"] for token in expected]
+    if 9 not in order:
+        assert all(token["head"] == 0 for token in result if token["form"] in ("over", "lazy"))
+
+
+def test_compact_select_and_reorder_match_token_lists(sentence):
+    compact = CompactSentence.from_tokenlist(sentence)
+    keep = np.array([True, True, False, True, True, True, False, True, True, False])
+    kept_ids = [token_id for token_id, kept in zip(range(1, 11), keep) if kept]
+
+    selected = _naive_fix_token_indices(_take(sentence, kept_ids))
+    assert compact.select(keep).heads.tolist() == [token["head"] for token in selected]
+
+    order = [9, 8, 7, 6, 5, 4, 3, 2, 1, 10]
+    reordered = _naive_fix_token_indices(_take(sentence, order))
+    result = compact.reorder(order)
+    assert result.heads.tolist() == [token["head"] for token in reordered]
+    assert result.form_strings() == [token["form"] for token in reordered]
+
+
+def test_compact_missing_heads_stay_missing():
+    compact = CompactSentence.from_strings([2, MISSING_HEAD, 2], ["det", "root", "punct"])
+
+    assert compact.reorder([3, 2, 1]).heads.tolist() == [2, MISSING_HEAD, 2]
+    assert compact.select(np.array([False, True, True])).heads.tolist() == [MISSING_HEAD, 1]
@@ -0,0 +1,57 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from src.load_treebank import TreebankLoader
+from src.sentence_cleaner import SentenceCleaner
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+@pytest.fixture
+def treebank(tmp_path):
+    infile = Path(tmp_path, "treebank.conllu")
+    shutil.copy(Path(DATA_DIR, "small.conllu"), infile)
+    return infile
+
+
+def _serialize(sentences):
+    return [sentence.serialize() for sentence in sentences]
+
+
+def _entries(cache_dir):
+    return sorted(path.name for path in Path(cache_dir).iterdir())
+
+
+def test_warm_load_matches_cold_load(tmp_path, treebank, monkeypatch):
+    cache_dir = Path(tmp_path, "cache")
+    expected = _serialize(TreebankLoader().load_treebank(treebank))
+
+    cold = TreebankLoader(cache_dir=cache_dir).load_treebank(treebank)
+    assert _serialize(cold) == expected
+    assert len(_entries(cache_dir)) == 1
+
+    # A warm load reads the entry without parsing the treebank
+    loader = TreebankLoader(cache_dir=cache_dir)
+    monkeypatch.setattr(loader, "_iter_parse_treebank", None)
+    assert _serialize(loader.load_treebank(treebank)) == expected
+
+
+def test_cache_entries_follow_file_and_config(tmp_path, treebank):
+    cache_dir = Path(tmp_path, "cache")
+    TreebankLoader(cache_dir=cache_dir).load_treebank(treebank)
+    entries = _entries(cache_dir)
+
+    # Another cleaner gives a new entry, with its own sentences
+    cleaner = SentenceCleaner(remove_config=[{"upos": "PUNCT"}])
+    cleaned = TreebankLoader(cleaner=cleaner, cache_dir=cache_dir).load_treebank(treebank)
+    assert len(_entries(cache_dir)) == len(entries) + 1
+    assert [len(sentence) for sentence in cleaned] == [5, 9, 3]
+
+    # A changed file is not served from the entry of its old contents
+    text = treebank.read_text(encoding="utf-8")
+    treebank.write_text(text.replace("\tmar\t", "\tsea\t", 1), encoding="utf-8")
+    reloaded = TreebankLoader(cache_dir=cache_dir).load_treebank(treebank)
+    assert len(_entries(cache_dir)) == len(entries) + 2
+    assert reloaded[0].filter(id=5)[0]["form"] == "sea"